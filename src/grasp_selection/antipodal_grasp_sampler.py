@@ -11,16 +11,14 @@ import numpy as np
 import random
 import time
 
-import openravepy as rave
-
 import contacts
 import experiment_config as ec
 import grasp
 import graspable_object
 from grasp import ParallelJawPtGrasp3D
 import grasp_sampler as gs
+import instrumentation as inst
 import obj_file
-import pr2_grasp_checker as pgc
 import quality as pgq
 import sdf_file
 
@@ -51,7 +49,57 @@ class AntipodalGraspParams:
         self.rho1 = rho1
         self.rho2 = rho2
 
+def _tangent_bases(directions):
+    """
+    Returns two unit vectors spanning the plane orthogonal to each direction
+    Params:
+        directions: numpy N x 3 array of unit vectors
+    Returns:
+        numpy N x 3 arrays t1, t2
+    """
+    # cross with the coordinate axis least aligned with each direction
+    axes = np.zeros(directions.shape)
+    axes[np.arange(directions.shape[0]), np.argmin(np.abs(directions), axis=1)] = 1
+    t1 = np.cross(directions, axes)
+    t1 = t1 / np.linalg.norm(t1, axis=1)[:,np.newaxis]
+    t2 = np.cross(directions, t1)
+    return t1, t2
+
+def _first_quadratic_root(a, b, c, max_t=10):
+    """
+    Elementwise version of the root selection in sdf.find_zero_crossing_quadratic for a t^2 + b t + c: the
+    smallest real root in [0, max_t], falling back to the vertex of the parabola
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        disc = b**2 - 4 * a * c
+        sqrt_disc = np.sqrt(np.maximum(disc, 0))
+        r1 = (-b - sqrt_disc) / (2 * a)
+        r2 = (-b + sqrt_disc) / (2 * a)
+        r_lo = np.minimum(r1, r2)
+        r_hi = np.maximum(r1, r2)
+        real = disc >= 0
+
+        t = -b / (2 * a)
+        t = np.where(real & (r_hi >= 0) & (r_hi <= max_t), r_hi, t)
+        t = np.where(real & (r_lo >= 0) & (r_lo <= max_t), r_lo, t)
+
+        # degenerate to a line
+        t_lin = -c / b
+        t_lin = np.where((t_lin >= 0) & (t_lin <= max_t), t_lin, np.nan)
+        t = np.where(a == 0, t_lin, t)
+    return t
+
 class AntipodalGraspSampler(gs.ExactGraspSampler):
+    # whether to sample all surface points at once or one contact at a time (used for visualization)
+    use_batch = True
+
+    def _configure(self, config):
+        """Configures the grasp generator."""
+        gs.ExactGraspSampler._configure(self, config)
+        self.max_surface_points = None
+        if 'max_surface_points' in config and config['max_surface_points'] is not None:
+            self.max_surface_points = config['max_surface_points']
+
     def sample_from_cone(self, cone, num_samples=1):
         """
         Samples points from within the cone.
@@ -91,22 +139,213 @@ class AntipodalGraspSampler(gs.ExactGraspSampler):
         x_samp = x + (scale / 2.0) * (np.random.rand(3) - 0.5)
         return x_samp
 
-    def _generate_grasps(self, graspable, num_grasps,
-                         check_collisions=False, vis=False):
-        """Returns a list of candidate grasps for graspable object.
+    def friction_cones(self, in_normals):
+        """
+        Batched version of Contact3D.friction_cone without the slip check
+        Params:
+            in_normals - numpy N x 3 array of inward pointing unit normals
+        Returns:
+            cones - numpy N x 3 x num_cone_faces array of cone supports
+        """
+        t1, t2 = _tangent_bases(in_normals)
+        angles = 2 * np.pi * np.arange(self.num_cone_faces) / float(self.num_cone_faces)
+        tan_vecs = t1[:,:,np.newaxis] * np.cos(angles) + t2[:,:,np.newaxis] * np.sin(angles)
+        return in_normals[:,:,np.newaxis] + self.friction_coef * tan_vecs
+
+    def sample_from_cones(self, cones):
+        """
+        Samples one direction from within each cone using a single Dirichlet draw.
+        Params:
+            cones - numpy N x 3 x num_cone_faces array of cone supports
+        Returns:
+            v_samples - numpy N x 3 array of directions
+        """
+        lambdas = np.random.dirichlet(self.dir_prior * np.ones(cones.shape[2]), size=cones.shape[0])
+        return np.sum(cones * lambdas[:,np.newaxis,:], axis=2)
+
+    def within_cones(self, cones, n, v):
+        """
+        Batched version of within_cone.
+        Params:
+            cones - numpy N x 3 x num_cone_faces array of cone supports
+            n - numpy N x 3 array of outward pointing normals
+            v - numpy N x 3 array of direction vectors between contacts
+        Returns:
+            in_cone - numpy N bool array, True if alpha is within the cone
+            alpha - numpy N array of angles between the normals and v
+        """
+        in_cone = (np.sum(cones * v[:,:,np.newaxis], axis=1) >= 0).all(axis=1)
+        f = -n / np.linalg.norm(n, axis=1)[:,np.newaxis]
+        cos_alpha = np.sum(f * v, axis=1) / np.linalg.norm(v, axis=1)
+        alpha = np.arccos(np.clip(cos_alpha, -1, 1))
+        return in_cone & (alpha <= np.arctan(self.friction_coef)), alpha
+
+    def _surface_normals(self, sdf, pts_grid, in_directions=None):
+        """
+        Batched version of Contact3D._compute_normal: principal direction of the sdf hessian
+        Params:
+            sdf - the Sdf3D to compute normals on
+            pts_grid - numpy N x 3 array of points in grid coords
+            in_directions - numpy N x 3 array of inward facing directions, normals are flipped to oppose them
+        Returns:
+            numpy N x 3 array of normals in obj coords
+        """
+        U, _, _ = np.linalg.svd(sdf.interpolate_curvature(pts_grid))
+        normals = U[:,:,0]
+        if in_directions is not None:
+            flip = np.sum(in_directions * normals, axis=1) > 0
+            normals[flip,:] = -normals[flip,:]
+        return sdf.transform_pt_grid_to_obj(normals.T, direction=True).T.reshape(-1, 3)
+
+    def _march_contacts(self, sdf, starts, axes, ts):
+        """
+        Batched version of ParallelJawPtGrasp3D.find_contact: steps along many lines of action at once
+        Params:
+            sdf - the Sdf3D to find contacts on
+            starts - numpy N x 3 array of line start points in grid coords
+            axes - numpy N x 3 array of unit line directions in grid coords
+            ts - numpy array of distances along each line to check
+        Returns:
+            found - numpy N bool array, True where a contact was found
+            contacts - numpy N x 3 array of contact points in grid coords (only valid where found)
+        """
+        num_lines = starts.shape[0]
+        num_steps = ts.shape[0]
+        pts = starts[:,np.newaxis,:] + ts[np.newaxis,:,np.newaxis] * axes[:,np.newaxis,:]
+        sd = sdf.interpolate(pts.reshape(-1, 3)).reshape(num_lines, num_steps)
+
+        # candidates are on the surface and the sdf does not shrink further at the next step
+        abs_sd = np.abs(sd)
+        candidates = abs_sd < sdf.surface_thresh
+        candidates[:,:-1] &= abs_sd[:,1:] >= abs_sd[:,:-1]
+
+        # quadratic fit to the zero crossing around each step, relative to the first of three points
+        j = np.clip(np.arange(num_steps), 1, num_steps - 2)
+        y0, y1, y2 = sd[:,j-1], sd[:,j], sd[:,j+1]
+        h = ts[1] - ts[0]
+        a = (y0 - 2 * y1 + y2) / (2 * h**2)
+        b = (4 * y1 - 3 * y0 - y2) / (2 * h)
+        t_zc = _first_quadratic_root(a, b, y0)
+        with np.errstate(invalid='ignore'):
+            candidates &= np.abs(t_zc) <= 1.0
+
+        # take the first valid contact on each line
+        found = candidates.any(axis=1)
+        k = np.argmax(candidates, axis=1)
+        t_contact = ts[j[k] - 1] + t_zc[np.arange(num_lines), k]
+        t_contact[~found] = 0
+        return found, starts + t_contact[:,np.newaxis] * axes
+
+    def _sample_antipodal_grasps_batch(self, graspable, backup=0.5):
+        """
+        Samples antipodal grasp candidates for all surface points at once.
         Params:
             graspable - (GraspableObject3D) the object to grasp
-            num_grasps - currently unused TODO
+            backup - distance in grid cells to back up from each contact when searching for the surface
         Returns:
-            list of ParallelJawPtGrasp3D objects
+            list of AntipodalGraspParams
+        """
+        sdf = graspable.sdf
+        to_grid = lambda x, direction=False: sdf.transform_pt_obj_to_grid(x.T, direction=direction).T.reshape(-1, 3)
+        to_obj = lambda x, direction=False: sdf.transform_pt_grid_to_obj(x.T, direction=direction).T.reshape(-1, 3)
+        start_time = time.clock()
+
+        # subsample surface points and perturb each num_samples times (TODO: sample in tangent plane to surface)
+        surface_points, _ = sdf.surface_points(grid_basis=False)
+        if self.max_surface_points is not None and surface_points.shape[0] > self.max_surface_points:
+            indices = np.random.choice(surface_points.shape[0], self.max_surface_points, replace=False)
+            surface_points = surface_points[indices,:]
+        x1 = np.repeat(surface_points, self.num_samples, axis=0)
+        x1 = x1 + (sdf.resolution / 2.0) * (np.random.rand(x1.shape[0], 3) - 0.5)
+        if x1.shape[0] == 0:
+            return []
+
+        # compute normals and friction cones at contact 1
+        x1_grid = to_grid(x1)
+        on_surface = np.abs(sdf.interpolate(x1_grid)) < sdf.surface_thresh
+        x1 = x1[on_surface,:]
+        x1_grid = x1_grid[on_surface,:]
+        n1 = self._surface_normals(sdf, x1_grid)
+        cone1 = self.friction_cones(-n1)
+        cone_time = time.clock()
+
+        # sample grasp axes from friction cones
+        v = self.sample_from_cones(cone1)
+        v = v / np.linalg.norm(v, axis=1)[:,np.newaxis]
+        sample_time = time.clock()
+
+        # march along the grasp axes from both ends to find the contacts
+        axis_grid = to_grid(v, direction=True)
+        width_grid = sdf.transform_pt_obj_to_grid(self.grasp_width)
+        num_steps = max(int(2 * width_grid), 3)
+        ts = np.linspace(0, width_grid, num=num_steps)
+        start1 = x1_grid - backup * axis_grid
+        start2 = start1 + (width_grid - backup) * axis_grid
+        found1, c1_grid = self._march_contacts(sdf, start1, axis_grid, ts)
+        found2, c2_grid = self._march_contacts(sdf, start2, -axis_grid, ts)
+        found = found1 & found2
+        found[found] = np.abs(sdf.interpolate(c2_grid[found,:])) < sdf.surface_thresh
+        march_time = time.clock()
+
+        # make sure grasps are wide enough
+        c1 = to_obj(c1_grid[found,:])
+        c2 = to_obj(c2_grid[found,:])
+        wide = np.linalg.norm(x1[found,:] - c2, axis=1) >= self.min_contact_dist
+        c1, c2 = c1[wide,:], c2[wide,:]
+        valid = np.nonzero(found)[0][wide]
+        n1, cone1, v = n1[valid,:], cone1[valid,:,:], v[valid,:]
+        c2_grid = c2_grid[valid,:]
+
+        # compute friction cones for contact 2, which is approached along -v
+        v_true = c2 - c1
+        v_true = v_true / np.linalg.norm(v_true, axis=1)[:,np.newaxis]
+        n2 = self._surface_normals(sdf, c2_grid, in_directions=-v)
+        cone2 = self.friction_cones(-n2)
+
+        # check that contact 2 would not slip
+        normal_force_mag = np.maximum(np.sum(v * n2, axis=1), 0)
+        tan_force_mag = np.sqrt(np.maximum(1 - np.sum(v * n2, axis=1)**2, 0))
+        no_slip = self.friction_coef * normal_force_mag >= tan_force_mag
+
+        # check friction cones
+        in_cone1, alpha1 = self.within_cones(cone1, n1, v_true)
+        in_cone2, alpha2 = self.within_cones(cone2, n2, -v_true)
+        antipodal = np.nonzero(no_slip & in_cone1 & in_cone2)[0]
+        within_cone_time = time.clock()
+
+        # get moment arms
+        grasp_centers = (c1 + c2) / 2
+        x1_world = grasp_centers - (self.grasp_width / 2.0) * v_true
+        x2_world = grasp_centers + (self.grasp_width / 2.0) * v_true
+        rho1 = np.linalg.norm(graspable.moment_arm(x1_world), axis=1)
+        rho2 = np.linalg.norm(graspable.moment_arm(x2_world), axis=1)
+
+        ap_grasps = []
+        for i in antipodal:
+            grasp = ParallelJawPtGrasp3D(grasp_centers[i,:], v_true[i,:], self.grasp_width, 0, grasp_angle=0, tf=graspable.tf)
+            ap_grasps.append(AntipodalGraspParams(graspable, grasp, alpha1[i], alpha2[i], rho1[i], rho2[i]))
+        end_time = time.clock()
+
+        logging.debug('Antipodal: Time to compute %d friction cones: %f' %(x1.shape[0], cone_time - start_time))
+        logging.debug('Antipodal: Time to sample grasp axes: %f' %(sample_time - cone_time))
+        logging.debug('Antipodal: Time to find contacts: %f' %(march_time - sample_time))
+        logging.debug('Antipodal: Time to check friction cones: %f' %(within_cone_time - march_time))
+        logging.debug('Antipodal: Time to create %d grasps: %f' %(len(ap_grasps), end_time - within_cone_time))
+        return ap_grasps
+
+    def _sample_antipodal_grasps(self, graspable, vis=False):
+        """
+        Samples antipodal grasp candidates one contact at a time.
+        Params:
+            graspable - (GraspableObject3D) the object to grasp
+        Returns:
+            list of AntipodalGraspParams
         """
         # get surface points
         ap_grasps = []
         surface_points, _ = graspable.sdf.surface_points(grid_basis=False)
 
         for x_surf in surface_points:
-            start_time = time.clock()
-
             # perturb grasp for num samples
             for i in range(self.num_samples):
                 # perturb contact (TODO: sample in tangent plane to surface)
@@ -117,11 +356,9 @@ class AntipodalGraspSampler(gs.ExactGraspSampler):
                 cone_succeeded, cone1, n1 = c1.friction_cone(self.num_cone_faces, self.friction_coef)
                 if not cone_succeeded:
                     continue
-                cone_time = time.clock()
 
                 # sample grasp axes from friction cone
                 v_samples = self.sample_from_cone(cone1, num_samples=1)
-                sample_time = time.clock()
 
                 for v in v_samples:
                     if vis:
@@ -163,7 +400,6 @@ class AntipodalGraspSampler(gs.ExactGraspSampler):
                     # check friction cone
                     in_cone1, alpha1 = self.within_cone(cone1, n1, v_true.T)
                     in_cone2, alpha2 = self.within_cone(cone2, n2, -v_true.T)
-                    within_cone_time = time.clock()
 
                     # add points if within friction cone
                     if in_cone1 and in_cone2:
@@ -174,16 +410,30 @@ class AntipodalGraspSampler(gs.ExactGraspSampler):
 
                         antipodal_grasp = AntipodalGraspParams(graspable, grasp, alpha1, alpha2, rho1, rho2)
                         ap_grasps.append(antipodal_grasp)
+        return ap_grasps
+
+    def _generate_grasps(self, graspable, num_grasps,
+                         check_collisions=False, vis=False):
+        """Returns a list of candidate grasps for graspable object.
+        Params:
+            graspable - (GraspableObject3D) the object to grasp
+            num_grasps - currently unused TODO
+        Returns:
+            list of ParallelJawPtGrasp3D objects
+        """
+        with inst.timer('antipodal_candidates'):
+            if AntipodalGraspSampler.use_batch and not vis:
+                ap_grasps = self._sample_antipodal_grasps_batch(graspable)
+            else:
+                ap_grasps = self._sample_antipodal_grasps(graspable, vis=vis)
 
         # randomly sample max num grasps from total list
         max_grasp_index = min(len(ap_grasps), self.max_num_grasps)
         random.shuffle(ap_grasps)
         ap_grasps = ap_grasps[:max_grasp_index]
 
-        # load openrave
-        if check_collisions:
-            rave.raveSetDebugLevel(rave.DebugLevel.Error)
-            grasp_checker = pgc.OpenRaveGraspChecker(view=vis)
+        # load collision checker
+        grasp_checker = gs.make_grasp_checker(check_collisions, vis=vis)
 
         # go back through grasps and threshold
         grasps = []
@@ -194,23 +444,27 @@ class AntipodalGraspSampler(gs.ExactGraspSampler):
                 alpha_thresh < np.pi / 2:
             # prune grasps above thresholds
             next_ap_grasps = []
+            candidate_grasps = []
             for ap_grasp in ap_grasps:
                 if max(ap_grasp.alpha1, ap_grasp.alpha2) < alpha_thresh and \
                         max(ap_grasp.rho1, ap_grasp.rho2) < rho_thresh:
-                    # convert grasps to PR2 gripper poses
-                    rotated_grasps = ap_grasp.grasp.transform(graspable.tf, self.theta_res)
-
-                    # prune collision grasps if necessary
-                    if check_collisions:
-                        rotated_grasps = grasp_checker.prune_grasps_in_collision(graspable, rotated_grasps, auto_step=True, delay=0.0)
-
-                    # only add grasp if at least 1 is collision free
-                    if len(rotated_grasps) > 0:
-                        grasps.append(ap_grasp.grasp)
-                        pr2_grasps.extend(rotated_grasps)
+                    candidate_grasps.append(ap_grasp.grasp)
                 else:
                     next_ap_grasps.append(ap_grasp)
 
+            # convert grasps to PR2 gripper poses, pruning collision grasps if necessary
+            with inst.timer('gripper_poses'):
+                if grasp_checker is not None:
+                    rotated_grasps = grasp_checker.collision_free_rotations(graspable, candidate_grasps, self.theta_res)
+                else:
+                    rotated_grasps = [grasp.transform(graspable.tf, self.theta_res) for grasp in candidate_grasps]
+
+            # only add grasp if at least 1 is collision free
+            for grasp, rotations in zip(candidate_grasps, rotated_grasps):
+                if len(rotations) > 0:
+                    grasps.append(grasp)
+                    pr2_grasps.extend(rotations)
+
             # update alpha and rho thresholds
             alpha_thresh = alpha_thresh + self.alpha_inc #np.arctan(friction_coef)
             rho_thresh = rho_thresh + self.rho_inc
@@ -0,0 +1,201 @@
+"""
+Throughput benchmarks for the discrete adaptive samplers on synthetic Bernoulli arms.
+Each sampler and problem size runs in a fresh process so that the peak memory is not shared between runs, and
+the results are written to a json file that can be diffed between commits.
+
+Usage: python src/grasp_selection/bandit_benchmark.py --num_arms 100 1000 10000 --output bandit_benchmark.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import numpy as np
+import platform
+import resource
+import scipy.stats
+import subprocess
+import time
+
+import discrete_adaptive_samplers as das
+import kernels
+import objectives
+
+import IPython
+
+DEF_NUM_ARMS = [100, 1000, 10000, 100000]
+DEF_NUM_PULLS = 1000
+DEF_FEATURE_DIM = 10
+DEF_SNAPSHOT_RATE = 100
+DEF_MAX_CORRELATED_ARMS = 10000 # correlated updates visit every neighbor in python, so larger runs take hours
+DEF_NEIGHBOR_FRACTION = 0.01
+DEF_KERNEL_TOLERANCE = 1e-2
+
+def _phi(rv):
+    return rv.features
+
+def _correlated_args(feature_dim, neighbor_fraction = DEF_NEIGHBOR_FRACTION, tolerance = DEF_KERNEL_TOLERANCE):
+    """
+    Returns the nearest neighbor structure, kernel and tolerance for the correlated samplers. The squared distance
+    between two synthetic arms is 2 chi^2(feature_dim), so the lengthscale is set to make the kernel reach the
+    tolerance at the distance that a neighbor_fraction of the other arms fall within
+    """
+    radius = np.sqrt(2 * scipy.stats.chi2.ppf(neighbor_fraction, feature_dim))
+    l = radius / np.sqrt(2 * np.log(1.0 / tolerance))
+    nn = kernels.KDTree(phi=_phi)
+    kernel = kernels.SquaredExponentialKernel(sigma=1.0, l=l, phi=_phi)
+    return nn, kernel, tolerance
+
+SAMPLERS = {
+    'UniformAllocationMean': lambda obj, cands, dim: das.UniformAllocationMean(obj, cands),
+    'ThompsonSampling': lambda obj, cands, dim: das.ThompsonSampling(obj, cands),
+    'GittinsIndex98': lambda obj, cands, dim: das.GittinsIndex98(obj, cands),
+    'GaussianUniformAllocationMean': lambda obj, cands, dim: das.GaussianUniformAllocationMean(obj, cands),
+    'GaussianThompsonSampling': lambda obj, cands, dim: das.GaussianThompsonSampling(obj, cands),
+    'GaussianUCBSampling': lambda obj, cands, dim: das.GaussianUCBSampling(obj, cands),
+    'CorrelatedThompsonSampling': lambda obj, cands, dim: das.CorrelatedThompsonSampling(obj, cands, *_correlated_args(dim)),
+    'CorrelatedBayesUCB': lambda obj, cands, dim: das.CorrelatedBayesUCB(obj, cands, *_correlated_args(dim)),
+    'CorrelatedGittins': lambda obj, cands, dim: das.CorrelatedGittins(obj, cands, *_correlated_args(dim)),
+}
+
+def synthetic_candidates(num_arms, feature_dim = DEF_FEATURE_DIM, seed = 100):
+    """
+    Creates Bernoulli arms whose success probabilities vary smoothly with random feature vectors, so that the
+    correlated models have structure to exploit
+    Returns:
+        list of das.BernoulliRV with a features attribute
+    """
+    np.random.seed(seed)
+    features = np.random.randn(num_arms, feature_dim)
+    weights = np.random.randn(feature_dim) / np.sqrt(feature_dim)
+    probs = 1.0 / (1.0 + np.exp(-features.dot(weights)))
+
+    candidates = []
+    for p, x in zip(probs, features):
+        rv = das.BernoulliRV(p)
+        rv.features = x
+        candidates.append(rv)
+    return candidates
+
+def benchmark_sampler(sampler_name, num_arms, num_pulls = DEF_NUM_PULLS, feature_dim = DEF_FEATURE_DIM,
+                      snapshot_rate = DEF_SNAPSHOT_RATE, seed = 100):
+    """
+    Runs num_pulls iterations of the select, evaluate, snapshot, update loop of
+    DiscreteAdaptiveSampler.discrete_maximize and times each stage
+    Returns:
+        dict of benchmark results
+    """
+    candidates = synthetic_candidates(num_arms, feature_dim, seed)
+    objective = objectives.RandomBinaryObjective()
+
+    start_time = time.time()
+    sampler = SAMPLERS[sampler_name](objective, candidates, feature_dim)
+    setup_time = time.time() - start_time
+    model = sampler.model_
+    policy = sampler.selection_policy_
+
+    stage_times = {'select': 0.0, 'evaluate': 0.0, 'snapshot': 0.0, 'update': 0.0}
+    loop_start_time = time.time()
+    for k in range(num_pulls):
+        t0 = time.time()
+        next_ind = policy.choose_next()
+        t1 = time.time()
+        next_ind_val = objective.evaluate(candidates[next_ind])
+        t2 = time.time()
+        if k % snapshot_rate == 0:
+            model.snapshot()
+        t3 = time.time()
+        model.update(next_ind, next_ind_val)
+        t4 = time.time()
+
+        stage_times['select'] += t1 - t0
+        stage_times['evaluate'] += t2 - t1
+        stage_times['snapshot'] += t3 - t2
+        stage_times['update'] += t4 - t3
+    loop_time = time.time() - loop_start_time
+
+    return {
+        'sampler': sampler_name,
+        'num_arms': num_arms,
+        'num_pulls': num_pulls,
+        'feature_dim': feature_dim,
+        'snapshot_rate': snapshot_rate,
+        'setup_sec': setup_time,
+        'loop_sec': loop_time,
+        'pulls_per_sec': num_pulls / loop_time,
+        'stage_sec': stage_times,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def _benchmark_worker(queue, args, kwargs):
+    try:
+        queue.put(benchmark_sampler(*args, **kwargs))
+    except Exception as e:
+        queue.put({'sampler': args[0], 'num_arms': args[1], 'error': repr(e)})
+
+def benchmark_sampler_process(*args, **kwargs):
+    """ Runs benchmark_sampler in a fresh process, so the peak memory only reflects that run """
+    queue = mp.Queue()
+    p = mp.Process(target=_benchmark_worker, args=(queue, args, kwargs))
+    p.start()
+    result = queue.get()
+    p.join()
+    return result
+
+def benchmark_metadata():
+    """ Returns the revision, versions and host of a benchmark run, to store alongside its results """
+    try:
+        git_revision = subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_revision = None
+    return {
+        'git_revision': git_revision,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'host': platform.node(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+def run_benchmarks(sampler_names, num_arms_list, num_pulls = DEF_NUM_PULLS, feature_dim = DEF_FEATURE_DIM,
+                   snapshot_rate = DEF_SNAPSHOT_RATE, seed = 100, max_correlated_arms = DEF_MAX_CORRELATED_ARMS):
+    """
+    Benchmarks every sampler on every problem size, skipping correlated samplers with more than max_correlated_arms
+    Returns:
+        dict with the run metadata and a list of results
+    """
+    results = []
+    for num_arms in num_arms_list:
+        for sampler_name in sampler_names:
+            if sampler_name.startswith('Correlated') and num_arms > max_correlated_arms:
+                logging.info('Skipping %s with %d arms' %(sampler_name, num_arms))
+                continue
+            logging.info('Benchmarking %s with %d arms' %(sampler_name, num_arms))
+            result = benchmark_sampler_process(sampler_name, num_arms, num_pulls=num_pulls, feature_dim=feature_dim,
+                                               snapshot_rate=snapshot_rate, seed=seed)
+            if 'error' in result:
+                logging.warning('%s failed with %d arms: %s' %(sampler_name, num_arms, result['error']))
+            else:
+                logging.info('%s: %.1f pulls/sec, peak rss %d kb' %(sampler_name, result['pulls_per_sec'], result['peak_rss_kb']))
+            results.append(result)
+
+    report = benchmark_metadata()
+    report['results'] = results
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samplers', nargs='+', default=sorted(SAMPLERS.keys()))
+    parser.add_argument('--num_arms', nargs='+', type=int, default=DEF_NUM_ARMS)
+    parser.add_argument('--num_pulls', type=int, default=DEF_NUM_PULLS)
+    parser.add_argument('--feature_dim', type=int, default=DEF_FEATURE_DIM)
+    parser.add_argument('--snapshot_rate', type=int, default=DEF_SNAPSHOT_RATE)
+    parser.add_argument('--max_correlated_arms', type=int, default=DEF_MAX_CORRELATED_ARMS)
+    parser.add_argument('--seed', type=int, default=100)
+    parser.add_argument('--output', default='bandit_benchmark.json')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    report = run_benchmarks(args.samplers, args.num_arms, args.num_pulls, args.feature_dim,
+                            args.snapshot_rate, args.seed, args.max_correlated_arms)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    logging.info('Wrote benchmark results to %s' %(args.output))
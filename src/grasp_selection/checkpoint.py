@@ -0,0 +1,193 @@
+"""
+Checkpointing for long labelling and bandit experiments.
+Each run keeps a directory with the keys of finished objects and one pickle of partial state per unfinished unit of
+work (an object, a trial or a single bandit run). Files are written to a temporary file and renamed into place, so a
+preempted node never leaves a truncated checkpoint behind. Random states are saved with the partial state so resumed
+runs continue with identical random streams. Partial states use the .ckpt extension rather than .pkl, so result
+compilation never picks them up even when the checkpoints live inside the result directory.
+"""
+import logging
+import os
+import pickle as pkl
+import random
+
+import numpy as np
+
+CHECKPOINT_DIRNAME = 'checkpoints'
+COMPLETED_FILENAME = 'completed_keys.txt'
+CHECKPOINT_EXT = '.ckpt'
+DEF_INTERVAL = 1000
+
+def save_atomic(obj, filename):
+    """ Pickles obj to a temporary file next to filename and renames it into place """
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        pkl.dump(obj, f, protocol=pkl.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_filename, filename)
+
+def load(filename):
+    """ Returns the object pickled in filename, or None if there is no usable checkpoint """
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            return pkl.load(f)
+    except (IOError, EOFError, pkl.UnpicklingError) as e:
+        logging.warning('Ignoring unreadable checkpoint %s: %s' %(filename, str(e)))
+        return None
+
+def random_state():
+    """ Returns the state of the global numpy and python random number generators """
+    return {'numpy': np.random.get_state(), 'python': random.getstate()}
+
+def set_random_state(state):
+    """ Restores the global random number generators from a state returned by random_state """
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+
+def sample_counts(candidates):
+    """ Returns the position of each candidate in its stream of preallocated samples, or None if it has no stream """
+    return [getattr(c, 'sample_count_', None) for c in candidates]
+
+def set_sample_counts(candidates, counts):
+    """ Restores sample stream positions returned by sample_counts """
+    for candidate, count in zip(candidates, counts):
+        if count is not None:
+            candidate.sample_count_ = count
+
+class Checkpointer(object):
+    """
+    Tracks completed keys and partial states for a run in checkpoint_dir
+    Params:
+        checkpoint_dir: (string) directory for the checkpoint files, created if it does not exist
+        interval: (int) number of bandit pulls between checkpoints of an in-progress bandit run
+        resume: (bool) whether to pick up completed keys and partial states left by a previous run
+    """
+    def __init__(self, checkpoint_dir, interval = DEF_INTERVAL, resume = True):
+        self.checkpoint_dir_ = checkpoint_dir
+        self.interval_ = interval
+        self.resume_ = resume
+        if not os.path.exists(self.checkpoint_dir_):
+            os.makedirs(self.checkpoint_dir_)
+
+        self.completed_keys_ = []
+        completed_filename = os.path.join(self.checkpoint_dir_, COMPLETED_FILENAME)
+        if self.resume_ and os.path.exists(completed_filename):
+            with open(completed_filename, 'r') as f:
+                self.completed_keys_ = [line.strip() for line in f if line.strip()]
+            logging.info('Resuming with %d completed keys' %(len(self.completed_keys_)))
+
+    @staticmethod
+    def from_config(config, out_dir):
+        """
+        Creates a checkpointer from the checkpoint config keys, or returns None if checkpointing is off.
+        Checkpoints go to checkpoint_dir if specified and out_dir/checkpoints otherwise
+        """
+        if 'checkpoint' not in config or not config['checkpoint']:
+            return None
+        checkpoint_dir = os.path.join(out_dir, CHECKPOINT_DIRNAME)
+        if 'checkpoint_dir' in config and config['checkpoint_dir'] is not None:
+            checkpoint_dir = config['checkpoint_dir']
+        interval = DEF_INTERVAL
+        if 'checkpoint_interval' in config and config['checkpoint_interval'] is not None:
+            interval = config['checkpoint_interval']
+        resume = True
+        if 'resume' in config and config['resume'] is not None:
+            resume = config['resume']
+        return Checkpointer(checkpoint_dir, interval, resume)
+
+    @property
+    def interval(self):
+        return self.interval_
+
+    @property
+    def completed_keys(self):
+        return self.completed_keys_
+
+    def _filename(self, key):
+        return os.path.join(self.checkpoint_dir_, key + CHECKPOINT_EXT)
+
+    def is_complete(self, key):
+        return key in self.completed_keys_
+
+    def mark_complete(self, key):
+        """ Records key as finished and removes its partial state """
+        if key not in self.completed_keys_:
+            self.completed_keys_.append(key)
+        completed_filename = os.path.join(self.checkpoint_dir_, COMPLETED_FILENAME)
+        tmp_filename = completed_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write('\n'.join(self.completed_keys_) + '\n')
+        os.rename(tmp_filename, completed_filename)
+        self.clear(key)
+
+    def save(self, key, state):
+        """ Saves the partial state for key """
+        save_atomic(state, self._filename(key))
+
+    def load(self, key):
+        """ Returns the partial state for key left by a previous run, or None """
+        if not self.resume_:
+            return None
+        state = load(self._filename(key))
+        if state is not None:
+            logging.info('Resuming %s from checkpoint' %(key))
+        return state
+
+    def clear(self, key):
+        """ Removes the partial state for key, e.g. once the enclosing unit of work has been checkpointed """
+        filename = self._filename(key)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def solver_checkpoint(self, key):
+        """ Returns a checkpoint for a single bandit run to pass to a solver """
+        return SolverCheckpoint(self, key)
+
+class SolverCheckpoint(object):
+    """ Partial state of a single bandit run, saved every interval pulls by DiscreteAdaptiveSampler """
+    def __init__(self, checkpointer, key):
+        self.checkpointer_ = checkpointer
+        self.key_ = key
+
+    @property
+    def interval(self):
+        return self.checkpointer_.interval
+
+    def load(self):
+        return self.checkpointer_.load(self.key_)
+
+    def save(self, state):
+        self.checkpointer_.save(self.key_, state)
+
+    def clear(self):
+        self.checkpointer_.clear(self.key_)
+
+def test_checkpointer(checkpoint_dir = 'checkpoint_test'):
+    import shutil
+    checkpointer = Checkpointer(checkpoint_dir, interval=10)
+
+    # partial states and random streams survive a restart
+    np.random.seed(100)
+    checkpointer.save('obj', {'trial': 3, 'random_state': random_state()})
+    expected = np.random.rand(5)
+    np.random.rand(7)
+    state = Checkpointer(checkpoint_dir).load('obj')
+    assert state['trial'] == 3
+    assert not [f for f in os.listdir(checkpoint_dir) if f.endswith('.pkl')]
+    set_random_state(state['random_state'])
+    assert np.allclose(np.random.rand(5), expected)
+
+    # completed keys persist and their partial states are removed
+    checkpointer.mark_complete('obj')
+    resumed = Checkpointer(checkpoint_dir)
+    assert resumed.is_complete('obj') and resumed.load('obj') is None
+    assert not Checkpointer(checkpoint_dir, resume=False).is_complete('obj')
+    shutil.rmtree(checkpoint_dir)
+    logging.info('Checkpoint test passed!')
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    test_checkpointer()
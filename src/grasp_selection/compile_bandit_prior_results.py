@@ -2,6 +2,7 @@
 Generates plots for the prior correlated bandits experiments
 """
 import argparse
+import functools
 import IPython
 import logging
 import matplotlib as mpl; mpl.use('Agg') # this doesn't seem to work...
@@ -17,106 +18,102 @@ import scipy.spatial.distance as ssd
 import correlated_bandits_priors as cb
 from correlated_bandits_priors import BanditCorrelatedPriorExperimentResult
 import experiment_config as ec
+import result_compiler as rc
+
+def plot_result(result, config, result_dir, colors):
+    """ Plots the kernels, grasp histogram and reward curves of a single object """
+    line_width = config['line_width']
+    font_size = config['font_size']
+    dpi = config['dpi']
+
+    # kernel plot
+    pfc_arr = np.array([result.true_avg_reward]).T
+    pfc_diff = ssd.squareform(ssd.pdist(pfc_arr))
+    plotting.plot_kernels(result.obj_key, result.kernel_matrix, pfc_diff,
+                          result.neighbor_kernels, result.neighbor_pfc_diffs, result.neighbor_keys,
+                          font_size=font_size)
+    figname = '%s_kernels.png' %(result.obj_key)
+    plt.savefig(os.path.join(result_dir, figname), dpi=dpi)
+    logging.info('Finished plotting %s', figname)
+
+    # grasp histogram plot
+    plotting.plot_grasp_histogram(result.true_avg_reward, font_size=font_size)
+    figname = '%s_grasp_histogram.png' %(result.obj_key)
+    plt.savefig(os.path.join(result_dir, figname), dpi=dpi)
+    logging.info('Finished plotting %s', figname)
+    
+    # avg reward plot
+    plt.figure()
+    plt.plot(result.iters, result.ua_reward, c=colors[0], linewidth=line_width, label='Uniform Allocation')
+    plt.plot(result.iters, result.ts_reward, c=colors[1], linewidth=line_width, label='Thompson Sampling (Uncorrelated)')
+    plt.plot(result.iters, result.gi_reward, c=colors[2], linewidth=line_width, label='Gittins Indices')
+    plt.plot(result.iters, result.ts_corr_reward, c=colors[3], linewidth=line_width, label='Thompson Sampling (Correlated)')
+    plt.plot(result.iters, result.bucb_corr_reward, c=colors[4], linewidth=line_width, label='Bayes UCB (Correlated)')
+    for ts_corr_prior, color, label in zip(result.ts_corr_prior_reward, colors[5:5+len(result.ts_corr_prior_reward)],
+                                           config['priors_feature_names']):
+        plt.plot(result.iters, ts_corr_prior,
+                 c=color, linewidth=line_width, label='TS (%s)' %(label.replace('nearest_features', 'Priors')))
+
+    for bucb_corr_prior, color, label in zip(result.bucb_corr_prior_reward, colors[5+len(result.bucb_corr_prior_reward):],
+                                             config['priors_feature_names']):
+        plt.plot(result.iters, bucb_corr_prior,
+                 c=color, linewidth=line_width, label='BUCB (%s)' %(label.replace('nearest_features', 'Priors')))
+
+    plt.xlim(0, np.max(result.iters))
+    plt.ylim(0.5, 1)
+    plt.xlabel('Iteration', fontsize=font_size)
+    plt.ylabel('Normalized Probability of Force Closure', fontsize=font_size)
+    plt.title('Avg Normalized PFC vs Iteration', fontsize=font_size)
+
+    handles, labels = plt.gca().get_legend_handles_labels()
+    plt.legend(handles, labels, loc='lower right', prop={'size':5})
+
+    figname = '%s_avg_reward.pdf' %(result.obj_key)
+    plt.savefig(os.path.join(result_dir, figname), dpi=dpi)
+    logging.info('Finished plotting %s', figname)
+    plt.close('all')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('config')
     parser.add_argument('result_dir')
+    parser.add_argument('--num_processes', type=int, default=1, help='number of processes reading result files')
+    parser.add_argument('--from_summary', action='store_true', help='replot from the summary of a previous run')
     args = parser.parse_args()
 
     logging.getLogger().setLevel(logging.INFO)
     config = ec.ExperimentConfig(args.config)
     result_dir = args.result_dir
 
-    # read in all pickle files
-    results = []
-    names = []
-    for _, dirs, _ in os.walk(result_dir):
-        # compile each subdirectory
-        for d in dirs:
-            # get the pickle files from each directory
-            for root, _, files in os.walk(os.path.join(result_dir, d)):
-                for f in files:
-                    if f.endswith('.pkl'):
-                        names.append(f.split('.')[0])
-                        result_pkl = os.path.join(root, f)
-                        f = open(result_pkl, 'r')
-
-                        logging.info('Reading %s' %(result_pkl))
-                        try:
-                            p = pkl.load(f)
-                        except:
-                            continue
-
-                        if p is not None:
-                            results.append(p)
-
-    if len(results) == 0:
-        exit(0)
-
     # plot params
     line_width = config['line_width']
     font_size = config['font_size']
     dpi = config['dpi']
 
-    num_colors = 5 + len(results[0].ts_corr_prior_reward) + len(results[0].bucb_corr_prior_reward)
+    num_colors = 5 + 2 * len(config['priors_feature_names'])
     colors = plotting.distinguishable_colors(num_colors)
 
-    # per-object plots
-    for result in results:
-        # kernel plot
-        pfc_arr = np.array([result.true_avg_reward]).T
-        pfc_diff = ssd.squareform(ssd.pdist(pfc_arr))
-        plotting.plot_kernels(result.obj_key, result.kernel_matrix, pfc_diff,
-                              result.neighbor_kernels, result.neighbor_pfc_diffs, result.neighbor_keys,
-                              font_size=font_size)
-        figname = '%s_kernels.png' %(result.obj_key)
-        plt.savefig(os.path.join(result_dir, figname), dpi=dpi)
-        logging.info('Finished plotting %s', figname)
-
-        # grasp histogram plot
-        plotting.plot_grasp_histogram(result.true_avg_reward, font_size=font_size)
-        figname = '%s_grasp_histogram.png' %(result.obj_key)
-        plt.savefig(os.path.join(result_dir, figname), dpi=dpi)
-        logging.info('Finished plotting %s', figname)
-        
-        # avg reward plot
-        plt.figure()
-        plt.plot(result.iters, result.ua_reward, c=colors[0], linewidth=line_width, label='Uniform Allocation')
-        plt.plot(result.iters, result.ts_reward, c=colors[1], linewidth=line_width, label='Thompson Sampling (Uncorrelated)')
-        plt.plot(result.iters, result.gi_reward, c=colors[2], linewidth=line_width, label='Gittins Indices')
-        plt.plot(result.iters, result.ts_corr_reward, c=colors[3], linewidth=line_width, label='Thompson Sampling (Correlated)')
-        plt.plot(result.iters, result.bucb_corr_reward, c=colors[4], linewidth=line_width, label='Bayes UCB (Correlated)')
-        for ts_corr_prior, color, label in zip(result.ts_corr_prior_reward, colors[5:5+len(result.ts_corr_prior_reward)],
-                                               config['priors_feature_names']):
-            plt.plot(result.iters, ts_corr_prior,
-                     c=color, linewidth=line_width, label='TS (%s)' %(label.replace('nearest_features', 'Priors')))
-
-        for bucb_corr_prior, color, label in zip(result.bucb_corr_prior_reward, colors[5+len(result.bucb_corr_prior_reward):],
-                                                 config['priors_feature_names']):
-            plt.plot(result.iters, bucb_corr_prior,
-                     c=color, linewidth=line_width, label='BUCB (%s)' %(label.replace('nearest_features', 'Priors')))
-
-        plt.xlim(0, np.max(result.iters))
-        plt.ylim(0.5, 1)
-        plt.xlabel('Iteration', fontsize=font_size)
-        plt.ylabel('Normalized Probability of Force Closure', fontsize=font_size)
-        plt.title('Avg Normalized PFC vs Iteration', fontsize=font_size)
-
-        handles, labels = plt.gca().get_legend_handles_labels()
-        plt.legend(handles, labels, loc='lower right', prop={'size':5})
-
-        figname = '%s_avg_reward.pdf' %(result.obj_key)
-        plt.savefig(os.path.join(result_dir, figname), dpi=dpi)
-        logging.info('Finished plotting %s', figname)
-
-    # aggregate results
-    all_results = BanditCorrelatedPriorExperimentResult.compile_results(results)
+    # stream the pickle files into running aggregates, plotting each object on the way
+    summary_filename = os.path.join(result_dir, rc.SUMMARY_FILENAME)
+    if args.from_summary:
+        summary = rc.load_summary(summary_filename)
+    else:
+        aggregator = rc.ResultAggregator(['ua_reward', 'ts_reward', 'gi_reward', 'ts_corr_reward', 'bucb_corr_reward',
+                                          'ts_corr_prior_reward', 'bucb_corr_prior_reward'],
+                                         ['num_grasps', 'ua_runtime', 'ts_runtime', 'ts_corr_runtime', 'bucb_corr_runtime',
+                                          'ts_corr_prior_runtime', 'bucb_corr_prior_runtime', 'prior_comp_time'],
+                                         {'ce_vals': 'num_grasps', 'se_vals': 'num_grasps', 'we_vals': 'total_weights'})
+        per_result = functools.partial(plot_result, config=config, result_dir=result_dir, colors=colors)
+        aggregator = rc.compile_results(rc.result_files(result_dir), aggregator, args.num_processes, per_result)
+        if aggregator.num_results == 0:
+            exit(0)
+        summary = aggregator.summary()
+        rc.save_summary(summary, summary_filename)
 
     # plot ce and se
-    avg_ce = np.sum(np.diag(all_results.num_grasps).dot(all_results.ce_vals), axis=0) * (1.0 / np.sum(all_results.num_grasps))
-    avg_se = np.sum(np.diag(all_results.num_grasps).dot(all_results.se_vals), axis=0) * (1.0 / np.sum(all_results.num_grasps))
-    avg_we = np.sum(all_results.total_weights * all_results.we_vals, axis=0)  / np.sum(all_results.total_weights, axis=0)
+    avg_ce = summary['ce_vals_weighted_mean']
+    avg_se = summary['se_vals_weighted_mean']
+    avg_we = summary['we_vals_weighted_mean']
     np.savetxt('cross_entropy_vs_nn.csv', avg_ce, delimiter=',')
     np.savetxt('squared_error_vs_nn.csv', avg_se, delimiter=',')
     np.savetxt('weighted_squared_error_vs_nn.csv', avg_we, delimiter=',')
@@ -149,40 +146,33 @@ if __name__ == '__main__':
     logging.info('Finished plotting %s', figname)
 
     # plotting of average final results
-    ua_normalized_reward = np.mean(all_results.ua_reward, axis=0)
-    ts_normalized_reward = np.mean(all_results.ts_reward, axis=0)
-    gi_normalized_reward = np.mean(all_results.gi_reward, axis=0)
-    ts_corr_normalized_reward = np.mean(all_results.ts_corr_reward, axis=0)
-    bucb_corr_normalized_reward = np.mean(all_results.bucb_corr_reward, axis=0)
-
-    all_ts_corr_prior_rewards = all_results.ts_corr_prior_reward
-    ts_corr_prior_normalized_reward = []
-    for ts_corr_prior_rewards in all_ts_corr_prior_rewards:
-        ts_corr_prior_normalized_reward.append(np.mean(ts_corr_prior_rewards, axis=0))
-
-    all_bucb_corr_prior_rewards = all_results.bucb_corr_prior_reward
-    bucb_corr_prior_normalized_reward = []
-    for bucb_corr_prior_rewards in all_bucb_corr_prior_rewards:
-        bucb_corr_prior_normalized_reward.append(np.mean(bucb_corr_prior_rewards, axis=0))
+    iters = summary['iters']
+    ua_normalized_reward = summary['ua_reward_mean']
+    ts_normalized_reward = summary['ts_reward_mean']
+    gi_normalized_reward = summary['gi_reward_mean']
+    ts_corr_normalized_reward = summary['ts_corr_reward_mean']
+    bucb_corr_normalized_reward = summary['bucb_corr_reward_mean']
+    ts_corr_prior_normalized_reward = list(summary['ts_corr_prior_reward_mean'])
+    bucb_corr_prior_normalized_reward = list(summary['bucb_corr_prior_reward_mean'])
 
     plt.figure()
-    plt.plot(all_results.iters[0], ua_normalized_reward, c=colors[0], linewidth=line_width, label='Uniform')
-    plt.plot(all_results.iters[0], ts_normalized_reward, c=colors[1], linewidth=line_width, label='TS (Uncorrelated)')
-    plt.plot(all_results.iters[0], gi_normalized_reward, c=colors[2], linewidth=line_width, label='Gittins Indices')
-    plt.plot(all_results.iters[0], ts_corr_normalized_reward, c=colors[3], linewidth=line_width, label='TS (Correlated)')
-    plt.plot(all_results.iters[0], bucb_corr_normalized_reward, c=colors[4], linewidth=line_width, label='BUCB (Correlated)')
+    plt.plot(iters, ua_normalized_reward, c=colors[0], linewidth=line_width, label='Uniform')
+    plt.plot(iters, ts_normalized_reward, c=colors[1], linewidth=line_width, label='TS (Uncorrelated)')
+    plt.plot(iters, gi_normalized_reward, c=colors[2], linewidth=line_width, label='Gittins Indices')
+    plt.plot(iters, ts_corr_normalized_reward, c=colors[3], linewidth=line_width, label='TS (Correlated)')
+    plt.plot(iters, bucb_corr_normalized_reward, c=colors[4], linewidth=line_width, label='BUCB (Correlated)')
 
     for ts_corr_prior, color, label in zip(ts_corr_prior_normalized_reward, colors[5:5+len(ts_corr_prior_normalized_reward)],
                                            config['priors_feature_names']):
-        plt.plot(all_results.iters[0], ts_corr_prior,
+        plt.plot(iters, ts_corr_prior,
                  c=color, linewidth=line_width, label='TS (%s)' %(label.replace('nearest_features', 'Priors')))
 
     for bucb_corr_prior, color, label in zip(bucb_corr_prior_normalized_reward, colors[5+len(ts_corr_prior_normalized_reward):],
                                            config['priors_feature_names']):
-        plt.plot(all_results.iters[0], bucb_corr_prior,
+        plt.plot(iters, bucb_corr_prior,
                  c=color, linewidth=line_width, label='BUCB (%s)' %(label.replace('nearest_features', 'Priors')))
 
-    plt.xlim(0, np.max(all_results.iters[0]))
+    plt.xlim(0, np.max(iters))
     plt.ylim(0.5, 1)
     plt.xlabel('Iteration', fontsize=font_size)
     plt.ylabel('Normalized Probability of Force Closure', fontsize=font_size)
@@ -1,4 +1,6 @@
 import IPython
+import argparse
+import functools
 import logging
 import matplotlib as mpl; mpl.use('Agg') # this doesn't seem to work...
 import matplotlib.pyplot as plt
@@ -12,42 +14,34 @@ import scipy.spatial.distance as ssd
 import correlated_bandits as cb
 from correlated_bandits import BanditCorrelatedExperimentResult
 import experiment_config as ec
+import result_compiler as rc
+
+def plot_correlations(result, correlations_dir, font_size, dpi):
+    """ Plots the kernel values against the pfc differences of all pairs of grasps on an object """
+    pfc = result.true_avg_reward
+    pfc_diff_vec = ssd.squareform(ssd.pdist(np.array([pfc]).T)).ravel()
+    k_vec = result.kernel_matrix.ravel()
+    plt.figure()
+    plt.scatter(k_vec, pfc_diff_vec)
+    plt.xlabel('Kernel', fontsize=font_size)
+    plt.ylabel('PFC Diff', fontsize=font_size)
+    plt.title('%s Correlations' %(result.obj_key), fontsize=font_size)
+    figname = 'correlations_%s.png' %(result.obj_key)
+    plt.savefig(os.path.join(correlations_dir, figname), dpi=dpi)
+    plt.close()
+    logging.info('Finished plotting %s', figname)
 
 if __name__ == '__main__':
-    config_file = sys.argv[1]
-    result_dir = sys.argv[2]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config')
+    parser.add_argument('result_dir')
+    parser.add_argument('--num_processes', type=int, default=1, help='number of processes reading result files')
+    parser.add_argument('--from_summary', action='store_true', help='replot from the summary of a previous run')
+    args = parser.parse_args()
 
     logging.getLogger().setLevel(logging.INFO)
-    config = ec.ExperimentConfig(config_file)
-
-    # read in all pickle files
-    results = []
-    names = []
-    for _, dirs, _ in os.walk(result_dir):
-        # compile each subdirectory
-        for d in dirs:
-            # get the pickle files from each directory
-            for root, _, files in os.walk(os.path.join(result_dir, d)):
-                for f in files:
-                    if f.endswith('.pkl'):
-                        names.append(f.split('.')[0])
-                        result_pkl = os.path.join(root, f)
-                        f = open(result_pkl, 'r')
-
-                        logging.info('Reading %s' %(result_pkl))
-                        try:
-                            p = pkl.load(f)
-                        except:
-                            continue
-
-                        if p is not None:
-                            results.append(p)
-
-    # aggregate results
-    if len(results) == 0:
-        exit(0)
-
-    all_results = BanditCorrelatedExperimentResult.compile_results(results)
+    config = ec.ExperimentConfig(args.config)
+    result_dir = args.result_dir
 
     # plot params
     line_width = config['line_width']
@@ -58,44 +52,25 @@ if __name__ == '__main__':
     if not os.path.exists(correlations_dir):
         os.mkdir(correlations_dir)
 
-    # plot the prior distribution of grasp quality
-    grasp_qualities = np.zeros(0)
-    grasp_qualities_diff = np.zeros(0)
-    kernel_values = np.zeros(0)
-    for obj_name, result in zip(names, results):
-        pfc = result.true_avg_reward
-        grasp_qualities = np.r_[grasp_qualities, pfc]
-
-        pfc_diff_vec = ssd.squareform(ssd.pdist(np.array([pfc]).T)).ravel()
-        k_vec = result.kernel_matrix.ravel()
-        plt.figure()
-        plt.scatter(k_vec, pfc_diff_vec)
-        plt.xlabel('Kernel', fontsize=font_size)
-        plt.ylabel('PFC Diff', fontsize=font_size)
-        plt.title('%s Correlations' %(obj_name), fontsize=font_size)
-        figname = 'correlations_%s.png' %(obj_name)
-        plt.savefig(os.path.join(correlations_dir, figname), dpi=dpi)
-        logging.info('Finished plotting %s', figname)
-
-        grasp_qualities_diff = np.r_[grasp_qualities_diff, pfc_diff_vec]
-        kernel_values = np.r_[kernel_values, k_vec]
-
-    # plot pfc difference
-    # plt.figure()
-    # plt.scatter(kernel_values, grasp_qualities_diff)
-    # plt.xlabel('Kernel', fontsize=font_size)
-    # plt.ylabel('PFC Diff', fontsize=font_size)
-    # plt.title('Correlations', fontsize=font_size)
-
-    # figname = 'correlations.png'
-    # plt.savefig(os.path.join(result_dir, figname), dpi=dpi)
-    # logging.info('Finished plotting %s', figname)
+    # stream the pickle files into running aggregates, plotting the correlations of each object on the way
+    summary_filename = os.path.join(result_dir, rc.SUMMARY_FILENAME)
+    if args.from_summary:
+        summary = rc.load_summary(summary_filename)
+    else:
+        num_bins = 100
+        aggregator = rc.ResultAggregator(['ua_reward', 'ts_reward', 'ts_corr_reward'],
+                                         histogram_fields={'true_avg_reward': np.linspace(0, 1, num_bins+1)})
+        plot_result = functools.partial(plot_correlations, correlations_dir=correlations_dir, font_size=font_size, dpi=dpi)
+        aggregator = rc.compile_results(rc.result_files(result_dir), aggregator, args.num_processes, plot_result)
+        if aggregator.num_results == 0:
+            exit(0)
+        summary = aggregator.summary()
+        rc.save_summary(summary, summary_filename)
 
     # plot histograms
-    num_bins = 100
-    bin_edges = np.linspace(0, 1, num_bins+1)
+    bin_edges = summary['true_avg_reward_bin_edges']
     plt.figure()
-    n, bins, patches = plt.hist(grasp_qualities, bin_edges)
+    n, bins, patches = plt.hist(bin_edges[:-1], bin_edges, weights=summary['true_avg_reward_hist'])
     plt.xlabel('Probability of Success', fontsize=font_size)
     plt.ylabel('Num Grasps', fontsize=font_size)
     plt.title('Histogram of Grasps by Probability of Success', fontsize=font_size)
@@ -105,22 +80,23 @@ if __name__ == '__main__':
     logging.info('Finished plotting %s', figname)
 
     # plotting of final results
-    ua_avg_norm_reward = np.mean(all_results.ua_reward, axis=0)
-    ts_avg_norm_reward = np.mean(all_results.ts_reward, axis=0)
-    ts_corr_avg_norm_reward = np.mean(all_results.ts_corr_reward, axis=0)
+    iters = summary['iters']
+    ua_avg_norm_reward = summary['ua_reward_mean']
+    ts_avg_norm_reward = summary['ts_reward_mean']
+    ts_corr_avg_norm_reward = summary['ts_corr_reward_mean']
 
-    ua_std_norm_reward = np.std(all_results.ua_reward, axis=0)
-    ts_std_norm_reward = np.std(all_results.ts_reward, axis=0)
-    ts_corr_std_norm_reward = np.std(all_results.ts_corr_reward, axis=0)
+    ua_std_norm_reward = summary['ua_reward_std']
+    ts_std_norm_reward = summary['ts_reward_std']
+    ts_corr_std_norm_reward = summary['ts_corr_reward_std']
 
     # plot avg simple regret
     plt.figure()
 
-    plt.plot(all_results.iters[0], ua_avg_norm_reward, c=u'b', linewidth=line_width, label='Uniform Allocation')
-    plt.plot(all_results.iters[0], ts_avg_norm_reward, c=u'g', linewidth=line_width, label='Thompson Sampling (Uncorrelated)')
-    plt.plot(all_results.iters[0], ts_corr_avg_norm_reward, c=u'r', linewidth=line_width, label='Thompson Sampling (Correlated)')
+    plt.plot(iters, ua_avg_norm_reward, c=u'b', linewidth=line_width, label='Uniform Allocation')
+    plt.plot(iters, ts_avg_norm_reward, c=u'g', linewidth=line_width, label='Thompson Sampling (Uncorrelated)')
+    plt.plot(iters, ts_corr_avg_norm_reward, c=u'r', linewidth=line_width, label='Thompson Sampling (Correlated)')
 
-    plt.xlim(0, np.max(all_results.iters[0]))
+    plt.xlim(0, np.max(iters))
     plt.ylim(0.5, 1)
     plt.xlabel('Iteration', fontsize=font_size)
     plt.ylabel('Normalized Probability of Force Closure', fontsize=font_size)
@@ -136,11 +112,11 @@ if __name__ == '__main__':
     # plot avg simple regret w error bars
     plt.figure()
 
-    plt.errorbar(all_results.iters[0], ua_avg_norm_reward, yerr=ua_std_norm_reward, c=u'b', linewidth=line_width, label='Uniform Allocation')
-    plt.errorbar(all_results.iters[0], ts_avg_norm_reward, yerr=ts_std_norm_reward, c=u'g', linewidth=line_width, label='Thompson Sampling (Uncorrelated)')
-    plt.errorbar(all_results.iters[0], ts_corr_avg_norm_reward, yerr=ts_corr_std_norm_reward, c=u'r', linewidth=line_width, label='Thompson Sampling (Correlated)')
+    plt.errorbar(iters, ua_avg_norm_reward, yerr=ua_std_norm_reward, c=u'b', linewidth=line_width, label='Uniform Allocation')
+    plt.errorbar(iters, ts_avg_norm_reward, yerr=ts_std_norm_reward, c=u'g', linewidth=line_width, label='Thompson Sampling (Uncorrelated)')
+    plt.errorbar(iters, ts_corr_avg_norm_reward, yerr=ts_corr_std_norm_reward, c=u'r', linewidth=line_width, label='Thompson Sampling (Correlated)')
 
-    plt.xlim(0, np.max(all_results.iters[0]))
+    plt.xlim(0, np.max(iters))
     plt.ylim(0.5, 1)
     plt.xlabel('Iteration', fontsize=font_size)
     plt.ylabel('Normalized Probability of Force Closure', fontsize=font_size)
@@ -5,95 +5,75 @@ To run file, enter python connected_components.py DIR_PATH
 Author: Nikhil Sharma
 """
 
-import mesh
-import sys
+import multiprocessing as mp
+import numpy as np
 import obj_file
-import Queue
 import os
+import scipy.sparse as sp
+import scipy.sparse.csgraph as csgraph
+import sys
 
-def assign_components(path):
+def label_components(triangles, num_vertices=None):
 	"""
-	Sets values for component attribute of all meshes in an input directory.
-	Utilizes breadth first search to determine connected components and assign values accordingly.
-	Returns a dictionary mapping component numbers to indexes of all the vertices contained in that component.
+	Labels the connected components of a triangle mesh from a sparse vertex adjacency matrix.
+	Returns the number of components, the component label of each vertex and of each triangle, and the number of vertices in each component.
+	Vertices not referenced by any triangle form their own components.
 
-	path -- path to directory containing mesh objects as .obj
+	triangles -- list or num_triangles x 3 array of vertex indices
+	num_vertices -- number of mesh vertices, defaults to one more than the largest index in triangles
 	"""
-	mesh_files = [filename for filename in os.listdir(path) if filename[-4:] == ".obj"]
-	mesh_components_list = []
-	for filename in mesh_files:
-		print "Assigning components: " + path + "/" + filename
-		ob = obj_file.ObjFile(path + "/" + filename)
-		mesh = ob.read()
-		mesh.remove_unreferenced_vertices()
+	triangles = np.array(triangles, dtype=np.int64).reshape(-1, 3)
+	if num_vertices is None:
+		num_vertices = triangles.max() + 1 if triangles.shape[0] > 0 else 0
 
-		# generate graph and connect nodes appropriately
-		nodes = []
-		for triangle in mesh.triangles():
-			node_0 = Node(triangle[0])
-			node_1 = Node(triangle[1])
-			node_2 = Node(triangle[2])
-			node_0.connect_nodes(node_1)
-			node_1.connect_nodes(node_2)
-			node_2.connect_nodes(node_0)
-			nodes.append(node_0)
-			nodes.append(node_1)
-			nodes.append(node_2)
+	# connect each triangle vertex to the next one, csgraph symmetrizes the adjacency
+	rows = triangles.ravel()
+	cols = np.roll(triangles, 1, axis=1).ravel()
+	adjacency = sp.coo_matrix((np.ones(rows.shape[0], dtype=np.int8), (rows, cols)), shape=(num_vertices, num_vertices))
+	num_components, vertex_labels = csgraph.connected_components(adjacency.tocsr(), directed=False)
 
-		# breadth-first-search to mark elements of each component
-		component_counter = 0
-		component_to_index = {}
-		while nodes != []:
-			q = Queue.Queue()
-			q.put(nodes[0])
-			while (q.qsize() != 0):
-				curr = q.get()
-				curr.visited = True;
-				if curr in nodes:
-					nodes.remove(curr)
-				else:
-					continue
+	triangle_labels = vertex_labels[triangles[:,0]]
+	component_sizes = np.bincount(vertex_labels, minlength=num_components)
+	return num_components, vertex_labels, triangle_labels, component_sizes
 
-				for child in curr.children:
-					if not child.visited:
-						q.put(child)
-
-				if component_counter in component_to_index:
-					if curr.index not in component_to_index[component_counter]:
-						component_to_index[component_counter].append(curr.index)
-				else:
-					component_to_index[component_counter] = [curr.index]
-			component_counter += 1
-		mesh_components_list.append(component_to_index)
-	return mesh_components_list
+def mesh_components(filename):
+	"""
+	Returns a dictionary mapping component numbers to the indices of all the vertices contained in that component for a single .obj file.
 
-class Node:
+	filename -- path to the mesh .obj file
 	"""
-	A basic Node class used to construct a Graph with the vertices of a given mesh
+	print "Assigning components: " + filename
+	ob = obj_file.ObjFile(filename)
+	mesh = ob.read()
+	mesh.remove_unreferenced_vertices()
+
+	num_components, vertex_labels, triangle_labels, component_sizes = label_components(mesh.triangles(), len(mesh.vertices()))
+	order = np.argsort(vertex_labels, kind='mergesort')
+	splits = np.cumsum(component_sizes)[:-1]
+	component_to_index = {}
+	for component, indices in enumerate(np.split(order, splits)):
+		component_to_index[component] = indices.tolist()
+	return component_to_index
+
+def assign_components(path, num_processes=None):
 	"""
-	children = []
-	visited = False
-
-	def __init__(self, index):
-		"""
-		Init method for Node class.
-
-		index -- index of vertex in mesh.
-		"""
-		self.index = index
-
-	def connect_nodes(self, other):
-		"""
-		Forms a connection between two nodes.
-
-		other -- node to connect this node to.
-		"""
-		if other not in self.children:
-			self.children.append(other)
-		# if self not in other.children:
-		# 	other.children.append(self)
-
+	Sets values for component attribute of all meshes in an input directory.
+	Returns a list with a dictionary per mesh mapping component numbers to indexes of all the vertices contained in that component.
 
+	path -- path to directory containing mesh objects as .obj
+	num_processes -- number of worker processes, defaults to the number of cpus
+	"""
+	mesh_files = [os.path.join(path, filename) for filename in os.listdir(path) if filename[-4:] == ".obj"]
+	if num_processes == 1:
+		return map(mesh_components, mesh_files)
+
+	pool = mp.Pool(num_processes)
+	try:
+		mesh_components_list = pool.map(mesh_components, mesh_files)
+	finally:
+		pool.close()
+		pool.join()
+	return mesh_components_list
 
 if __name__ == '__main__':
-	print(assign_components(sys.argv[1]))
\ No newline at end of file
+	print(assign_components(sys.argv[1]))
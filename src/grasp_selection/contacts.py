@@ -13,6 +13,8 @@ import IPython
 import matplotlib.pyplot as plt
 from sklearn.decomposition import PCA
 
+import instrumentation as inst
+
 NO_CONTACT_DIST = 0.2 # distance to points that are not in contact for window extraction
 WIN_DIST_LIM = 0.02 # limits for window plotting
 
@@ -51,6 +53,7 @@ class Contact3D(Contact):
         on_surface, _ = self.graspable.sdf.on_surface(as_grid)
         if not on_surface:
             logging.debug('Contact point not on surface')
+            inst.count('contact_normals_failed')
             return None
 
         # Use Hessian to compute outward facing normal
@@ -119,7 +122,9 @@ class Contact3D(Contact):
             normal - outward facing direction vector
         """
         if self.friction_cone_ is not None and self.normal_ is not None:
+            inst.count('friction_cone_cache_hits')
             return True, self.friction_cone_, self.normal_
+        inst.count('friction_cones')
 
         # get normal and tangents
         in_normal, t1, t2 = self.tangents()
@@ -178,6 +183,7 @@ class Contact3D(Contact):
 
         return True, torques
 
+    @inst.timed('surface_window_sdf')
     def surface_window_sdf(self, width=1e-2, num_steps=21):
         """Returns a window of SDF values on the tangent plane at a contact point.
         Params:
@@ -311,6 +317,7 @@ class Contact3D(Contact):
             back_up_units=back_up_units, samples_per_grid=samples_per_grid,
             sigma=sigma, direction=direction, vis=vis)
 
+    @inst.timed('surface_window_projection')
     def surface_window_projection(self, width=1e-2, num_steps=21,
         max_projection=0.1, back_up_units=3.0, samples_per_grid=2.0,
         sigma_mult=0.07, direction=None, vis=False):
@@ -402,6 +409,7 @@ class Contact3D(Contact):
         Returns the local surface window, gradient, and curvature for a single contact.
         """
         if self.surface_info_ is not None:
+            inst.count('surface_info_cache_hits')
             return self.surface_info_
 
         proj_window = self.surface_window_projection(width, num_steps,
@@ -21,6 +21,7 @@ import discrete_adaptive_samplers as das
 import experiment_config as ec
 import feature_functions as ff
 import grasp_sampler as gs
+import instrumentation as inst
 import json_serialization as jsons
 import kernels
 import models
@@ -249,15 +250,28 @@ if __name__ == '__main__':
     except os.error:
         pass
 
+    # optionally profile the hot paths of each object
+    profile = 'profile' in config and config['profile']
+    inst.enable(profile)
+    run_profile = None
+
     # loop through objects, labelling each
     results = []
     for obj in chunk:
         logging.info('Labelling object {}'.format(obj.key))
+        inst.reset()
         experiment_result = label_correlated(obj, chunk, dest, config)
+        if profile:
+            obj_profile = inst.report()
+            inst.dump(os.path.join(dest, obj.key + '_profile.json'), obj_profile)
+            run_profile = inst.merge_reports(run_profile, obj_profile)
         if experiment_result is None:
             continue # no grasps to run bandits on for this object
         results.append(experiment_result)
 
+    if run_profile is not None:
+        inst.dump(os.path.join(dest, 'profile.json'), run_profile)
+
     if len(results) == 0:
         logging.info('Exiting. No grasps found')
         exit(0)
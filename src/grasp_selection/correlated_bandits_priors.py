@@ -21,6 +21,7 @@ import numpy as np
 import scipy.stats
 
 import antipodal_grasp_sampler as ags
+import checkpoint as ckpt
 import database as db
 import discrete_adaptive_samplers as das
 import experiment_config as ec
@@ -43,6 +44,9 @@ from correlated_bandits import experiment_hash, reward_vs_iters
 # list of keys that cause trouble (right now the ones that take way too damn long)
 skip_keys = ['BigBIRD_nutrigrain_strawberry_greek_yogurt', 'ModelNet40_radio_112']
 
+# seed of the bandit model random streams when the config has no bandit_seed
+DEF_BANDIT_SEED = 100
+
 class BanditCorrelatedPriorExperimentResult:
     def __init__(self, ua_reward, ts_reward, gi_reward, ts_corr_reward, bucb_corr_reward, ts_corr_prior_reward, bucb_corr_prior_reward,
                  true_avg_reward, iters, kernel_matrix,
@@ -219,14 +223,18 @@ def load_candidate_grasps(obj, chunk):
 
 
 def label_correlated(obj, chunk, config, plot=False,
-                     priors_dataset=None, nearest_features_names=None):
+                     priors_dataset=None, nearest_features_names=None, checkpointer=None):
     """Label an object with grasps according to probability of force closure,
-    using correlated bandits."""
+    using correlated bandits. With a checkpoint.Checkpointer the priors and finished trials are saved after each
+    trial and each bandit run is checkpointed, so a resumed run skips finished work."""
     # bandit params
     num_trials = config['num_trials']
     max_iter = config['bandit_max_iter']
     confidence = config['bandit_confidence']
     snapshot_rate = config['bandit_snapshot_rate']
+    bandit_seed = DEF_BANDIT_SEED
+    if 'bandit_seed' in config and config['bandit_seed'] is not None:
+        bandit_seed = config['bandit_seed']
     tc_list = [
         tc.MaxIterTerminationCondition(max_iter),
         ]
@@ -248,17 +256,26 @@ def label_correlated(obj, chunk, config, plot=False,
         sigma=config['kernel_sigma'], l=config['kernel_l'], phi=phi)
     objective = objectives.RandomBinaryObjective()
 
+    # pick up the priors and finished trials of a previous run
+    obj_state = None
+    if checkpointer is not None:
+        obj_state = checkpointer.load(obj.key)
+
     # compute priors
-    logging.info('Computing priors')
-    if priors_dataset is None:
-        priors_dataset = chunk
-    prior_engine = pce.PriorComputationEngine(priors_dataset, config)
+    if obj_state is None:
+        logging.info('Computing priors')
+        if priors_dataset is None:
+            priors_dataset = chunk
+        prior_engine = pce.PriorComputationEngine(priors_dataset, config)
 
     # Compute priors
     all_alpha_priors = []
     all_beta_priors = []
     prior_comp_times = []
-    if nearest_features_names == None:
+    neighbor_keys = []
+    if obj_state is not None:
+        all_alpha_priors, all_beta_priors, prior_comp_times, neighbor_keys = obj_state['priors']
+    elif nearest_features_names == None:
         alpha_priors, beta_priors = prior_engine.compute_priors(obj, candidates)
         all_alpha_priors.append(alpha_priors)
         all_beta_priors.append(beta_priors)
@@ -336,37 +353,63 @@ def label_correlated(obj, chunk, config, plot=False,
     for x in range(0, len(all_alpha_priors)):
         all_bucb_corr_prior_runtimes.append([])
 
+    # restore the buffers and random state after the last finished trial
+    first_trial = 0
+    if obj_state is not None:
+        first_trial = obj_state['trial']
+        ua_rewards, ts_rewards, gi_rewards, ts_corr_rewards, bucb_corr_rewards, all_ts_corr_prior_rewards, all_bucb_corr_prior_rewards, \
+            ua_runtimes, ts_runtimes, gi_runtimes, ts_corr_runtimes, bucb_corr_runtimes, all_ts_corr_prior_runtimes, all_bucb_corr_prior_runtimes, \
+            ua_result, ts_result, ts_corr_result, bucb_corr_result, all_ts_corr_prior_ind, all_bucb_corr_prior_ind = obj_state['buffers']
+        ckpt.set_random_state(obj_state['random_state'])
+        ckpt.set_sample_counts(candidates, obj_state['sample_counts'])
+        logging.info('Resuming %s at trial %d' %(obj.key, first_trial))
+
+    # checkpoints for the bandit runs of the current trial
+    trial_checkpoints = []
+    def solver_checkpoint(name):
+        if checkpointer is None:
+            return None
+        trial_checkpoints.append(checkpointer.solver_checkpoint('%s_trial%d_%s' %(obj.key, t, name)))
+        return trial_checkpoints[-1]
+
     # run bandits for several trials
     logging.info('Running bandits')
-    for t in range(num_trials):
+    for t in range(first_trial, num_trials):
         logging.info('Trial %d' %(t))
+        trial_seed = [bandit_seed, t] # each trial samples the bandit models from its own stream
 
         # Uniform sampling
-        ua = das.UniformAllocationMean(objective, candidates)
+        ua = das.UniformAllocationMean(objective, candidates, seed=trial_seed)
         logging.info('Running Uniform allocation.')
-        ua_result = ua.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate)
+        ua_result = ua.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate,
+                             checkpoint=solver_checkpoint('ua'))
 
         # Thompson sampling
-        ts = das.ThompsonSampling(objective, candidates)
+        ts = das.ThompsonSampling(objective, candidates, seed=trial_seed)
         logging.info('Running Thompson sampling.')
-        ts_result = ts.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate)
+        ts_result = ts.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate,
+                             checkpoint=solver_checkpoint('ts'))
 
         # Gittins indices
-        gi = das.GittinsIndex98(objective, candidates)
+        gi = das.GittinsIndex98(objective, candidates, seed=trial_seed)
         logging.info('Running Gittins Indices.')
-        gi_result = gi.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate)
+        gi_result = gi.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate,
+                             checkpoint=solver_checkpoint('gi'))
 
         # correlated Thompson sampling for even faster convergence
         ts_corr = das.CorrelatedThompsonSampling(
-            objective, candidates, nn, kernel, tolerance=config['kernel_tolerance'], p=config['lb_alpha'])
+            objective, candidates, nn, kernel, tolerance=config['kernel_tolerance'], p=config['lb_alpha'], seed=trial_seed)
         logging.info('Running correlated Thompson sampling.')
-        ts_corr_result = ts_corr.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate)
+        ts_corr_result = ts_corr.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate,
+                                       checkpoint=solver_checkpoint('ts_corr'))
 
         # correlated Thompson sampling for even faster convergence
         bucb_corr = das.CorrelatedGittins(
-            objective, candidates, nn, kernel, tolerance=config['kernel_tolerance'], p=config['lb_alpha'])#horizon=max_iter)
+            objective, candidates, nn, kernel, tolerance=config['kernel_tolerance'], p=config['lb_alpha'],
+            seed=trial_seed)#horizon=max_iter)
         logging.info('Running correlated Bayes UCB.')
-        bucb_corr_result = bucb_corr.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate)
+        bucb_corr_result = bucb_corr.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate,
+                                           checkpoint=solver_checkpoint('bucb_corr'))
 
         # correlated MAB for faster convergence
         all_ts_corr_prior_ind = []
@@ -376,10 +419,11 @@ def label_correlated(obj, chunk, config, plot=False,
             # thompson sampling
             ts_corr_prior = das.CorrelatedThompsonSampling(
                 objective, candidates, nn, kernel, tolerance=config['kernel_tolerance'], alpha_prior = alpha_priors,
-                beta_prior = beta_priors, p=config['lb_alpha'])
+                beta_prior = beta_priors, p=config['lb_alpha'], seed=trial_seed)
             logging.info('Running correlated Thompson sampling with priors from %s' %(nearest_features_name))
             ts_corr_prior_result = ts_corr_prior.solve(termination_condition=tc.OrTerminationCondition(tc_list),
-                                                       snapshot_rate=snapshot_rate)
+                                                       snapshot_rate=snapshot_rate,
+                                                       checkpoint=solver_checkpoint('ts_corr_prior_%s' %(nearest_features_name)))
             ts_corr_prior_normalized_reward = reward_vs_iters(ts_corr_prior_result, true_pfc)
             ts_corr_prior_rewards.append(ts_corr_prior_normalized_reward)
             ts_corr_runtimes.append(ts_corr_prior_result.total_time)
@@ -388,9 +432,10 @@ def label_correlated(obj, chunk, config, plot=False,
             # bayes ucb
             bucb_corr = das.CorrelatedGittins(
                 objective, candidates, nn, kernel, tolerance=config['kernel_tolerance'], #horizon=max_iter,
-                alpha_prior = alpha_priors, beta_prior = beta_priors, p=config['lb_alpha'])
+                alpha_prior = alpha_priors, beta_prior = beta_priors, p=config['lb_alpha'], seed=trial_seed)
             logging.info('Running correlated Bayes UCB with priors from %s' %(nearest_features_name))
-            bucb_corr_prior_result = bucb_corr.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate)
+            bucb_corr_prior_result = bucb_corr.solve(termination_condition=tc.OrTerminationCondition(tc_list), snapshot_rate=snapshot_rate,
+                                                     checkpoint=solver_checkpoint('bucb_corr_prior_%s' %(nearest_features_name)))
             bucb_corr_prior_normalized_reward = reward_vs_iters(bucb_corr_prior_result, true_pfc)
             bucb_corr_prior_rewards.append(bucb_corr_prior_normalized_reward)
             bucb_corr_runtimes.append(bucb_corr_prior_result.total_time)
@@ -415,6 +460,22 @@ def label_correlated(obj, chunk, config, plot=False,
         ts_corr_runtimes.append(ts_corr_result.total_time)
         bucb_corr_runtimes.append(bucb_corr_result.total_time)
 
+        # save the finished trial, after which its bandit runs are no longer needed
+        if checkpointer is not None:
+            checkpointer.save(obj.key, {'trial': t + 1,
+                                        'priors': (all_alpha_priors, all_beta_priors, prior_comp_times, neighbor_keys),
+                                        'buffers': (ua_rewards, ts_rewards, gi_rewards, ts_corr_rewards, bucb_corr_rewards,
+                                                    all_ts_corr_prior_rewards, all_bucb_corr_prior_rewards,
+                                                    ua_runtimes, ts_runtimes, gi_runtimes, ts_corr_runtimes, bucb_corr_runtimes,
+                                                    all_ts_corr_prior_runtimes, all_bucb_corr_prior_runtimes,
+                                                    ua_result, ts_result, ts_corr_result, bucb_corr_result,
+                                                    all_ts_corr_prior_ind, all_bucb_corr_prior_ind),
+                                        'sample_counts': ckpt.sample_counts(candidates),
+                                        'random_state': ckpt.random_state()})
+            for trial_checkpoint in trial_checkpoints:
+                trial_checkpoint.clear()
+            del trial_checkpoints[:]
+
     if num_trials == 0:
         return None
 
@@ -546,9 +607,11 @@ def run_and_save_experiment(obj, chunk, priors_dataset, config, result_dir):
 
     results = []
     avg_experiment_result = None
+    checkpointer = ckpt.Checkpointer.from_config(config, result_dir)
     experiment_result = label_correlated(obj, chunk, config,
                                          priors_dataset=priors_dataset,
-                                         nearest_features_names=nearest_features_names)
+                                         nearest_features_names=nearest_features_names,
+                                         checkpointer=checkpointer)
     results.append(experiment_result)
 
     if len(results) == 0:
@@ -600,6 +663,8 @@ def run_and_save_experiment(obj, chunk, priors_dataset, config, result_dir):
     plt.ylabel('Num Grasps', fontsize=font_size)
     plt.title('Histogram of Grasps by Probability of Success', fontsize=font_size)
     plt.savefig(os.path.join(result_dir,  obj.key+'_histogram.png'), dpi=dpi)
+    if checkpointer is not None:
+        checkpointer.mark_complete(obj.key)
 
     # plot_prior_diffs(obj, chunk, config, nearest_features_name=nearest_features_names[2])
     # plt.savefig(os.path.join(result_dir, obj.key+'_errors_all.png'), dpi=dpi)
@@ -634,29 +699,41 @@ if __name__ == '__main__':
     else:
         priors_dataset = None
 
+    # checkpoint objects and trials if specified
+    checkpointer = ckpt.Checkpointer.from_config(config, dest)
+
     # loop through objects, labelling each
     results = []
     for obj in chunk:
         if obj.key in skip_keys:
             continue
 
+        # reuse the saved results of objects finished by a previous run
+        if checkpointer is not None and checkpointer.is_complete(obj.key):
+            logging.info('Skipping finished object {}'.format(obj.key))
+            result_filename = os.path.join(dest, obj.key + '.pkl')
+            if os.path.exists(result_filename):
+                with open(result_filename, 'r') as f:
+                    results.append(pkl.load(f))
+            continue
+
         logging.info('Labelling object {}'.format(obj.key))
         experiment_result = label_correlated(obj, chunk, config,
                                              priors_dataset=priors_dataset,
-                                             nearest_features_names=config['priors_feature_names'])
-        if experiment_result is None:
-            continue
-        results.append(experiment_result)
+                                             nearest_features_names=config['priors_feature_names'],
+                                             checkpointer=checkpointer)
+        if experiment_result is not None:
+            # save to file right away so a preempted run keeps the finished objects
+            logging.info('Saving results to %s' %(dest))
+            experiment_result.save(dest)
+            results.append(experiment_result)
+        if checkpointer is not None:
+            checkpointer.mark_complete(obj.key)
 
     if len(results) == 0:
         logging.info('Exiting. No grasps found')
         exit(0)
 
-    # save to file
-    logging.info('Saving results to %s' %(dest))
-    for r in results:
-        r.save(dest)
-
     if config['plot']:
         # combine results
         all_results = BanditCorrelatedPriorExperimentResult.compile_results(results)
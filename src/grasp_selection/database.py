@@ -60,6 +60,19 @@ class Dataset(object):
     def _parse_config(self, config):
         self.database_root_dir_ = config['database_dir']
 
+        # optionally store sdfs sparsely, keeping only a band of voxels around the surface
+        self.sdf_narrow_band_ = None
+        self.sdf_brick_size_ = 8
+        if 'sdf_narrow_band' in config and config['sdf_narrow_band'] is not None:
+            self.sdf_narrow_band_ = config['sdf_narrow_band']
+            if 'sdf_brick_size' in config and config['sdf_brick_size'] is not None:
+                self.sdf_brick_size_ = config['sdf_brick_size']
+
+        # optionally store dense sdf values and gradients in single precision
+        self.sdf_dtype_ = None
+        if 'sdf_float32' in config and config['sdf_float32']:
+            self.sdf_dtype_ = np.float32
+
     def _read_data_keys(self, start=0, end=None):
         """Read in all the data keys from start to end in the index."""
         index_filename = os.path.join(self.dataset_root_dir_, INDEX_FILE)
@@ -125,7 +138,10 @@ class Dataset(object):
 
         # read in data
         sf = sdf_file.SdfFile(sdf_filename)
-        sdf = sf.read()
+        sdf = sf.read(dtype=self.sdf_dtype_)
+        if self.sdf_narrow_band_ is not None:
+            sdf = sdf.to_narrow_band(self.sdf_narrow_band_, self.sdf_brick_size_)
+        logging.debug('SDF for %s uses %d bytes' %(key, sdf.nbytes))
         
         of = obj_file.ObjFile(obj_filename)
         mesh = of.read()
@@ -14,7 +14,9 @@ import scipy.io
 import scipy.stats
 import time
 
+import checkpoint as ckpt
 import discrete_selection_policies as dcsp
+import instrumentation as inst
 import kernels
 import models
 import objectives
@@ -61,10 +63,12 @@ class DiscreteAdaptiveSampler(solvers.DiscreteSamplingSolver):
         pass
 
     def discrete_maximize(self, candidates, termination_condition = tc.MaxIterTerminationCondition(solvers.DEF_MAX_ITER),
-                          snapshot_rate = 1):
+                          snapshot_rate = 1, checkpoint = None):
         """
         Maximizes a function over a discrete set of variables by
         iteratively predicting the best point (using some model policy)
+        A checkpoint.SolverCheckpoint saves the run every checkpoint.interval pulls and keeps the final result, so a
+        resumed run continues from the last checkpoint with the same random streams
         """
         # check input
         if len(candidates) == 0:
@@ -89,13 +93,39 @@ class DiscreteAdaptiveSampler(solvers.DiscreteSamplingSolver):
         start_time = time.clock()
         next_ind_val = 0
 
+        # continue from the last checkpoint of this run
+        if checkpoint is not None:
+            state = checkpoint.load()
+            if state is not None:
+                ckpt.set_random_state(state['random_state'])
+                ckpt.set_sample_counts(candidates, state['sample_counts'])
+                if 'result' in state:
+                    return state['result']
+                k = state['iter']
+                next_ind_val = state['val']
+                times, iters, iter_indices, iter_vals, iter_models = state['log']
+                start_time = start_time - state['elapsed']
+                self.model_.set_state(state['model'])
+
         while not terminate:
+            # save progress
+            if checkpoint is not None and k > 0 and (k % checkpoint.interval) == 0:
+                with inst.timer('bandit_checkpoint'):
+                    checkpoint.save({'iter': k, 'val': next_ind_val,
+                                     'log': (times, iters, iter_indices, iter_vals, iter_models),
+                                     'elapsed': time.clock() - start_time,
+                                     'model': self.model_.get_state(),
+                                     'sample_counts': ckpt.sample_counts(candidates),
+                                     'random_state': ckpt.random_state()})
+
             # get next point to sample
-            next_ind = self.selection_policy_.choose_next()
+            with inst.timer('bandit_select'):
+                next_ind = self.selection_policy_.choose_next()
 
             # evaluate the function at the given point (can be nondeterministic)
             prev_ind_val = next_ind_val
-            next_ind_val = self.objective_.evaluate(candidates[next_ind])
+            with inst.timer('bandit_evaluate'):
+                next_ind_val = self.objective_.evaluate(candidates[next_ind])
 
             # snapshot the model and whatnot
             if (k % snapshot_rate) == 0:
@@ -107,10 +137,13 @@ class DiscreteAdaptiveSampler(solvers.DiscreteSamplingSolver):
                 iters.append(k)
                 iter_indices.append(next_ind)
                 iter_vals.append(next_ind_val)
-                iter_models.append(self.model_.snapshot())
+                with inst.timer('bandit_snapshot'):
+                    iter_models.append(self.model_.snapshot())
 
             # update the model (e.g. posterior update, grasp pruning)
-            self.model_.update(next_ind, next_ind_val)
+            with inst.timer('bandit_update'):
+                self.model_.update(next_ind, next_ind_val)
+            inst.count('bandit_pulls')
 
             # check termination condiation
             terminate = termination_condition(k, cur_val = next_ind_val, prev_val = prev_ind_val, model = self.model_)
@@ -134,16 +167,21 @@ class DiscreteAdaptiveSampler(solvers.DiscreteSamplingSolver):
         num_best = best_indices.shape[0]
         for i in range(num_best):
             best_candidates.append(best_indices[i])
-        return AdaptiveSamplingResult(best_candidates, best_pred_means, best_pred_vars, total_duration,
-                                      times, iters, iter_indices, iter_vals, iter_models)
+        result = AdaptiveSamplingResult(best_candidates, best_pred_means, best_pred_vars, total_duration,
+                                        times, iters, iter_indices, iter_vals, iter_models)
+        if checkpoint is not None:
+            checkpoint.save({'result': result, 'sample_counts': ckpt.sample_counts(candidates),
+                             'random_state': ckpt.random_state()})
+        return result
 
 
 # Beta-Bernoulli bandit models: so easy!
 class BetaBernoulliBandit(DiscreteAdaptiveSampler):
     """ Performs uniform allocation to get the candidate that maximizes the mean value of the objective"""
-    def __init__(self, objective, candidates, policy, alpha_prior = 1.0, beta_prior = 1.0):
+    def __init__(self, objective, candidates, policy, alpha_prior = 1.0, beta_prior = 1.0, seed = None):
         self.num_candidates_ = len(candidates)
-        self.model_ = models.BetaBernoulliModel(self.num_candidates_, alpha_prior, beta_prior)
+        self.seed_ = seed
+        self.model_ = models.BetaBernoulliModel(self.num_candidates_, alpha_prior, beta_prior, seed)
         self.selection_policy_ = policy
         self.selection_policy_.set_model(self.model_)
 
@@ -152,61 +190,65 @@ class BetaBernoulliBandit(DiscreteAdaptiveSampler):
     def reset_model(self, candidates):
         """ Needed to independently maximize over subsets of data """
         num_subcandidates = len(candidates)
-        self.model_ = models.BetaBernoulliModel(self.num_candidates_, self.model_.alpha_prior_, self.model_.beta_prior_)
+        self.model_ = models.BetaBernoulliModel(self.num_candidates_, self.model_.alpha_prior_, self.model_.beta_prior_,
+                                                self.seed_)
         self.selection_policy_.set_model(self.model_) # always update the selection policy!
 
 class UniformAllocationMean(BetaBernoulliBandit):
     """ Performs uniform allocation to get the candidate that maximizes the mean value of the objective"""
-    def __init__(self, objective, candidates, alpha_prior = 1.0, beta_prior = 1.0):
+    def __init__(self, objective, candidates, alpha_prior = 1.0, beta_prior = 1.0, seed = None):
         self.selection_policy_ = dcsp.UniformSelectionPolicy()
-        BetaBernoulliBandit.__init__(self, objective, candidates, self.selection_policy_, alpha_prior, beta_prior)
+        BetaBernoulliBandit.__init__(self, objective, candidates, self.selection_policy_, alpha_prior, beta_prior, seed)
 
 class ThompsonSampling(BetaBernoulliBandit):
     """ Performs thompson sampling to get the candidate that maximizes the mean value of the objective"""
-    def __init__(self, objective, candidates, alpha_prior = 1.0, beta_prior = 1.0):
+    def __init__(self, objective, candidates, alpha_prior = 1.0, beta_prior = 1.0, seed = None):
         self.selection_policy_ = dcsp.ThompsonSelectionPolicy()
-        BetaBernoulliBandit.__init__(self, objective, candidates, self.selection_policy_, alpha_prior, beta_prior)
+        BetaBernoulliBandit.__init__(self, objective, candidates, self.selection_policy_, alpha_prior, beta_prior, seed)
 
 class GittinsIndex98(BetaBernoulliBandit):
     """ Performs Gittins index policy with gamma = 0.98 to get the candidate that maximizes the mean value of the objective"""
-    def __init__(self, objective, candidates, alpha_prior = 1.0, beta_prior = 1.0):
-        # NOTE: priors will be rounded to the nearest integers
+    def __init__(self, objective, candidates, alpha_prior = 1.0, beta_prior = 1.0, seed = None):
+        # NOTE: fractional priors are interpolated in the index table
         self.selection_policy_ = dcsp.BetaBernoulliGittinsIndex98Policy()
-        BetaBernoulliBandit.__init__(self, objective, candidates, self.selection_policy_, alpha_prior, beta_prior)
+        BetaBernoulliBandit.__init__(self, objective, candidates, self.selection_policy_, alpha_prior, beta_prior, seed)
 
 # Gaussian bandit models
 class GaussianBandit(DiscreteAdaptiveSampler):
-    def __init__(self, objective, candidates, policy, mean_prior=0.5, sigma=1e-2):
+    def __init__(self, objective, candidates, policy, mean_prior=0.5, sigma=1e-2, seed=None):
         self.num_candidates_ = len(candidates)
-        self.model_ = models.GaussianModel(self.num_candidates_, mean_prior, sigma)
+        self.seed_ = seed
+        self.model_ = models.GaussianModel(self.num_candidates_, mean_prior, sigma, seed)
         self.selection_policy_ = policy
         self.selection_policy_.set_model(self.model_)
 
         DiscreteAdaptiveSampler.__init__(self, objective, candidates, self.model_, self.selection_policy_)
 
     def reset_model(self, candidates):
-        self.model_ = models.GaussianModel(self.num_candidates_, self.model_.mean_prior_, self.model_.sigma_)
+        self.model_ = models.GaussianModel(self.num_candidates_, self.model_.mean_prior_, self.model_.sigma_, self.seed_)
         self.selection_policy_.set_model(self.model_) # always update the selection policy!
 
 class GaussianUniformAllocationMean(GaussianBandit):
-    def __init__(self, objective, candidates, mean_prior=0.5, sigma=1e-2):
-        GaussianBandit.__init__(self, objective, candidates, dcsp.UniformSelectionPolicy(), mean_prior, sigma)
+    def __init__(self, objective, candidates, mean_prior=0.5, sigma=1e-2, seed=None):
+        GaussianBandit.__init__(self, objective, candidates, dcsp.UniformSelectionPolicy(), mean_prior, sigma, seed)
 
 class GaussianThompsonSampling(GaussianBandit):
-    def __init__(self, objective, candidates, mean_prior=0.5, sigma=1e-2):
-        GaussianBandit.__init__(self, objective, candidates, dcsp.ThompsonSelectionPolicy(), mean_prior, sigma)
+    def __init__(self, objective, candidates, mean_prior=0.5, sigma=1e-2, seed=None):
+        GaussianBandit.__init__(self, objective, candidates, dcsp.ThompsonSelectionPolicy(), mean_prior, sigma, seed)
 
 class GaussianUCBSampling(GaussianBandit):
-    def __init__(self, objective, candidates, mean_prior=0.5, sigma=1e-2):
-        GaussianBandit.__init__(self, objective, candidates, dcsp.GaussianUCBPolicy(), mean_prior, sigma)
+    def __init__(self, objective, candidates, mean_prior=0.5, sigma=1e-2, seed=None):
+        GaussianBandit.__init__(self, objective, candidates, dcsp.GaussianUCBPolicy(), mean_prior, sigma, seed)
 
 
 # Correlated Beta-Bernoulli bandit models
 class CorrelatedBetaBernoulliBandit(DiscreteAdaptiveSampler):
     """ Performs uniform allocation to get the candidate that maximizes the mean value of the objective"""
-    def __init__(self, objective, candidates, policy, nn, kernel, tolerance=1e-4, alpha_prior=1.0, beta_prior=1.0, p=0.95):
+    def __init__(self, objective, candidates, policy, nn, kernel, tolerance=1e-4, alpha_prior=1.0, beta_prior=1.0, p=0.95,
+                 seed=None):
         self.num_candidates_ = len(candidates)
-        self.model_ = models.CorrelatedBetaBernoulliModel(candidates, nn, kernel, tolerance, alpha_prior, beta_prior, p)
+        self.seed_ = seed
+        self.model_ = models.CorrelatedBetaBernoulliModel(candidates, nn, kernel, tolerance, alpha_prior, beta_prior, p, seed)
         self.selection_policy_ = policy
         self.selection_policy_.set_model(self.model_)
 
@@ -216,36 +258,36 @@ class CorrelatedBetaBernoulliBandit(DiscreteAdaptiveSampler):
         """ Needed to independently maximize over subsets of data """
         self.model_ = models.CorrelatedBetaBernoulliModel(
             self.candidates_, self.model_.nn_, self.model_.kernel_,
-            self.model_.tolerance_, self.model_.alpha_prior_, self.model_.beta_prior_, p=self.model_.p_
+            self.model_.tolerance_, self.model_.alpha_prior_, self.model_.beta_prior_, p=self.model_.p_, seed=self.seed_
         )
         self.selection_policy_.set_model(self.model_) # always update the selection policy!
 
 class CorrelatedThompsonSampling(CorrelatedBetaBernoulliBandit):
     def __init__(self, objective, candidates, nn, kernel,
-                 tolerance=1e-4, alpha_prior=1.0, beta_prior=1.0, p=0.95):
+                 tolerance=1e-4, alpha_prior=1.0, beta_prior=1.0, p=0.95, seed=None):
         CorrelatedBetaBernoulliBandit.__init__(
             self, objective, candidates, dcsp.ThompsonSelectionPolicy(),
-            nn, kernel, tolerance, alpha_prior, beta_prior, p
+            nn, kernel, tolerance, alpha_prior, beta_prior, p, seed
         )
 
 class CorrelatedBayesUCB(CorrelatedBetaBernoulliBandit):
     """ Performs Gittins index policy with gamma = 0.98 to get the candidate that maximizes the mean value of the objective"""
     def __init__(self, objective, candidates, nn, kernel, tolerance=1e-4,
-                 alpha_prior=1.0, beta_prior=1.0, horizon=1000, c=6, p=0.95):
+                 alpha_prior=1.0, beta_prior=1.0, horizon=1000, c=6, p=0.95, seed=None):
         policy = dcsp.BetaBernoulliBayesUCBPolicy(horizon=horizon, c=c)
         CorrelatedBetaBernoulliBandit.__init__(
             self, objective, candidates, policy,
-            nn, kernel, tolerance, alpha_prior, beta_prior, p
+            nn, kernel, tolerance, alpha_prior, beta_prior, p, seed
         )
 
 class CorrelatedGittins(CorrelatedBetaBernoulliBandit):
     """ Performs Gittins index policy with gamma = 0.98 to get the candidate that maximizes the mean value of the objective"""
     def __init__(self, objective, candidates, nn, kernel, tolerance=1e-4,
-                 alpha_prior=1.0, beta_prior=1.0, p=0.95):
+                 alpha_prior=1.0, beta_prior=1.0, p=0.95, seed=None):
         policy = dcsp.BetaBernoulliGittinsIndex98Policy()
         CorrelatedBetaBernoulliBandit.__init__(
             self, objective, candidates, policy,
-            nn, kernel, tolerance, alpha_prior, beta_prior, p
+            nn, kernel, tolerance, alpha_prior, beta_prior, p, seed
         )
 
 class RandomVariable:
@@ -277,6 +319,34 @@ class BernoulliRV(RandomVariable):
     def __repr__(self):
         return 'Bernoulli({})'.format(self.p_)
 
+class PreallocatedBernoulliRV(BernoulliRV):
+    """ Bernoulli RV that draws its samples up front and steps through them with sample_count_, like ForceClosureRV """
+    def __init__(self, p, num_samples):
+        BernoulliRV.__init__(self, p)
+        self.samples_ = scipy.stats.bernoulli.rvs(p, size=num_samples)
+        self.sample_count_ = 0
+
+    def sample_success(self):
+        sample = self.samples_[self.sample_count_]
+        self.sample_count_ = self.sample_count_ + 1
+        return sample
+
+class PreemptionError(Exception):
+    pass
+
+class PreemptedObjective(objectives.RandomBinaryObjective):
+    """ Random binary objective that raises PreemptionError after max_evals evaluations, to simulate a preempted node """
+    def __init__(self, max_evals = None):
+        objectives.RandomBinaryObjective.__init__(self)
+        self.max_evals_ = max_evals
+        self.num_evals_ = 0
+
+    def evaluate(self, x):
+        if self.max_evals_ is not None and self.num_evals_ >= self.max_evals_:
+            raise PreemptionError()
+        self.num_evals_ = self.num_evals_ + 1
+        return objectives.RandomBinaryObjective.evaluate(self, x)
+
 # Tests
 NUM_CANDIDATES = 100
 MAX_ITERS = 3000
@@ -357,7 +427,7 @@ def test_thompson_sampling(num_candidates=NUM_CANDIDATES, random=False):
 
     # solve using uniform allocation
     obj = objectives.RandomBinaryObjective()
-    ua = ThompsonSampling(obj, candidates)
+    ua = ThompsonSampling(obj, candidates, seed=1000)
 
     result = ua.solve(termination_condition = tc.MaxIterTerminationCondition(MAX_ITERS), snapshot_rate = SNAPSHOT_RATE)
 
@@ -377,6 +447,40 @@ def test_thompson_sampling(num_candidates=NUM_CANDIDATES, random=False):
 
     return result
 
+def run_checkpointed_trial(checkpointer, max_evals=None, num_candidates=20, max_iters=50):
+    """ Runs uniform allocation and then Thompson sampling on the same candidates, like a trial of label_correlated """
+    np.random.seed(1000)
+    candidates = [PreallocatedBernoulliRV(p, 2 * (max_iters + 1)) for p in np.random.rand(num_candidates)]
+    obj = PreemptedObjective(max_evals)
+    results = []
+    for name, sampler_class in [('ua', UniformAllocationMean), ('ts', ThompsonSampling)]:
+        sampler = sampler_class(obj, candidates, seed=1000)
+        results.append(sampler.solve(termination_condition = tc.MaxIterTerminationCondition(max_iters), snapshot_rate = 1,
+                                     checkpoint = checkpointer.solver_checkpoint(name)))
+    return results, ckpt.sample_counts(candidates)
+
+def test_checkpoint_resume(checkpoint_dir='bandit_checkpoint_test'):
+    import shutil
+    expected_results, expected_counts = run_checkpointed_trial(ckpt.Checkpointer(checkpoint_dir, interval=20))
+    shutil.rmtree(checkpoint_dir)
+
+    # preempt during uniform allocation, during Thompson sampling before its first checkpoint and after it
+    for max_evals in [30, 55, 85]:
+        try:
+            run_checkpointed_trial(ckpt.Checkpointer(checkpoint_dir, interval=20), max_evals)
+            assert False, 'Trial was not preempted'
+        except PreemptionError:
+            pass
+        results, counts = run_checkpointed_trial(ckpt.Checkpointer(checkpoint_dir, interval=20))
+        shutil.rmtree(checkpoint_dir)
+
+        assert counts == expected_counts
+        for result, expected in zip(results, expected_results):
+            assert result.best_candidates == expected.best_candidates
+            assert result.indices == expected.indices
+            assert result.vals == expected.vals
+    logging.info('Checkpoint resume test passed!')
+
 def test_gittins_indices_98(num_candidates=NUM_CANDIDATES):
     # get candidates
     np.random.seed(1000)
@@ -454,7 +558,7 @@ def test_gaussian_thompson_sampling(num_candidates=NUM_CANDIDATES):
 
     # solve using Thompson sampling
     obj = objectives.RandomBinaryObjective()
-    ts = GaussianThompsonSampling(obj, candidates)
+    ts = GaussianThompsonSampling(obj, candidates, seed=1000)
     result = ts.solve(termination_condition=tc.MaxIterTerminationCondition(MAX_ITERS), snapshot_rate=SNAPSHOT_RATE)
 
     # check result (not guaranteed to work in finite iterations but whatever)
@@ -521,7 +625,7 @@ def test_correlated_thompson_sampling(num_candidates=NUM_CANDIDATES, sig=1.0, ep
 
     # solve using Thompson sampling
     obj = objectives.RandomBinaryObjective()
-    ts = CorrelatedThompsonSampling(obj, candidates, nn, kernel, tolerance=eps)
+    ts = CorrelatedThompsonSampling(obj, candidates, nn, kernel, tolerance=eps, seed=1000)
     result = ts.solve(termination_condition=tc.MaxIterTerminationCondition(MAX_ITERS), snapshot_rate=SNAPSHOT_RATE)
 
     # check result (not guaranteed to work in finite iterations but whatever)
@@ -598,7 +702,7 @@ def test_ua_vs_thompson(num_trials = 20, num_candidates=1000, brute_iters=50000,
         ua = UniformAllocationMean(obj, candidates)
         ua_result = ua.solve(termination_condition = tc.MaxIterTerminationCondition(brute_iters), snapshot_rate = snapshot_rate)
 
-        ts = ThompsonSampling(obj, candidates)
+        ts = ThompsonSampling(obj, candidates, seed=[1000, i])
         ts_result = ts.solve(termination_condition = tc.MaxIterTerminationCondition(max_iters), snapshot_rate = snapshot_rate)
 
         # check result (not guaranteed to work in finite iterations but whatever)
@@ -706,6 +810,7 @@ def test_ua_vs_thompson(num_trials = 20, num_candidates=1000, brute_iters=50000,
 
 if __name__ == '__main__':
     logging.getLogger().setLevel(logging.DEBUG)
+    # test_checkpoint_resume()
     # test_uniform_alloc()
     # test_thompson_sampling()
     # test_gittins_indices_98()
@@ -7,12 +7,25 @@ from abc import ABCMeta, abstractmethod
 
 import logging
 import numpy as np
-import scipy.io
 import scipy.stats as ss
 
+import gittins_indices
 import models
 import IPython
 
+def argmax_random_tie(values):
+    """
+    Returns the index of the maximal value, breaking ties uniformly at random. Only scans the array for ties when
+    the maximum is not unique
+    """
+    max_index = np.argmax(values)
+    max_value = values[max_index]
+    num_max_indices = np.count_nonzero(values == max_value)
+    if num_max_indices == 1:
+        return max_index
+    max_indices = np.flatnonzero(values == max_value)
+    return max_indices[np.random.randint(num_max_indices)]
+
 class DiscreteSelectionPolicy:
     __metaclass__ = ABCMeta
 
@@ -59,45 +72,29 @@ class ThompsonSelectionPolicy(DiscreteSelectionPolicy):
         sampled_values = self.model_.sample()
         if stop:
             IPython.embed()
-        max_indices = np.where(sampled_values == np.max(sampled_values))[0]
-        num_max_indices = max_indices.shape[0]
-        next_index = np.random.choice(num_max_indices)
-        return max_indices[next_index]        
+        return argmax_random_tie(sampled_values)
 
-class BetaBernoulliGittinsIndex98Policy(DiscreteSelectionPolicy):
-    """ Chooses the next point using the BetaBernoulli gittins index policy with gamma = 0.98"""
-    def __init__(self, model = None):
-        self.indices_ = scipy.io.loadmat('data/bandits/gittins_indices_98.mat')
-        self.indices_ = self.indices_['indices']
+class BetaBernoulliGittinsIndexPolicy(DiscreteSelectionPolicy):
+    """ Chooses the next point using the BetaBernoulli gittins index policy with discount gamma """
+    def __init__(self, gamma = 0.98, model = None):
+        self.indices_ = gittins_indices.gittins_index_table(gamma)
         DiscreteSelectionPolicy.__init__(self, model)
 
     def choose_next(self):
-        """ Returns the index of the maximal random sample, breaking ties uniformly at random"""
+        """ Returns the index with the maximal gittins index, breaking ties uniformly at random"""
         if self.model_ is None:
             raise ValueError('Must set predictive model')
         if not isinstance(self.model_, models.BetaBernoulliModel):
             raise ValueError('Gittins index policy can only be used with Beta-bernoulli models')
         
-        alphas = self.model_.posterior_alphas.astype(np.uint64)
-        betas = self.model_.posterior_betas.astype(np.uint64)
-
-        # subtract one, since the indices are intended for matlab 1 indexing
-        alphas = alphas - 1
-        betas = betas - 1
-
-        # snap alphas and betas to boundaries of index matrix
-        alphas[alphas >= self.indices_.shape[0]] = self.indices_.shape[0] - 1
-        betas[betas >= self.indices_.shape[1]] = self.indices_.shape[1] - 1
-        np.round(alphas)
-        np.round(betas)
-
-        # find maximum of gittins indices
-        gittins_indices = self.indices_[alphas, betas]
+        # fractional alphas and betas of correlated models are interpolated
+        gittins = self.indices_.lookup(self.model_.posterior_alphas, self.model_.posterior_betas)
+        return argmax_random_tie(gittins)
 
-        max_indices = np.where(gittins_indices == np.max(gittins_indices))[0]
-        num_max_indices = max_indices.shape[0]
-        next_index = np.random.choice(num_max_indices)
-        return max_indices[next_index]        
+class BetaBernoulliGittinsIndex98Policy(BetaBernoulliGittinsIndexPolicy):
+    """ Chooses the next point using the BetaBernoulli gittins index policy with gamma = 0.98"""
+    def __init__(self, model = None):
+        BetaBernoulliGittinsIndexPolicy.__init__(self, 0.98, model)
 
 class BetaBernoulliBayesUCBPolicy(DiscreteSelectionPolicy):
     """ Chooses the next point using the Bayes UCB selection policy"""
@@ -117,11 +114,8 @@ class BetaBernoulliBayesUCBPolicy(DiscreteSelectionPolicy):
         intervals = ss.beta.interval(gamma, alphas, betas)
         ucbs = intervals[1]
 
-        max_indices = np.where(ucbs == np.max(ucbs))[0]
-        num_max_indices = max_indices.shape[0]
-        next_index = np.random.choice(num_max_indices)
         self.t_ += 1
-        return max_indices[next_index]        
+        return argmax_random_tie(ucbs)
 
 class GaussianUCBPolicy(DiscreteSelectionPolicy):
     def __init__(self, beta=1.0):
@@ -136,8 +130,4 @@ class GaussianUCBPolicy(DiscreteSelectionPolicy):
             raise ValueError('GP-UCB can only be used with Gaussian models')
 
         ucb = self.model_.means + self.beta_ * np.sqrt(self.model_.variances)
-        max_ucb = np.max(ucb)
-        max_indices = np.where(ucb == max_ucb)[0]
-        num_max_indices = max_indices.shape[0]
-        next_index = np.random.choice(num_max_indices)
-        return max_indices[next_index]
+        return argmax_random_tie(ucb)
@@ -5,6 +5,7 @@ import sys
 import IPython
 
 import features as f
+import instrumentation as inst
 
 HEADER_SIZE = 8 #size of feature file header
 
@@ -18,6 +19,8 @@ class LocalFeatureFile:
     '''
     For reading and writing DexNet custom local feature desriptor files (.ftr)
     '''
+    use_cache = True # store parsed features next to the file in a binary .npz cache
+
     def __init__(self, filepath):
         '''
         Set the path to the file to open
@@ -39,25 +42,49 @@ class LocalFeatureFile:
         '''
         Read in the feature file. Currently hardcorded for SHOT features, will change later
         '''
+        cache_filepath = self.filepath_ + '.npz'
+        if LocalFeatureFile.use_cache and os.path.exists(cache_filepath) and \
+                os.path.getmtime(cache_filepath) >= os.path.getmtime(self.filepath_):
+            inst.count('feature_cache_hits')
+            cache = np.load(cache_filepath)
+            return f.BagOfFeatures(descriptors=cache['descriptors'], reference_frames=cache['reference_frames'],
+                                   keypoints=cache['keypoints'], normals=cache['normals'])
+
+        inst.count('feature_cache_misses')
+        descriptors, rfs, keypoints, normals = self.read_arrays()
+
+        # drop descriptors with nan or inf entries
+        valid = np.isfinite(descriptors).all(axis=1)
+        descriptors, rfs, keypoints, normals = descriptors[valid], rfs[valid], keypoints[valid], normals[valid]
+
+        if LocalFeatureFile.use_cache:
+            try:
+                np.savez(cache_filepath, descriptors=descriptors, reference_frames=rfs, keypoints=keypoints, normals=normals)
+            except IOError:
+                pass
+        return f.BagOfFeatures(descriptors=descriptors, reference_frames=rfs, keypoints=keypoints, normals=normals)
+
+    def read_arrays(self):
+        '''
+        Parse the whole feature file at once into arrays of descriptors, reference frames, keypoints and normals
+        '''
         feature_file = open(self.filepath_, 'r')
         num_descriptors = int(feature_file.readline())
         len_descriptors = int(feature_file.readline())
         len_rf = int(feature_file.readline())
-       
-        # initialize features object
-        features = f.BagOfFeatures()
-
-        # parse through the lines of data from the shot file to fill out the matrices
-        for i in range(num_descriptors):
-            p = feature_file.readline().split('\t')
-            rf, descriptor, keypoint, normal = [string_to_array(j) for j in p] 
-            if np.sum(np.isnan(descriptor)) == 0 and np.sum(np.isinf(descriptor)) == 0:
-                features.add(f.LocalFeature(descriptor, rf, keypoint, normal))
-
+        lines = feature_file.readlines()[:num_descriptors]
         feature_file.close()
 
-        # return feature object
-        return features
+        row_len = len_rf + len_descriptors + 6
+        data = np.fromstring(' '.join(lines).replace('\t', ' '), sep=' ')
+        if data.shape[0] != num_descriptors * row_len:
+            raise ValueError('Feature file %s does not contain %d descriptors of length %d' %(self.filepath_, num_descriptors, len_descriptors))
+        data = data.reshape(num_descriptors, row_len)
+        rfs = data[:,:len_rf]
+        descriptors = data[:,len_rf:len_rf+len_descriptors]
+        keypoints = data[:,len_rf+len_descriptors:len_rf+len_descriptors+3]
+        normals = data[:,len_rf+len_descriptors+3:]
+        return descriptors, rfs, keypoints, normals
 
     def write(self, mesh):
         '''
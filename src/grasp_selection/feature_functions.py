@@ -1,11 +1,14 @@
 from abc import ABCMeta, abstractmethod
 
+import hashlib
 import IPython
 import json_serialization as jsons
 import logging
 import matplotlib.pyplot as plt
+import multiprocessing as mp
 import numpy as np
 import os
+import pickle as pkl
 import scipy.signal as ss
 
 from contacts import SurfaceWindow
@@ -231,16 +234,18 @@ class CurvatureWindowFeatureExtractor(WindowFeatureExtractor):
 
 class GravityFeatureExtractor(FeatureExtractor):
     """Abstract class for extracting gravity-related features."""
-    def __init__(self, graspable, grasp, gravity_force, feature_weight=1.0):
+    def __init__(self, graspable, grasp, gravity_force, feature_weight=1.0, moment_arms=None):
         self.graspable_ = graspable
         self.grasp_ = grasp
         self.gravity_force_ = gravity_force # np 3 array, e.g. np.array([0, 0, -mg])
         self.feature_weight_ = feature_weight
 
-        # Compute moment arms
-        _, (c1, c2) = grasp.close_fingers(graspable)
-        self.moment1_ = self.graspable_.moment_arm(c1.point)
-        self.moment2_ = self.graspable_.moment_arm(c2.point)
+        # Compute moment arms (unless already known from the contacts)
+        if moment_arms is None:
+            _, (c1, c2) = grasp.close_fingers(graspable)
+            moment_arms = (self.graspable_.moment_arm(c1.point),
+                           self.graspable_.moment_arm(c2.point))
+        self.moment1_, self.moment2_ = moment_arms
 
     def angle(self, v1, v2):
         v1 = v1 / np.linalg.norm(v1)
@@ -285,12 +290,90 @@ GRAVITY_FORCE = 1.0 * np.array([0, 0, -9.8]) # TODO change this
 
 # Graspable feature functions
 
+def surface_rep(graspable, grasp, window_width, window_steps):
+    """Computes the unweighted surface windows and moment arms for a single grasp.
+    Returns a tuple (s1, s2, moment1, moment2), or None if the contacts or
+    windows could not be found."""
+    try:
+        s1, s2, c1, c2 = grasp.surface_information(graspable, window_width, window_steps)
+    except ValueError as e:
+        logging.warning('Failed to extract surface info with error');
+        logging.warning(str(e))
+        return None
+
+    # if computing either surface fails, don't set surface_features
+    if s1 is None or s2 is None or c1 is None or c2 is None:
+        return None
+    return s1, s2, graspable.moment_arm(c1.point), graspable.moment_arm(c2.point)
+
+# state shared with feature worker processes, set once per pool by the initializer
+_worker_graspable = None
+_worker_grasps = None
+_worker_window = None
+
+def _init_surface_worker(graspable, grasps, window_width, window_steps):
+    global _worker_graspable, _worker_grasps, _worker_window
+    _worker_graspable = graspable
+    _worker_grasps = grasps
+    _worker_window = (window_width, window_steps)
+
+def _surface_worker(index):
+    window_width, window_steps = _worker_window
+    return surface_rep(_worker_graspable, _worker_grasps[index], window_width, window_steps)
+
+class SurfaceFeatureCache:
+    """Persistent cache of unweighted surface windows and moment arms.
+    Entries are keyed by object key, a hash of the grasp parameters and the window
+    configuration, so changing feature weights never invalidates the cache."""
+    def __init__(self, cache_dir, window_width, window_steps, window_sigma):
+        self.cache_dir_ = cache_dir
+        window_config = repr((float(window_width), int(window_steps), float(window_sigma)))
+        self.window_key_ = hashlib.sha1(window_config).hexdigest()[:16]
+
+    @staticmethod
+    def grasp_key(grasp):
+        """ Hash of the parameters that determine the contacts of a grasp """
+        params = np.r_[grasp.center, grasp.axis, grasp.grasp_width,
+                       grasp.jaw_width, grasp.approach_angle].astype(np.float64)
+        return hashlib.sha1(params.tostring()).hexdigest()
+
+    def filename(self, obj_key):
+        return os.path.join(self.cache_dir_, obj_key, 'surface_%s.pkl' %(self.window_key_))
+
+    def load(self, obj_key):
+        """ Returns the dictionary of cached entries for an object (empty if none) """
+        filename = self.filename(obj_key)
+        if not os.path.exists(filename):
+            return {}
+        try:
+            with open(filename, 'rb') as f:
+                return pkl.load(f)
+        except Exception as e:
+            logging.warning('Failed to read feature cache %s: %s' %(filename, str(e)))
+            return {}
+
+    def save(self, obj_key, entries):
+        """ Atomically writes the dictionary of entries for an object """
+        filename = self.filename(obj_key)
+        try:
+            os.makedirs(os.path.dirname(filename))
+        except os.error:
+            pass
+
+        tmp_filename = '%s.%d.tmp' %(filename, os.getpid())
+        with open(tmp_filename, 'wb') as f:
+            pkl.dump(entries, f, pkl.HIGHEST_PROTOCOL)
+        os.rename(tmp_filename, filename)
+
 class GraspableFeatureExtractor:
     """Class for extracting features from a graspable object and an arbitrary
     number of grasps."""
     def __init__(self, graspable, config):
         self.graspable_ = graspable
         self.features_ = {} # to cache feature computation
+        self.surface_reps_ = {} # unweighted surface info, by grasp key
+        self.cache_loaded_ = False
+        self.cache_dirty_ = False # surface info computed since the last write to the persistent cache
         self._parse_config(config)
 
     def _parse_config(self, config):
@@ -299,6 +382,15 @@ class GraspableFeatureExtractor:
         self.window_steps_ = config['window_steps']
         self.window_sigma_ = config['window_sigma']
 
+        # parallelism and persistent caching
+        self.num_processes_ = 1
+        if 'feature_num_processes' in config and config['feature_num_processes'] is not None:
+            self.num_processes_ = config['feature_num_processes']
+        self.cache_ = None
+        if 'feature_cache_dir' in config and config['feature_cache_dir']:
+            self.cache_ = SurfaceFeatureCache(config['feature_cache_dir'], self.window_width_,
+                                              self.window_steps_, self.window_sigma_)
+
         # feature weights
         self.proj_win_weight_ = Weight(config['weight_proj_win'])
         self.grad_x_weight_ = Weight(config['weight_grad_x'])
@@ -321,27 +413,55 @@ class GraspableFeatureExtractor:
             GradYWindowFeatureExtractor, CurvatureWindowFeatureExtractor
         ]
 
-    def _compute_feature_rep(self, grasp, root_name=None):
-        """Extracts features from a graspable object and a single grasp."""
-        # look in cache for features
-        if grasp in self.features_:
-            return self.features_[grasp]
-
-        # get grasp windows
-        try:
-            s1, s2, c1, c2 = grasp.surface_information(self.graspable_,
-                                                       self.window_width_, self.window_steps_)
-        except ValueError as e:
-            logging.warning('Failed to extract surface info with error');
-            logging.warning(str(e))
-            s1 = None
-            s2 = None
-            c1 = None
-            c2 = None
-            
-        # if computing either surface fails, don't set surface_features
-        if s1 is None or s2 is None or c1 is None or c2 is None:
+    @property
+    def use_persistent_cache(self):
+        return self.cache_ is not None and self.graspable_.key != ''
+
+    def _compute_surface_reps(self, grasps):
+        """Returns the unweighted surface info for each grasp, reading from the
+        persistent cache when possible and computing the rest in parallel."""
+        grasp_keys = [SurfaceFeatureCache.grasp_key(grasp) for grasp in grasps]
+        if self.use_persistent_cache and not self.cache_loaded_:
+            self.surface_reps_.update(self.cache_.load(self.graspable_.key))
+            self.cache_loaded_ = True
+
+        missing = [i for i, k in enumerate(grasp_keys) if k not in self.surface_reps_]
+        logging.info('Computing surface info for %d of %d grasps' %(len(missing), len(grasps)))
+        if len(missing) == 0:
+            return [self.surface_reps_[k] for k in grasp_keys]
+
+        if self.num_processes_ > 1 and len(missing) > 1:
+            pool = mp.Pool(min(self.num_processes_, len(missing)), _init_surface_worker,
+                           (self.graspable_, grasps, self.window_width_, self.window_steps_))
+            try:
+                reps = pool.map(_surface_worker, missing)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            reps = []
+            for i in missing:
+                logging.info('Computing features for grasp %d' %(i))
+                reps.append(surface_rep(self.graspable_, grasps[i], self.window_width_, self.window_steps_))
+
+        for i, rep in zip(missing, reps):
+            self.surface_reps_[grasp_keys[i]] = rep
+        self.cache_dirty_ = True
+        return [self.surface_reps_[k] for k in grasp_keys]
+
+    def flush(self):
+        """Writes the surface info computed since the last flush to the persistent
+        cache. Called once per batch by compute_all_features and after each new
+        grasp by _compute_feature_rep."""
+        if self.use_persistent_cache and self.cache_dirty_:
+            self.cache_.save(self.graspable_.key, self.surface_reps_)
+        self.cache_dirty_ = False
+
+    def _feature_rep_from_surface(self, grasp, surface_rep, root_name=None):
+        """Creates weighted feature extractors from unweighted surface info."""
+        if surface_rep is None:
             return None
+        s1, s2, moment1, moment2 = surface_rep
 
         # compute surface features
         surface_features = []
@@ -362,11 +482,12 @@ class GraspableFeatureExtractor:
 
         # compute gravity features
         gravity_args = (self.graspable_, grasp, GRAVITY_FORCE)
+        moment_arms = (moment1, moment2)
         gravity_features = [
-#            MomentArmFeatureExtractor(*gravity_args, feature_weight=self.gravity_weight_),
-            MomentArmMagnitudeFeatureExtractor(*gravity_args, feature_weight=self.gravity_weight_),
-            GraspAxisGravityAngleFeatureExtractor(*gravity_args, feature_weight=0.0),
-            MomentArmGravityAngleFeatureExtractor(*gravity_args, feature_weight=0.0),
+#            MomentArmFeatureExtractor(*gravity_args, feature_weight=self.gravity_weight_, moment_arms=moment_arms),
+            MomentArmMagnitudeFeatureExtractor(*gravity_args, feature_weight=self.gravity_weight_, moment_arms=moment_arms),
+            GraspAxisGravityAngleFeatureExtractor(*gravity_args, feature_weight=0.0, moment_arms=moment_arms),
+            MomentArmGravityAngleFeatureExtractor(*gravity_args, feature_weight=0.0, moment_arms=moment_arms),
         ]
 
         # compute additional features
@@ -374,19 +495,42 @@ class GraspableFeatureExtractor:
             root_name = self.graspable_.key
         features = AggregatedFeatureExtractor(
             surface_features + grasp_pose_features + gravity_features, root_name)
-        self.features_[grasp] = features
+        return features
 
+    def _compute_feature_rep(self, grasp, root_name=None):
+        """Extracts features from a graspable object and a single grasp.
+        New surface info is written to the persistent cache right away, so use
+        compute_all_features to write it once for many grasps."""
+        # look in cache for features
+        if grasp in self.features_:
+            return self.features_[grasp]
+
+        surface_rep = self._compute_surface_reps([grasp])[0]
+        self.flush()
+        features = self._feature_rep_from_surface(grasp, surface_rep, root_name)
+        if features is not None:
+            self.features_[grasp] = features
         return features
 
     def compute_all_features(self, grasps):
         """Convenience function for extracting features from many grasps."""
         num_digits = len(str(len(grasps)-1)) # for padding with zeros
+        uncached = [grasp for grasp in grasps if grasp not in self.features_]
+        if len(uncached) > 0:
+            self._compute_surface_reps(uncached)
+            self.flush()
+
         features = []
         for i, grasp in enumerate(grasps):
-            logging.info('Computing features for grasp %d' %(i))
-
-            feature = self._compute_feature_rep(
-                grasp, '%s_%s' %(self.graspable_.key, str(i).zfill(num_digits)))
+            if grasp in self.features_:
+                features.append(self.features_[grasp])
+                continue
+
+            surface_rep = self.surface_reps_[SurfaceFeatureCache.grasp_key(grasp)]
+            feature = self._feature_rep_from_surface(
+                grasp, surface_rep, '%s_%s' %(self.graspable_.key, str(i).zfill(num_digits)))
+            if feature is not None:
+                self.features_[grasp] = feature
             features.append(feature)
         return features
 
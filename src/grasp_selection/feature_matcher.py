@@ -5,6 +5,65 @@ import numpy as np
 import IPython
 from scipy import spatial
 
+def mutual_nearest_neighbors(source_descriptors, target_descriptors, ratio = None, leafsize = 16):
+    """
+    Finds the nearest target descriptor for each source descriptor with KD-trees and keeps the two-way matches
+    Params:
+        source_descriptors: (numpy N x D array) source feature descriptors
+        target_descriptors: (numpy M x D array) target feature descriptors
+        ratio: (float) if given, also require the nearest target to be closer than ratio times the second nearest
+        leafsize: (int) KD-tree leaf size
+    Returns:
+        source_closest: (numpy N int array) index of the nearest target descriptor for each source descriptor
+        is_match: (numpy N bool array) whether each source descriptor has a mutual match
+    """
+    num_neighbors = 2 if ratio is not None and target_descriptors.shape[0] > 1 else 1
+    target_tree = spatial.cKDTree(target_descriptors, leafsize=leafsize)
+    source_dists, source_closest = target_tree.query(source_descriptors, k=num_neighbors)
+    if num_neighbors > 1:
+        ratio_ok = source_dists[:,0] < ratio * source_dists[:,1]
+        source_closest = source_closest[:,0]
+    else:
+        ratio_ok = np.ones(source_descriptors.shape[0], dtype=np.bool)
+
+    source_tree = spatial.cKDTree(source_descriptors, leafsize=leafsize)
+    _, target_closest = source_tree.query(target_descriptors, k=1)
+    is_match = (target_closest[source_closest] == np.arange(source_descriptors.shape[0])) & ratio_ok
+    return source_closest, is_match
+
+class PointIndex:
+    """
+    KD-tree index from point coordinates to their row in an array of points, replacing linear scans
+    """
+    def __init__(self, points, eps = 1e-4, leafsize = 16):
+        self.points_ = points
+        self.eps_ = eps
+
+        # keep only the first of any repeated points, so lookups return the first matching row
+        order = np.lexsort(points.T) # stable, so repeated points stay in row order
+        sorted_points = points[order]
+        first = np.ones(order.shape[0], dtype=np.bool)
+        first[1:] = np.any(sorted_points[1:] != sorted_points[:-1], axis=1)
+        self.rows_ = order[first]
+        self.tree_ = None
+        if self.rows_.shape[0] > 0:
+            self.tree_ = spatial.cKDTree(points[self.rows_], leafsize=leafsize)
+
+    def lookup(self, point):
+        """ Returns the index of the nearest point within eps of the given point, or -1 """
+        return self.lookup_all(point[np.newaxis,:])[0]
+
+    def lookup_all(self, points):
+        """ Returns the indices of many points at once, -1 for points that are not in the index """
+        indices = -np.ones(points.shape[0], dtype=np.int)
+        if points.shape[0] == 0 or self.tree_ is None:
+            return indices
+        dists, nearest = self.tree_.query(points, k=1, distance_upper_bound=self.eps_)
+        found = np.isfinite(dists)
+        indices[found] = self.rows_[nearest[found]]
+        return indices
+
+
 class Correspondences:
     def __init__(self, index_map, source_points, target_points):
         self.index_map_ = index_map
@@ -63,9 +122,16 @@ class FeatureMatcher:
         pass
 
 class RawDistanceFeatureMatcher(FeatureMatcher):
+    def __init__(self, ratio = None):
+        """
+        Params:
+            ratio: (float) max ratio of the nearest to second nearest descriptor distance for a match, no test if None
+        """
+        self.ratio_ = ratio
+
     def match(self, source_obj_features, target_obj_features):
         """
-        Matches features between two graspable objects based on a full distance matrix
+        Matches features between two graspable objects using mutual nearest neighbors in descriptor space
         Params:
             source_obj_features: (BagOfFeatures) bag of the source objects features
             target_obj_features: (BagOfFeatures) bag of the target objects features
@@ -83,25 +149,10 @@ class RawDistanceFeatureMatcher(FeatureMatcher):
         source_keypoints = source_obj_features.keypoints
         target_keypoints = target_obj_features.keypoints
 
-        #calculate distance between this model's descriptors and each of the other_model's descriptors
-        dists = spatial.distance.cdist(source_descriptors, target_descriptors) 
-        
-        #calculate the indices of the target_model that minimize the distance to the descriptors in this model
-        source_closest_descriptors = dists.argmin(axis=1)
-        target_closest_descriptors = dists.argmin(axis=0)
-        match_indices = []
-        source_matched_points = np.zeros((0,3))
-        target_matched_points = np.zeros((0,3))
-
-        #calculate which points/indices the closest descriptors correspond to
-        for i, j in enumerate(source_closest_descriptors):
-            # for now, only keep correspondences that are a 2-way match
-            if target_closest_descriptors[j] == i:
-                match_indices.append(j)
-                source_matched_points = np.r_[source_matched_points, source_keypoints[i:i+1, :]]
-                target_matched_points = np.r_[target_matched_points, target_keypoints[j:j+1, :]]
-            else:
-                match_indices.append(-1)
-
+        # find the two-way nearest neighbors in descriptor space
+        source_closest_descriptors, is_match = mutual_nearest_neighbors(source_descriptors, target_descriptors,
+                                                                        ratio=self.ratio_)
+        match_indices = np.where(is_match, source_closest_descriptors, -1)
+        source_matched_points = source_keypoints[is_match]
+        target_matched_points = target_keypoints[source_closest_descriptors[is_match]]
         return Correspondences(match_indices, source_matched_points, target_matched_points)
-
@@ -38,37 +38,64 @@ class SHOTFeature(LocalFeature):
         LocalFeature.__init__(self, descriptor, rf, point, normal)
 
 class BagOfFeatures:
-    """ Actually just a list of features, but created for the sake of future bag-of-words reps """
-    def __init__(self, features = None):
-        self.features_ = features
-        if self.features_ is None:
-            self.features_ = []
-
-        self.num_features_ = len(self.features_)
+    """
+    Actually just a list of features, but created for the sake of future bag-of-words reps.
+    Stored as contiguous arrays of descriptors, reference frames, keypoints and normals, one row per feature
+    """
+    def __init__(self, features = None, descriptors = None, reference_frames = None, keypoints = None, normals = None):
+        self.descriptors_ = descriptors
+        self.reference_frames_ = reference_frames
+        self.keypoints_ = keypoints
+        self.normals_ = normals
+        self.num_features_ = 0 if descriptors is None else descriptors.shape[0]
+        if features is not None:
+            self.extend(features)
+
+    @staticmethod
+    def _stack(features):
+        return (np.array([f.descriptor for f in features]), np.array([f.reference_frame for f in features]),
+                np.array([f.keypoint for f in features]), np.array([f.normal for f in features]))
+
+    def _append_arrays(self, descriptors, reference_frames, keypoints, normals):
+        if self.num_features_ == 0:
+            self.descriptors_, self.reference_frames_, self.keypoints_, self.normals_ = \
+                descriptors, reference_frames, keypoints, normals
+        else:
+            self.descriptors_ = np.r_[self.descriptors_, descriptors]
+            self.reference_frames_ = np.r_[self.reference_frames_, reference_frames]
+            self.keypoints_ = np.r_[self.keypoints_, keypoints]
+            self.normals_ = np.r_[self.normals_, normals]
+        self.num_features_ = self.descriptors_.shape[0]
 
     def add(self, feature):
         """ Add a new feature to the bag """
-        self.features_.append(feature)
-        self.num_features_ = len(self.features_)        
+        self.extend([feature])
 
     def extend(self, features):
-        """ Add a list of features to the bag """
-        self.features_.extend(features)
-        self.num_features_ = len(self.features_)        
+        """ Add a list or bag of features to the bag """
+        if isinstance(features, BagOfFeatures):
+            if features.num_features > 0:
+                self._append_arrays(features.descriptors, features.reference_frames, features.keypoints, features.normals)
+        elif len(features) > 0:
+            self._append_arrays(*BagOfFeatures._stack(features))
 
     def feature(self, index):
         """ Returns a feature """
         if index < 0 or index >= self.num_features_:
             raise ValueError('Index %d out of range' %(index))
-        return self.features_[index]
+        return LocalFeature(self.descriptors_[index], self.reference_frames_[index], self.keypoints_[index],
+                            self.normals_[index])
 
     def feature_subset(self, indices):
-        """ Returns some subset of the features """
-        if isinstance(indices, np.ndarray):
-            indices = indices.tolist()
-        if not isinstance(indices, list):
-            raise ValueError('Can only index with lists')
-        return [self.features_[i] for i in indices]
+        """ Returns some subset of the features as a bag, sharing memory with this bag for slices """
+        if isinstance(indices, list):
+            indices = np.array(indices, dtype=np.int)
+        if not isinstance(indices, (np.ndarray, slice)):
+            raise ValueError('Can only index with lists, arrays or slices')
+        if self.num_features_ == 0:
+            return BagOfFeatures()
+        return BagOfFeatures(descriptors=self.descriptors_[indices], reference_frames=self.reference_frames_[indices],
+                             keypoints=self.keypoints_[indices], normals=self.normals_[indices])
 
     @property
     def num_features(self):
@@ -76,20 +103,20 @@ class BagOfFeatures:
 
     @property
     def descriptors(self):
-        """ Make a nice array of the descriptors """
-        return np.array([f.descriptor for f in self.features_])
+        """ Array of the descriptors """
+        return self.descriptors_ if self.num_features_ > 0 else np.array([])
 
     @property
     def reference_frames(self):
-        """ Make a nice array of the reference frames """
-        return np.array([f.reference_frame for f in self.features_])
+        """ Array of the reference frames """
+        return self.reference_frames_ if self.num_features_ > 0 else np.array([])
 
     @property
     def keypoints(self):
-        """ Make a nice array of the keypoints """
-        return np.array([f.keypoint for f in self.features_])
+        """ Array of the keypoints """
+        return self.keypoints_ if self.num_features_ > 0 else np.array([])
 
     @property
     def normals(self):
-        """ Make a nice array of the normals """
-        return np.array([f.normal for f in self.features_])
+        """ Array of the normals """
+        return self.normals_ if self.num_features_ > 0 else np.array([])
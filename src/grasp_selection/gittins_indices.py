@@ -0,0 +1,169 @@
+"""
+Gittins indices for Beta-Bernoulli bandits.
+Index tables are computed on demand for any discount by calibration against a grid of retirement rewards, stored
+as .npy files and memory-mapped so that processes on the same machine share a single copy
+"""
+import logging
+import numpy as np
+import os
+import time
+
+import instrumentation as inst
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'bandits')
+
+_tables = {} # tables already loaded by this process
+
+def compute_gittins_indices(gamma, max_count = 100, horizon = 100, num_lambdas = 1000):
+    """
+    Computes Gittins indices of Beta(alpha, beta) arms with integer alpha, beta in [1, max_count].
+    For every retirement reward on a grid over [0, 1] the value of each state is found by backward induction,
+    vectorized over the rewards and all states with the same number of observations. The index of a state is the
+    reward at which retiring and continuing are equally good, linearly interpolated between grid points.
+    Params:
+        gamma: (float) discount factor
+        max_count: (int) max alpha and beta in the table
+        horizon: (int) number of pulls to look ahead of the largest state in the table
+        num_lambdas: (int) number of retirement rewards in the calibration grid
+    Returns:
+        numpy max_count x max_count array, with the index of Beta(alpha, beta) at [alpha-1, beta-1]
+    """
+    lambdas = np.linspace(0, 1, num_lambdas)[:,np.newaxis]
+    retire_value = lambdas / (1 - gamma)
+    indices = np.zeros([max_count, max_count])
+    max_level = 2 * max_count + horizon
+
+    # past the lookahead, assume the arm is pulled forever at its posterior mean or retired
+    a = np.arange(1, max_level)
+    values = np.maximum(lambdas, a / float(max_level)) / (1 - gamma)
+
+    for n in range(max_level - 1, 1, -1):
+        a = np.arange(1, n)
+        mu = a / float(n)
+        continue_value = mu * (1 + gamma * values[:,1:]) + (1 - mu) * gamma * values[:,:-1]
+        advantage = continue_value - retire_value
+        values = np.maximum(retire_value, continue_value)
+
+        # the advantage of continuing decreases with the retirement reward, find where it crosses zero
+        in_table = (a <= max_count) & (n - a <= max_count)
+        if np.any(in_table):
+            adv = advantage[:,in_table]
+            last_pos = np.minimum(np.sum(adv > 0, axis=0) - 1, num_lambdas - 2)
+            cols = np.arange(adv.shape[1])
+            adv_lo = adv[last_pos, cols]
+            adv_hi = adv[last_pos + 1, cols]
+            frac = adv_lo / (adv_lo - adv_hi)
+            lambda_step = lambdas[1,0] - lambdas[0,0]
+            indices[a[in_table] - 1, n - a[in_table] - 1] = lambdas[last_pos,0] + frac * lambda_step
+    return indices
+
+class GittinsIndexTable(object):
+    """
+    Lookup of Beta-Bernoulli Gittins indices, bilinearly interpolated for fractional alpha and beta
+    (e.g. from correlated updates). States outside the table add the exploration bonus (index minus posterior mean)
+    of the state with the same mean on the table edge to their posterior mean, decayed like the posterior variance,
+    so indices are continuous across the edge.
+    """
+    def __init__(self, indices, gamma):
+        self.indices_ = indices
+        self.gamma_ = gamma
+
+    @property
+    def gamma(self):
+        return self.gamma_
+
+    @property
+    def max_count(self):
+        return self.indices_.shape[0]
+
+    def lookup(self, alphas, betas):
+        """
+        Returns the Gittins indices of arms with the given Beta posteriors
+        Params:
+            alphas, betas: (numpy arrays) posterior parameters, may be fractional
+        Returns:
+            numpy array of indices
+        """
+        alphas = np.maximum(np.asarray(alphas, dtype=np.float64), 1)
+        betas = np.maximum(np.asarray(betas, dtype=np.float64), 1)
+        gittins = alphas / (alphas + betas)
+
+        in_table = (alphas <= self.max_count) & (betas <= self.max_count)
+        if np.any(in_table):
+            gittins[in_table] = self._interpolate(alphas[in_table], betas[in_table])
+
+        # scale states outside the table onto its edge, keeping the posterior mean
+        outside = ~in_table
+        if np.any(outside):
+            counts = alphas[outside] + betas[outside]
+            scale = float(self.max_count) / np.maximum(alphas[outside], betas[outside])
+            edge_alphas = np.clip(alphas[outside] * scale, 1, self.max_count)
+            edge_betas = np.clip(betas[outside] * scale, 1, self.max_count)
+            edge_counts = edge_alphas + edge_betas
+            bonus = self._interpolate(edge_alphas, edge_betas) - edge_alphas / edge_counts
+            gittins[outside] += bonus * (edge_counts + 1) / (counts + 1)
+        return gittins
+
+    def _interpolate(self, alphas, betas):
+        """ Bilinearly interpolates the table at alphas and betas in [1, max_count] """
+        x = alphas - 1
+        y = betas - 1
+        x0 = np.minimum(np.floor(x).astype(np.int64), self.max_count - 2)
+        y0 = np.minimum(np.floor(y).astype(np.int64), self.max_count - 2)
+        wx = x - x0
+        wy = y - y0
+        return (1 - wx) * (1 - wy) * self.indices_[x0, y0] + wx * (1 - wy) * self.indices_[x0 + 1, y0] + \
+            (1 - wx) * wy * self.indices_[x0, y0 + 1] + wx * wy * self.indices_[x0 + 1, y0 + 1]
+
+def gittins_index_table(gamma = 0.98, max_count = 100, horizon = 100, num_lambdas = 1000, cache_dir = DEFAULT_CACHE_DIR):
+    """
+    Returns the Gittins index table for a discount factor, loading it at most once per process. Tables are read
+    memory-mapped from cache_dir and computed and saved there if missing
+    """
+    key = (gamma, max_count, horizon, num_lambdas)
+    if key in _tables:
+        inst.count('gittins_table_cache_hits')
+        return _tables[key]
+
+    cache_filename = os.path.join(cache_dir, 'gittins_indices_g%g_n%d_h%d_l%d.npy' %(gamma, max_count, horizon, num_lambdas))
+    if os.path.exists(cache_filename):
+        indices = np.load(cache_filename, mmap_mode='r')
+    else:
+        start_time = time.time()
+        indices = compute_gittins_indices(gamma, max_count, horizon, num_lambdas)
+        logging.info('Computed Gittins indices for gamma %f in %f sec' %(gamma, time.time() - start_time))
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            # write to a temporary file and rename so other processes never see a partial table
+            tmp_filename = '%s.%d.tmp.npy' %(cache_filename[:-4], os.getpid())
+            np.save(tmp_filename, indices)
+            os.rename(tmp_filename, cache_filename)
+            indices = np.load(cache_filename, mmap_mode='r')
+        except (IOError, OSError):
+            logging.warning('Could not cache Gittins indices in %s' %(cache_dir))
+
+    _tables[key] = GittinsIndexTable(indices, gamma)
+    return _tables[key]
+
+def test_gittins_indices():
+    # index of a uniform prior arm with gamma = 0.9 from Gittins' tables
+    indices = compute_gittins_indices(0.9, max_count=10, horizon=200)
+    assert abs(indices[0,0] - 0.7029) < 1e-3
+
+    table = GittinsIndexTable(indices, 0.9)
+    assert np.allclose(table.lookup(np.array([1, 2]), np.array([1, 3])), [indices[0,0], indices[1,2]])
+    lookup = table.lookup(np.array([1.5]), np.array([1.0]))[0]
+    assert indices[0,0] < lookup < indices[1,0]
+
+    # indices past the table edge continue smoothly and stay close to a larger table
+    large_indices = compute_gittins_indices(0.9, max_count=20, horizon=200)
+    lookup = table.lookup(np.array([10, 10.001, 11, 15, 20]), np.array([3, 3, 3, 12, 4]))
+    assert abs(lookup[1] - lookup[0]) < 1e-3
+    assert np.allclose(lookup[2:], [large_indices[10,2], large_indices[14,11], large_indices[19,3]], atol=5e-3)
+    logging.info('Gittins index test passed!')
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    test_gittins_indices()
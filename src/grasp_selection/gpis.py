@@ -7,11 +7,14 @@ from abc import ABCMeta, abstractmethod
 import GPy as gpy
 import sdf
 import sdf_file
+import similarity_tf as stf
 
 from PIL import Image
 import scipy.io
+import scipy.linalg
 import scipy.ndimage
 import scipy.signal
+import scipy.spatial
 from skimage import feature
 import skimage.filters
 
@@ -24,6 +27,8 @@ import tfx
 
 import IPython
 
+DEF_SURFACE_THRESH = 0.005 # max absolute sdf value of surface points
+
 class Gpis(sdf.Sdf):
     __metaclass__ = ABCMeta
     
@@ -52,7 +57,19 @@ class Gpis(sdf.Sdf):
 
 class Gpis3D(Gpis):
     def __init__(self, points, sdf_meas, dims, meas_variance = 0.1, kernel_name = 'rbf', kernel_hyps = [1., 3.],
-                 origin = np.array([0,0]), resolution = 1.0, pose = tfx.identity_tf(frame="world")):
+                 origin = np.array([0,0]), resolution = 1.0, pose = tfx.identity_tf(frame="world"),
+                 num_inducing = None, inducing_placement = 'surface', band = None, max_points_per_batch = 10000):
+        """
+        Params:
+            points: (num_points x 3 numpy array) grid coordinates of the measurements
+            sdf_meas: (num_points x 1 numpy array) measured sdf values
+            dims: (3-tuple) dimensions of the sdf grid
+            num_inducing: (int) number of inducing points for a sparse gp, exact gp if None
+            inducing_placement: (string) 'surface' to spread the inducing points over the measurements closest to the
+                surface, 'random' for a random subset of the measurements
+            band: (float) if set, only predict grid points estimated to be within band voxels of the surface
+            max_points_per_batch: (int) max number of grid points to predict at once
+        """
         if len(dims) != 3:
             raise ValueError('Dimensions must be 3D!')
         
@@ -65,17 +82,25 @@ class Gpis3D(Gpis):
         self.origin_ = origin
         self.resolution_ = resolution
         self.pose_ = pose
+        self.band_ = band
+        self.max_points_per_batch_ = max_points_per_batch
 
         self._compute_flat_indices()
 
         # set up gp
         self.set_kernel(kernel_name, kernel_hyps)
-        self.gp_ = gpy.models.GPRegression(points, sdf_meas, self.kernel_, Y_variance=meas_variance)
+        if num_inducing is None or num_inducing >= points.shape[0]:
+            self.gp_ = gpy.models.GPRegression(points, sdf_meas, self.kernel_, Y_variance=meas_variance)
+        else:
+            Z = self.inducing_points(num_inducing, inducing_placement)
+            self.gp_ = gpy.models.SparseGPRegression(points, sdf_meas, kernel=self.kernel_, Z=Z)
+            self.gp_.likelihood.variance = meas_variance
         self.gp_.optimize()
         print(self.gp_)
 
         # predict mean and variance of grid
-        (self.mean_pred_, self.var_pred_) = self.predict_locations(self.grid_pts_, full_cov=False)
+        (self.mean_pred_, self.var_pred_) = self.predict_grid()
+        self.fourier_posterior_ = None
 
         self.feature_vector_ = None #Kmeans feature representation
 
@@ -84,10 +109,64 @@ class Gpis3D(Gpis):
         Sets the kernel of the Gaussian Process
         """
         if kernel_name == 'rbf':
-            self.kernel_ = gpy.kern.RBF(input_dim=2, variance=kernel_hyps[0], lengthscale=kernel_hyps[1])
+            self.kernel_ = gpy.kern.RBF(input_dim=3, variance=kernel_hyps[0], lengthscale=kernel_hyps[1])
         else:
             raise ValueError('Invalid Kernel specified')
 
+    def inducing_points(self, num_inducing, placement = 'surface'):
+        """
+        Chooses inducing point locations from the measurement points
+        Params:
+            num_inducing: (int) number of inducing points
+            placement: (string) 'surface' or 'random'
+        Returns:
+            numpy num_inducing x 3 array of inducing points
+        """
+        if placement == 'random':
+            indices = np.random.choice(self.pts_.shape[0], num_inducing, replace=False)
+            return self.pts_[indices].astype(np.float64)
+        elif placement != 'surface':
+            raise ValueError('Invalid inducing point placement %s' %(placement))
+
+        # spread the inducing points over the measurements closest to the surface with farthest point sampling
+        num_candidates = min(4 * num_inducing, self.pts_.shape[0])
+        candidates = self.pts_[np.argsort(np.abs(self.data_.ravel()))[:num_candidates]].astype(np.float64)
+        indices = [0]
+        min_dists = np.sum((candidates - candidates[0])**2, axis=1)
+        for i in range(1, num_inducing):
+            indices.append(np.argmax(min_dists))
+            min_dists = np.minimum(min_dists, np.sum((candidates - candidates[indices[-1]])**2, axis=1))
+        return candidates[indices]
+
+    def predict_grid(self):
+        """
+        Predicts the sdf mean and variance over the grid in batches. With a band, grid points that the nearest
+        measurement shows are more than band voxels from the surface are not predicted and are clamped to the band
+        with zero variance, like the far field of sdf.NarrowBandSdf3D
+        Returns:
+            means: (num_grid_pts x 1) numpy array of means
+            vars: (num_grid_pts x 1) numpy array of Gaussian vars
+        """
+        num_grid_pts = self.grid_pts_.shape[0]
+        means = np.zeros([num_grid_pts, 1])
+        variances = np.zeros([num_grid_pts, 1])
+        if self.band_ is not None:
+            meas_tree = scipy.spatial.cKDTree(self.pts_)
+            meas_abs_sdf = np.abs(self.data_.ravel()) / self.resolution_
+
+        for start in range(0, num_grid_pts, self.max_points_per_batch_):
+            batch = np.arange(start, min(start + self.max_points_per_batch_, num_grid_pts))
+            if self.band_ is not None:
+                # the sdf is 1-Lipschitz, so |sdf| is at least the nearest |measurement| minus the distance to it
+                dists, nearest = meas_tree.query(self.grid_pts_[batch])
+                in_band = meas_abs_sdf[nearest] - dists <= self.band_
+                far = batch[~in_band]
+                means[far,0] = self.band_ * self.resolution_ * np.where(self.data_.ravel()[nearest[~in_band]] < 0, -1, 1)
+                batch = batch[in_band]
+            if batch.shape[0] > 0:
+                means[batch], variances[batch] = self.predict_locations(self.grid_pts_[batch], full_cov=False)
+        return means, variances
+
     def _compute_flat_indices(self):
         """
         Gets the indices of the flattened array
@@ -100,17 +179,95 @@ class Gpis3D(Gpis):
         Samples sdfs from the GPIS
         Params:
             num_samples: (int) number of samples to generate
-            full_cov: (bool) whether or not to use the diagonal or entire covariance matrix
+            full_cov: (bool) whether to sample correlated shapes or independent voxels from the diagonal covariance
         Returns:
             list of sdf objects
         """        
-        sdf_samples = self.gp_.posterior_samples(self.grid_pts_, num_samples)
+        if full_cov:
+            return list(self.sdf_samples(num_samples))
+
         sdfs = []
         for i in range(num_samples):
-            sdf_data = sdf_samples[:,i].reshape(self.dims_)
-            sdfs.append(sdf.Sdf3D(sdf_data, pose = self.pose_))
+            sdf_data = self.mean_pred_ + np.sqrt(self.var_pred_) * np.random.randn(*self.var_pred_.shape)
+            sdfs.append(self._make_sdf(sdf_data))
         return sdfs
 
+    def sdf_samples(self, num_samples, num_features = 1000, samples_per_batch = 10):
+        """
+        Generates correlated sdf samples from an approximate posterior built on random Fourier features of the kernel.
+        Samples are drawn samples_per_batch at a time, so only that many grids are in memory at once
+        Params:
+            num_samples: (int) number of samples to generate
+            num_features: (int) number of random Fourier features approximating the kernel
+            samples_per_batch: (int) number of grids to evaluate together
+        Returns:
+            generator of Sdf3D samples
+        """
+        omega, phase, w_mean, L, noise_var = self.fourier_posterior(num_features)
+        num_grid_pts = self.grid_pts_.shape[0]
+
+        for start in range(0, num_samples, samples_per_batch):
+            num_batch_samples = min(samples_per_batch, num_samples - start)
+
+            # weight posterior is N(w_mean, noise_var * (L L^T)^-1)
+            noise = np.random.randn(num_features, num_batch_samples)
+            W = w_mean[:,np.newaxis] + np.sqrt(noise_var) * scipy.linalg.solve_triangular(L, noise, trans='T', lower=True)
+
+            sdf_values = np.empty([num_grid_pts, num_batch_samples])
+            for grid_start in range(0, num_grid_pts, self.max_points_per_batch_):
+                grid_pts = self.grid_pts_[grid_start:grid_start+self.max_points_per_batch_]
+                sdf_values[grid_start:grid_start+self.max_points_per_batch_] = self._fourier_features(grid_pts, omega, phase).dot(W)
+
+            for i in range(num_batch_samples):
+                yield self._make_sdf(sdf_values[:,i])
+
+    def fourier_posterior(self, num_features):
+        """
+        Fits a Bayesian linear model on random Fourier features of the RBF kernel to the measurements, using the
+        kernel and noise hyperparameters of the fitted gp. Cached until a different number of features is requested
+        Returns:
+            omega, phase: random frequencies and phases of the features
+            w_mean: posterior mean of the feature weights
+            L: lower cholesky factor of the weight posterior precision times noise_var
+            noise_var: measurement noise variance
+        """
+        if self.fourier_posterior_ is not None and self.fourier_posterior_[0].shape[0] == num_features:
+            return self.fourier_posterior_
+
+        lengthscale = float(self.kernel_.lengthscale)
+        noise_var = float(self.gp_.likelihood.variance)
+        omega = np.random.randn(num_features, 3) / lengthscale
+        phase = np.random.uniform(0, 2 * np.pi, num_features)
+
+        A = noise_var * np.eye(num_features)
+        b = np.zeros(num_features)
+        y = self.data_.ravel()
+        for start in range(0, self.pts_.shape[0], self.max_points_per_batch_):
+            phi = self._fourier_features(self.pts_[start:start+self.max_points_per_batch_], omega, phase)
+            A += phi.T.dot(phi)
+            b += phi.T.dot(y[start:start+self.max_points_per_batch_])
+
+        L = np.linalg.cholesky(A)
+        w_mean = scipy.linalg.cho_solve((L, True), b)
+        self.fourier_posterior_ = (omega, phase, w_mean, L, noise_var)
+        return self.fourier_posterior_
+
+    def _fourier_features(self, points, omega, phase):
+        """ Random Fourier features of the RBF kernel at the given points """
+        scale = np.sqrt(2.0 * float(self.kernel_.variance) / omega.shape[0])
+        return scale * np.cos(points.dot(omega.T) + phase)
+
+    def _make_sdf(self, sdf_data):
+        """ Wraps sdf values on the grid in an Sdf3D """
+        return sdf.Sdf3D(sdf_data.reshape(self.dims_), self.origin_, self.resolution_,
+                         tf = stf.SimilarityTransform3D(self.pose_), use_abs=False)
+
+    def mean_sdf(self):
+        """
+        Returns an SDF of the mean surface
+        """
+        return self._make_sdf(self.mean_pred_)
+
     def predict_locations(self, points, full_cov=False):
         """
         Predicts the sdf values at the given points
@@ -122,7 +279,7 @@ class Gpis3D(Gpis):
         """        
         return self.gp_.predict(points, full_cov=full_cov)
 
-    def surface_points(self, surface_thresh = sdf.DEF_SURFACE_THRESH):
+    def surface_points(self, surface_thresh = DEF_SURFACE_THRESH):
         """
         Returns the points on the surface of the mean sdf
         Params: (float) sdf value to threshold
@@ -184,7 +341,7 @@ class Gpis3D(Gpis):
         weights = weights / np.sum(weights)
         return weights.dot(values)
 
-    def scatter(self, surface_thresh = sdf.DEF_SURFACE_THRESH):
+    def scatter(self, surface_thresh = DEF_SURFACE_THRESH):
         """
         Plots the SDF as a matplotlib 3D scatter plot, and displays the figure
         Params: - 
@@ -292,7 +449,7 @@ class Gpis2D(Gpis):
         """
         return sdf.Sdf2D(self.mean_pred_.reshape(self.dims_))
 
-    def surface_points(self, surface_thresh = sdf.DEF_SURFACE_THRESH):
+    def surface_points(self, surface_thresh = DEF_SURFACE_THRESH):
         """
         Returns the points on the surface of the mean sdf
         Params: (float) sdf value to threshold
@@ -349,7 +506,7 @@ class Gpis2D(Gpis):
         weights = weights / np.sum(weights)
         return weights.dot(values)
 
-    def scatter(self, surface_thresh = sdf.DEF_SURFACE_THRESH):
+    def scatter(self, surface_thresh = DEF_SURFACE_THRESH):
         """
         Plots the GPIS mean shape as a matplotlib 2D scatter plot, and displays the figure
         Params: - 
@@ -412,7 +569,7 @@ def test_3d():
     sdf_3d = sf.read()
 
     # get params from read in sdf
-    all_points = sdf_3d.pts_
+    all_points = sdf_3d.flat_indices
     all_sdf = sdf_3d.data_.flatten()
     num_points = all_points.shape[0]
     num_rand_samples = 5000
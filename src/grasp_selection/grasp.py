@@ -13,6 +13,7 @@ import time
 
 import contacts
 import graspable_object as go
+import instrumentation as inst
 import sdf_file as sf
 import sdf
 import similarity_tf as stf
@@ -109,6 +110,7 @@ class ParallelJawPtGrasp3D(PointGrasp):
         grasp_axis = g2 - g1
         return grasp_axis / np.linalg.norm(grasp_axis)
 
+    @inst.timed('close_fingers')
     def close_fingers(self, obj, vis = False):
         """
         Steps along grasp axis to find the locations of contact
@@ -197,6 +199,15 @@ class ParallelJawPtGrasp3D(PointGrasp):
 
         # step along line of action, get points on surface when possible
         i = 0
+        if sdf.Sdf3D.use_pyramid and isinstance(obj.sdf, sdf.Sdf3D):
+            # skip ahead to the first point that may be on the surface, keeping two points for the zero crossing fit
+            candidates = np.nonzero(obj.sdf.surface_candidates(np.array(line_of_action)))[0]
+            if candidates.shape[0] == 0:
+                inst.count('rays_marched')
+                inst.count('contacts_failed')
+                return False, None
+            i = max(candidates[0] - 2, 0)
+
         while i < num_pts and not contact_found:
             # update loop vars
             pt_before_before = pt_before
@@ -245,6 +256,8 @@ class ParallelJawPtGrasp3D(PointGrasp):
                         contact_found = False
 
             i = i+1
+        inst.count('rays_marched')
+        inst.count('ray_steps', i)
 
         # visualization
         if vis and contact_found:
@@ -257,6 +270,9 @@ class ParallelJawPtGrasp3D(PointGrasp):
             in_direction_grid = in_direction_grid / np.linalg.norm(in_direction_grid)
             in_direction = obj.sdf.transform_pt_grid_to_obj(in_direction_grid, direction=True)
             contact = contacts.Contact3D(obj, pt_zc_world, in_direction=in_direction)
+            inst.count('contacts_found')
+        else:
+            inst.count('contacts_failed')
         return contact_found, contact
 
     def transform(self, tf, theta_res = 0):
@@ -514,6 +530,34 @@ def test_to_json():
 
     # TODO: hard checks
 
+def test_pyramid_contacts(num_grasps=100):
+    """ Compares contacts and runtime of coarse-to-fine contact search against the single-level search """
+    np.random.seed(100)
+    sdf_3d_file_name = 'data/test/sdf/Co_clean_dim_25.sdf'
+    sf3 = sf.SdfFile(sdf_3d_file_name)
+    sdf_3d = sf3.read()
+    obj_3d = go.GraspableObject3D(sdf_3d)
+
+    # random grasps around the object center
+    test_grasp_width = 1.0
+    centers = 0.5 * np.random.randn(num_grasps, 3)
+    axes = np.random.randn(num_grasps, 3)
+    grasps = [ParallelJawPtGrasp3D(c, a / np.linalg.norm(a), test_grasp_width) for c, a in zip(centers, axes)]
+
+    results = {}
+    for use_pyramid in [False, True]:
+        sdf.Sdf3D.use_pyramid = use_pyramid
+        start_t = time.clock()
+        results[use_pyramid] = [g.close_fingers(obj_3d) for g in grasps]
+        end_t = time.clock()
+        logging.info('Contact search with pyramid=%s took %f sec' %(use_pyramid, end_t - start_t))
+    sdf.Sdf3D.use_pyramid = False
+
+    for (found, c), (found_pyr, c_pyr) in zip(results[False], results[True]):
+        assert(found == found_pyr)
+        for c1, c2 in zip(c, c_pyr):
+            assert((c1 is None and c2 is None) or np.allclose(c1.point, c2.point))
+
 if __name__ == '__main__':
     test_find_contacts()
 #    test_grasp_from_contacts()
@@ -0,0 +1,303 @@
+"""
+Latency benchmarks for the geometric grasping pipeline on procedurally generated objects, so the pipeline can be
+profiled without the Dex-Net dataset. Spheres, boxes, tori and superquadrics are voxelized at several sdf grid
+resolutions and every stage from sdf loading to force closure sampling is timed per call.
+Results are written to a json file, and passing a previous file as the baseline reports the operations whose
+median latency regressed.
+
+Usage: python src/grasp_selection/grasp_benchmark.py --dims 25 50 --output grasp_benchmark.json --baseline old.json
+"""
+import argparse
+import json
+import logging
+import numpy as np
+import os
+import scipy.stats
+import shutil
+import tempfile
+import time
+
+import antipodal_grasp_sampler as ags
+import bandit_benchmark as bb
+import contacts
+import experiment_config as ec
+import grasp_sampler as gs
+import graspable_object as go
+import mesh
+import pfc
+import quality as pgq
+import sdf
+import sdf_file
+
+import IPython
+
+DEF_SHAPES = ['sphere', 'box', 'torus', 'superquadric']
+DEF_DIMS = [25, 50, 100]
+DEF_GRID_HALF_WIDTH = 0.06 # half the side length of the sdf grid in meters
+DEF_QUALITY_METRICS = ['force_closure', 'min_singular', 'wrench_volume', 'grasp_isotropy', 'ferrari_canny_L1']
+
+def _signed_pow(x, e):
+    return np.sign(x) * np.abs(x)**e
+
+def sphere_sdf(pts, radius = 0.03):
+    return np.linalg.norm(pts, axis=1) - radius
+
+def box_sdf(pts, half_dims = np.array([0.04, 0.025, 0.015])):
+    q = np.abs(pts) - half_dims
+    return np.linalg.norm(np.maximum(q, 0), axis=1) + np.minimum(np.max(q, axis=1), 0)
+
+def torus_sdf(pts, major_radius = 0.03, minor_radius = 0.01):
+    ring_dist = np.linalg.norm(pts[:,:2], axis=1) - major_radius
+    return np.sqrt(ring_dist**2 + pts[:,2]**2) - minor_radius
+
+def superquadric_sdf(pts, half_dims = np.array([0.035, 0.025, 0.02]), e1 = 0.5, e2 = 1.0):
+    """ Radial approximation of the distance to a superquadric with shape exponents e1 and e2 """
+    x, y, z = (np.abs(pts) / half_dims).T
+    f = ((x**(2.0 / e2) + y**(2.0 / e2))**(e2 / e1) + z**(2.0 / e1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sd = np.linalg.norm(pts, axis=1) * (1 - f**(-e1 / 2.0))
+    sd[~np.isfinite(sd)] = -np.min(half_dims)
+    return sd
+
+def _grid_mesh(X, Y, Z, wrap_v = False):
+    """
+    Triangulates a parametric surface sampled on a grid that wraps around along the first axis
+    Params:
+        X, Y, Z: (numpy NU x NV arrays) surface coordinates
+        wrap_v: (bool) whether the surface also wraps around along the second axis
+    Returns:
+        Mesh3D
+    """
+    nu, nv = X.shape
+    vertices = np.c_[X.ravel(), Y.ravel(), Z.ravel()]
+    i, j = np.meshgrid(np.arange(nu), np.arange(nv if wrap_v else nv - 1), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    a = i * nv + j
+    b = ((i + 1) % nu) * nv + j
+    c = ((i + 1) % nu) * nv + (j + 1) % nv
+    d = i * nv + (j + 1) % nv
+    triangles = np.r_[np.c_[a, b, c], np.c_[a, c, d]]
+    return mesh.Mesh3D(vertices.tolist(), triangles.tolist())
+
+def superquadric_mesh(half_dims = np.array([0.035, 0.025, 0.02]), e1 = 0.5, e2 = 1.0, num_steps = 40):
+    u, v = np.meshgrid(np.linspace(-np.pi, np.pi, num_steps, endpoint=False), np.linspace(-np.pi / 2, np.pi / 2, num_steps), indexing='ij')
+    X = half_dims[0] * _signed_pow(np.cos(v), e1) * _signed_pow(np.cos(u), e2)
+    Y = half_dims[1] * _signed_pow(np.cos(v), e1) * _signed_pow(np.sin(u), e2)
+    Z = half_dims[2] * _signed_pow(np.sin(v), e1)
+    return _grid_mesh(X, Y, Z)
+
+def box_mesh(half_dims = np.array([0.04, 0.025, 0.015])):
+    vertices = np.array([[x, y, z] for x in [-1, 1] for y in [-1, 1] for z in [-1, 1]]) * half_dims
+    triangles = [[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+                 [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]]
+    return mesh.Mesh3D(vertices.tolist(), triangles)
+
+def torus_mesh(major_radius = 0.03, minor_radius = 0.01, num_steps = 40):
+    u, v = np.meshgrid(np.linspace(0, 2 * np.pi, num_steps, endpoint=False), np.linspace(0, 2 * np.pi, num_steps, endpoint=False), indexing='ij')
+    X = (major_radius + minor_radius * np.cos(v)) * np.cos(u)
+    Y = (major_radius + minor_radius * np.cos(v)) * np.sin(u)
+    Z = minor_radius * np.sin(v)
+    return _grid_mesh(X, Y, Z, wrap_v=True)
+
+SHAPES = {
+    'sphere': (sphere_sdf, lambda: superquadric_mesh(half_dims=0.03 * np.ones(3), e1=1.0, e2=1.0)),
+    'box': (box_sdf, box_mesh),
+    'torus': (torus_sdf, torus_mesh),
+    'superquadric': (superquadric_sdf, superquadric_mesh),
+}
+
+def synthetic_graspable(shape, dim, half_width = DEF_GRID_HALF_WIDTH):
+    """
+    Voxelizes one of the synthetic shapes, centered in a cubic grid
+    Params:
+        shape: (string) key into SHAPES
+        dim: (int) number of grid cells along each axis
+        half_width: (float) half the side length of the grid in meters
+    Returns:
+        GraspableObject3D
+    """
+    sdf_func, mesh_func = SHAPES[shape]
+    resolution = 2.0 * half_width / (dim - 1)
+    origin = -half_width * np.ones(3)
+
+    # evaluate the shape at the object frame coordinates of each grid cell
+    grid = sdf.Sdf3D(np.zeros([dim, dim, dim]), origin, resolution)
+    pts_grid = np.indices([dim, dim, dim]).reshape(3, -1)
+    pts_obj = grid.transform_pt_grid_to_obj(pts_grid).T
+    sdf_data = sdf_func(pts_obj).reshape([dim, dim, dim])
+
+    sdf_3d = sdf.Sdf3D(sdf_data, origin, resolution)
+    return go.GraspableObject3D(sdf_3d, mesh=mesh_func(), model_name='%s_%d' %(shape, dim))
+
+class LatencyRecorder(object):
+    """ Collects per call latencies of named operations """
+    def __init__(self):
+        self.latencies_ = {}
+        self.items_ = {}
+
+    def time(self, name, func, *args, **kwargs):
+        """ Calls func, records its latency under name, and returns its result """
+        start_time = time.time()
+        result = func(*args, **kwargs)
+        self.add(name, time.time() - start_time)
+        return result
+
+    def add(self, name, latency, num_items = 1):
+        """ Records a latency, with the number of items (e.g. grasps) produced for the throughput """
+        self.latencies_.setdefault(name, []).append(latency)
+        self.items_[name] = self.items_.get(name, 0) + num_items
+
+    def summary(self):
+        """
+        Returns:
+            dict mapping operation names to latency percentiles in milliseconds and throughput in items per second
+        """
+        stats = {}
+        for name, latencies in self.latencies_.items():
+            latencies = 1e3 * np.array(latencies)
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            stats[name] = {
+                'count': latencies.shape[0],
+                'mean_ms': np.mean(latencies),
+                'p50_ms': p50,
+                'p90_ms': p90,
+                'p99_ms': p99,
+                'max_ms': np.max(latencies),
+                'throughput': 1e3 * self.items_[name] / max(np.sum(latencies), 1e-9),
+            }
+        return stats
+
+def benchmark_graspable(graspable, config, num_grasps = 25, num_trials = 3, num_fc_samples = 25,
+                        metrics = DEF_QUALITY_METRICS, cache_dir = None):
+    """
+    Times each stage of the grasping pipeline on an object
+    Params:
+        graspable: (GraspableObject3D) object to benchmark on
+        config: experiment config with the grasp sampling and uncertainty params
+        num_grasps: (int) target number of grasps per sampler call
+        num_trials: (int) number of calls of the whole object operations (loading, sampling)
+        num_fc_samples: (int) number of ForceClosureRV.sample_success calls per grasp
+        metrics: (list of strings) PointGraspMetrics3D methods to time
+        cache_dir: (string) directory for the temporary sdf file
+    Returns:
+        dict of LatencyRecorder summaries
+    """
+    recorder = LatencyRecorder()
+
+    # sdf loading from the text format used by the database
+    sdf_filename = os.path.join(cache_dir, '%s.sdf' %(graspable.model_name))
+    sdf_file.SdfFile(sdf_filename).write(graspable.sdf)
+    for i in range(num_trials):
+        recorder.time('sdf_load', sdf_file.SdfFile(sdf_filename).read)
+        recorder.time('surface_points', graspable.sdf.surface_points, grid_basis=False)
+
+    # grasp sampling
+    grasps = []
+    for name, sampler in [('gaussian_sampling', gs.GaussianGraspSampler(config)),
+                          ('antipodal_sampling', ags.AntipodalGraspSampler(config))]:
+        for i in range(num_trials):
+            start_time = time.time()
+            sampled_grasps = sampler.generate_grasps(graspable, target_num_grasps=num_grasps, check_collisions=False)
+            recorder.add(name, time.time() - start_time, num_items=len(sampled_grasps))
+            grasps.extend(sampled_grasps)
+
+    # per grasp and per contact operations
+    for grasp in grasps:
+        contacts_found, grasp_contacts = recorder.time('close_fingers', grasp.close_fingers, graspable)
+        if not contacts_found:
+            continue
+
+        for contact in grasp_contacts:
+            c = recorder.time('contact_normal', contacts.Contact3D, graspable, contact.point, in_direction=contact.in_direction_)
+            if c.normal is None:
+                continue
+            recorder.time('friction_cone', c.friction_cone, config['num_cone_faces'], config['friction_coef'])
+            recorder.time('surface_window_sdf', c.surface_window_sdf)
+            recorder.time('surface_window_projection', c.surface_window_projection)
+
+        for metric in metrics:
+            recorder.time('quality_%s' %(metric), pgq.PointGraspMetrics3D.grasp_quality, grasp, graspable, metric,
+                          soft_fingers=True, friction_coef=config['friction_coef'], num_cone_faces=config['num_cone_faces'])
+
+    # force closure under pose uncertainty, as evaluated by the bandits
+    graspable_rv = recorder.time('object_pose_rv', pfc.GraspableObjectGaussianPose, graspable, config)
+    f_rv = scipy.stats.norm(config['friction_coef'], config['sigma_mu'])
+    for grasp in grasps:
+        grasp_rv = pfc.ParallelJawGraspGaussian(grasp, config)
+        fc_rv = pfc.ForceClosureRV(grasp_rv, graspable_rv, f_rv, config)
+        for i in range(num_fc_samples):
+            recorder.time('force_closure_sample_success', fc_rv.sample_success)
+
+    return recorder.summary()
+
+def run_benchmarks(config, shapes = DEF_SHAPES, dims = DEF_DIMS, **kwargs):
+    """
+    Benchmarks the pipeline on every shape and grid resolution
+    Returns:
+        dict with the run metadata and results keyed by shape/dim/operation
+    """
+    cache_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for dim in dims:
+            for shape in shapes:
+                np.random.seed(100)
+                logging.info('Benchmarking %s with sdf dim %d' %(shape, dim))
+                graspable = synthetic_graspable(shape, dim)
+                summary = benchmark_graspable(graspable, config, cache_dir=cache_dir, **kwargs)
+                for op, stats in summary.items():
+                    results['%s/%d/%s' %(shape, dim, op)] = stats
+    finally:
+        shutil.rmtree(cache_dir)
+
+    report = bb.benchmark_metadata()
+    report['results'] = results
+    return report
+
+def compare_to_baseline(results, baseline_results, tolerance = 1.25):
+    """
+    Finds the operations whose median latency grew by more than a factor of tolerance over the baseline
+    Returns:
+        list of (key, baseline p50 ms, current p50 ms) tuples, sorted by key
+    """
+    regressions = []
+    for key in sorted(results.keys()):
+        if key not in baseline_results:
+            continue
+        p50 = results[key]['p50_ms']
+        baseline_p50 = baseline_results[key]['p50_ms']
+        if p50 > tolerance * baseline_p50:
+            regressions.append((key, baseline_p50, p50))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='cfg/correlated.yaml')
+    parser.add_argument('--shapes', nargs='+', default=DEF_SHAPES)
+    parser.add_argument('--dims', nargs='+', type=int, default=DEF_DIMS)
+    parser.add_argument('--num_grasps', type=int, default=25)
+    parser.add_argument('--num_trials', type=int, default=3)
+    parser.add_argument('--num_fc_samples', type=int, default=25)
+    parser.add_argument('--num_obj_samples', type=int, default=10)
+    parser.add_argument('--output', default='grasp_benchmark.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    config = ec.ExperimentConfig(args.config)
+    config['num_prealloc_obj_samples'] = args.num_obj_samples
+
+    report = run_benchmarks(config, args.shapes, args.dims, num_grasps=args.num_grasps, num_trials=args.num_trials,
+                            num_fc_samples=args.num_fc_samples)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    logging.info('Wrote benchmark results to %s' %(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report['results'], baseline['results'], args.tolerance)
+        for key, baseline_p50, p50 in regressions:
+            logging.warning('%s regressed: p50 %.3f ms -> %.3f ms' %(key, baseline_p50, p50))
+        logging.info('%d regressions against baseline %s (revision %s)' %(len(regressions), args.baseline, baseline['git_revision']))
@@ -17,6 +17,7 @@ import numpy as np
 import scipy.stats
 
 import antipodal_grasp_sampler as ags
+import checkpoint as ckpt
 import database as db
 import discrete_adaptive_samplers as das
 import experiment_config as ec
@@ -30,7 +31,8 @@ import pfc
 import pr2_grasp_checker as pgc
 import termination_conditions as tc
 
-def extract_features(obj, dest, feature_dest, config):
+def sample_grasps_and_features(obj, config):
+    """ Samples grasps on obj and computes their features. Returns None, None if no grasps were found """
     # sample grasps
     sample_start = time.clock()
     if config['grasp_sampler'] == 'antipodal':
@@ -60,7 +62,7 @@ def extract_features(obj, dest, feature_dest, config):
 
     if not grasps or len(grasps) == 0:
         logging.info('Skipping %s' %(obj.key))
-        return
+        return None, None
 
     # compute all features
     feature_start = time.clock()
@@ -69,6 +71,24 @@ def extract_features(obj, dest, feature_dest, config):
     feature_end = time.clock()
     feature_duration = feature_end - feature_start
     logging.info('Feature extraction took %f sec' %(feature_duration))
+    return grasps, all_features
+
+def extract_features(obj, dest, feature_dest, config, checkpointer=None):
+    # reuse the grasps and features of a previous run
+    obj_state = None
+    if checkpointer is not None:
+        obj_state = checkpointer.load(obj.key)
+    if obj_state is not None:
+        grasps = obj_state['grasps']
+        all_features = obj_state['features']
+        ckpt.set_random_state(obj_state['random_state'])
+    else:
+        grasps, all_features = sample_grasps_and_features(obj, config)
+        if grasps is None:
+            return
+        if checkpointer is not None:
+            checkpointer.save(obj.key, {'grasps': grasps, 'features': all_features,
+                                        'random_state': ckpt.random_state()})
 
     # generate pfc candidates
     graspable_rv = pfc.GraspableObjectGaussianPose(obj, config)
@@ -96,9 +116,12 @@ def extract_features(obj, dest, feature_dest, config):
     ua = das.UniformAllocationMean(objective, candidates)
     logging.info('Running uniform allocation for true pfc.')
     bandit_start = time.clock()
+    ua_checkpoint = None
+    if checkpointer is not None:
+        ua_checkpoint = checkpointer.solver_checkpoint(obj.key + '_brute_force')
     ua_result = ua.solve(
         termination_condition=tc.MaxIterTerminationCondition(brute_force_iter),
-        snapshot_rate=snapshot_rate)
+        snapshot_rate=snapshot_rate, checkpoint=ua_checkpoint)
     bandit_end = time.clock()
     bandit_duration = bandit_end - bandit_start
     logging.info('Uniform allocation (%d iters) took %f sec' %(brute_force_iter, bandit_duration))
@@ -132,6 +155,8 @@ def extract_features(obj, dest, feature_dest, config):
     feature_filename = os.path.join(feature_dest, obj.key + '.json')
     with open(feature_filename, 'w') as feature_file:
         jsons.dump(features_as_json, feature_file)
+    if ua_checkpoint is not None:
+        ua_checkpoint.clear()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -158,8 +183,16 @@ if __name__ == '__main__':
     except os.error:
         pass
 
+    # checkpoint objects and the brute force bandit runs if specified
+    checkpointer = ckpt.Checkpointer.from_config(config, dest)
+
     ff.FeatureExtractor.use_unity_weights = True
     for obj in chunk:
+        if checkpointer is not None and checkpointer.is_complete(obj.key):
+            logging.info('Skipping finished object {}'.format(obj.key))
+            continue
         logging.info('Extracting features for object {}'.format(obj.key))
-        extract_features(obj, dest, feature_dest, config)
+        extract_features(obj, dest, feature_dest, config, checkpointer)
+        if checkpointer is not None:
+            checkpointer.mark_complete(obj.key)
     logging.info('Features extracted.')
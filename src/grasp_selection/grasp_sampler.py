@@ -20,9 +20,28 @@ import scipy.stats as stats
 import experiment_config as ec
 import grasp
 import graspable_object
+import instrumentation as inst
 from grasp import ParallelJawPtGrasp3D
 import obj_file
 import sdf_file
+import sdf_grasp_checker as sgc
+
+def make_grasp_checker(check_collisions, vis=False):
+    """
+    Creates the gripper collision checker selected by the check_collisions config value: False for none,
+    'sdf' for the SDF-based checker, and True or 'openrave' for the OpenRAVE PR2 checker
+    """
+    if not check_collisions:
+        return None
+    if check_collisions == 'sdf':
+        return sgc.SdfGraspChecker()
+    if check_collisions is True or check_collisions == 'openrave':
+        # only load openrave when it is actually used, so the samplers can run headless
+        import openravepy as rave
+        import pr2_grasp_checker as pgc
+        rave.raveSetDebugLevel(rave.DebugLevel.Error)
+        return pgc.OpenRaveGraspChecker(view=vis)
+    raise ValueError('Unknown collision checker %s' %(str(check_collisions)))
 
 class GraspSampler:
     __metaclass__ = ABCMeta
@@ -77,8 +96,10 @@ class ExactGraspSampler(GraspSampler):
         while num_grasps_remaining > 0 and k <= max_iter:
             # generate more than we need
             num_grasps_generate = grasp_gen_mult * num_grasps_remaining
-            new_grasps = self._generate_grasps(graspable, num_grasps_generate,
-                                               check_collisions, vis, **kwargs)
+            with inst.timer('grasp_sampling'):
+                new_grasps = self._generate_grasps(graspable, num_grasps_generate,
+                                                   check_collisions, vis, **kwargs)
+            inst.count('grasps_sampled', len(new_grasps))
             grasps += new_grasps
             logging.info('%d/%d grasps found after iteration %d.',
                          len(grasps), target_num_grasps, k)
@@ -162,20 +183,12 @@ class GaussianGraspSampler(ExactGraspSampler):
             ax.set_zlim3d(0, graspable.sdf.dims_[2])
             plt.show()
 
-        # optionally use openrave to check collisionsx
-        if check_collisions:
-            rave.raveSetDebugLevel(rave.DebugLevel.Error)
-            grasp_checker = pgc.OpenRaveGraspChecker(view=vis)
-
-            # loop through grasps
-            collision_free_grasps = []
-            for grasp in grasps:
-                rotated_grasps = grasp.transform(graspable.tf, self.theta_res)
-                rotated_grasps = grasp_checker.prune_grasps_in_collision(graspable, rotated_grasps, auto_step=True, delay=0.0)
-                if len(rotated_grasps) > 0:
-                    collision_free_grasps.append(grasp)
-
-            grasps = collision_free_grasps
+        # optionally check collisions
+        grasp_checker = make_grasp_checker(check_collisions, vis=vis)
+        if grasp_checker is not None:
+            # check all rotations of all grasps
+            rotated_grasps = grasp_checker.collision_free_rotations(graspable, grasps, self.theta_res)
+            grasps = [grasp for grasp, rotations in zip(grasps, rotated_grasps) if len(rotations) > 0]
 
         return grasps
 
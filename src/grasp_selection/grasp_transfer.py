@@ -62,11 +62,10 @@ class SHOTpipeline():
 
 
 					grasplist_tf=[]
-					grasplist_tps=[]
 					for grasp in grasplist:
 						targetgrasp=transformgrasp(grasp,reg_solver2)
 						grasplist_tf.append(targetgrasp)
-						grasplist_tps.append(transformgrasp(grasp,reg_solver))
+					grasplist_tps=transformgrasps(grasplist,reg_solver)
 					try:
 						tps_probability=getprobability(other_obj,grasplist_tps)
 						if len(tps_probability)<=len(grasp_probability):
@@ -128,13 +127,25 @@ def transformgrasp(grasp,reg_solver):
 		newmatrix=transformmatrix.dot(graspmatrix)
 		return makegrasp(grasp,bmat=newmatrix)
 	else:
-		graspmatrix=makeblockmatrix(grasp)
-		position=getposition(graspmatrix)
-		orientation=getdirection(graspmatrix)
-		jacob_eval=make_eval_jacobian(position,reg_solver)
-		new_direction=jacob_eval.dot(orientation)
-		orthonormal_direction=make_orthonormal(new_direction)
-		return makegrasp(grasp,center=position,direction=orthonormal_direction)
+		return transformgrasps([grasp],reg_solver)[0]
+
+def transformgrasps(grasps,reg_solver):
+	"""
+	Transfers a list of grasps through a thin plate spline at once. The gripper positions are warped and the
+	orientations are mapped through the warp jacobians at the positions, then projected to the nearest rotations
+	"""
+	if len(grasps)==0:
+		return []
+	graspmatrices=np.array([makeblockmatrix(grasp) for grasp in grasps])
+	positions=graspmatrices[:,:3,3]
+	orientations=graspmatrices[:,:3,:3]
+	new_positions=reg_solver.transform(positions)
+	jacob_evals=reg_solver.jacobian(positions)
+	new_directions=np.einsum('nij,njk->nik',jacob_evals,orientations)
+	U,s,Vt=np.linalg.svd(new_directions)
+	orthonormal_directions=np.einsum('nij,njk->nik',U,Vt)
+	return [makegrasp(grasp,center=position,direction=direction)
+		for grasp,position,direction in zip(grasps,new_positions,orthonormal_directions)]
 
 def make_orthonormal(matrix):
 	U,s,v=np.linalg.svd(matrix)
@@ -263,18 +274,7 @@ def getprobability(object,grasps):
 	return estimated_pfc
 
 def make_eval_jacobian(position,reg_solver):
-	bigarray=None
-	for point in reg_solver.source_points:
-		bottom_coef=(sqrt(np.square(position[0]-point[0])+np.square(position[1]-point[1])+np.square(position[2]-point[2])))
-		temp_x=2*(position[0]-point[0])/bottom_coef
-		temp_y=2*(position[1]-point[1])/bottom_coef
-		temp_z=2*(position[2]-point[2])/bottom_coef
-		temp_array=np.array([[temp_x],[temp_y],[temp_z]])
-		if bigarray==None:
-			bigarray=temp_array
-		else:
-			bigarray=np.hstack((bigarray,temp_array))
-	return reg_solver.w_ng_.T.dot(bigarray.T)+reg_solver.lin_ag_.T
+	return reg_solver.jacobian(position[np.newaxis,:])[0]
 
 if __name__ == '__main__':
 	SHOTpipeline().startpipeline()
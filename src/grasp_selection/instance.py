@@ -5,7 +5,13 @@ import IPython
 import itertools as it
 import logging
 import multiprocessing as mp
+import os
+import pipes
+import signal
+import subprocess
+import sys
 import time
+import yaml
 
 import httplib2
 from oauth2client.client import flow_from_clientsecrets
@@ -71,6 +77,8 @@ class VMInstanceAllocator(object):
         """
         params = []
         param_dict = config['param_values']
+        if param_dict is None:
+            return [{}]
 
         # take the product of the paraeter values in a list
         for param_combination in it.product(*param_dict.values()):
@@ -189,6 +197,23 @@ class GceInstanceAllocator(VMInstanceAllocator):
         # return list of instances
         return instances
 
+class LocalInstanceAllocator(VMInstanceAllocator):
+    def __init__(self, config):
+        self.config = config
+
+    def allocate(self, instance_root, run_script, results_dir):
+        """
+        Returns a list of local instance objects, one per partition of the config, writing their output to
+        subdirectories of results_dir
+        """
+        instances = []
+        instance_name = '%s-' %(instance_root) + '%d'
+        for instance_num, params in enumerate(VMInstanceAllocator.partition(self.config)):
+            cur_instance_name = instance_name % instance_num
+            logging.info('Allocating local instance %s' %(cur_instance_name))
+            instances.append(LocalInstance(cur_instance_name, run_script, params, results_dir, self.config))
+        return instances
+
 # helper functions for multiprocessing
 def _pickle_method(m):
     if m.im_self is None:
@@ -255,6 +280,43 @@ class VMInstanceManager(object):
             raise ValueError('Must provide an instance object to stop')
         instance.stop()
                 
+class LocalInstanceManager(VMInstanceManager):
+    """ Runs local instances as processes on this machine, at most num_processes at a time """
+    def __init__(self):
+        self.num_processes = 1
+        self.instances = []
+        self.queued_instances = []
+
+    def launch_instances(self, instances, num_processes=None):
+        """ Queue a list of instances and start as many as there are process slots, by default one per core """
+        if num_processes is None:
+            num_processes = mp.cpu_count()
+        self.num_processes = num_processes
+        self.instances = list(instances)
+        self.queued_instances = list(instances)
+        self.update()
+
+        launched_instances = {}
+        for instance in instances:
+            launched_instances[instance.instance_name] = instance
+        return launched_instances
+
+    def update(self):
+        """ Starts queued instances in any process slots freed up by completed instances """
+        while len(self.queued_instances) > 0 and len(self.active_instances()) < self.num_processes:
+            self.queued_instances.pop(0).start()
+
+    def active_instances(self):
+        """ Returns the instances whose processes have been started but not stopped """
+        return [instance for instance in self.instances if instance.process is not None and instance.running]
+
+    def stop_instances(self, instances, num_processes=1):
+        """ Stop a list of instances, dropping any that are still queued """
+        for instance in instances:
+            if instance in self.queued_instances:
+                self.queued_instances.remove(instance)
+            instance.stop()
+
 class VMInstance(object):
     """ Abstract class to wrap per-instance configurations and starting / stopping of virtual instances """
     __metaclass__ = ABCMeta
@@ -353,3 +415,65 @@ class GceInstance(VMInstance):
         self.delete_disk()
         self.running = False
 
+
+class LocalInstance(VMInstance):
+    """
+    An instance that runs the experiment script in a local process. Mirrors the GCE startup script: the config is
+    written with the instance parameters appended, the script is run on it, and a marker file is written to the
+    results directory when the script exits, in place of the uploaded archive
+    """
+    def __init__(self, instance_name, run_script, params, results_dir, config):
+        self.instance_name = instance_name
+        self.run_script = run_script
+        self.params = params
+        self.results_dir = results_dir
+        self.config = config
+        self.process = None
+        self.running = True # queued instances are in progress
+
+    @property
+    def out_dir(self):
+        return os.path.join(self.results_dir, self.instance_name)
+
+    @property
+    def done_filename(self):
+        """ Marker written when the script exits, containing its return code """
+        return os.path.join(self.results_dir, self.instance_name + '.done')
+
+    def start(self):
+        """ Launch the run script in a new process group """
+        logging.info('Starting local instance %s' % self.instance_name)
+        try:
+            if not os.path.exists(self.out_dir):
+                os.makedirs(self.out_dir)
+
+            # instance config is the job config with the partition parameters appended
+            config_filename = os.path.join(self.out_dir, 'config.yaml')
+            with open(config_filename, 'w') as f:
+                f.write(self.config.file_contents)
+                f.write('\n')
+                if len(self.params) > 0:
+                    f.write(yaml.safe_dump(self.params, default_flow_style=False))
+
+            log_filename = os.path.join(self.out_dir, self.instance_name + '.log')
+            command = '%s %s %s %s > %s 2>&1; echo $? > %s' %(pipes.quote(sys.executable), pipes.quote(self.run_script),
+                                                              pipes.quote(config_filename), pipes.quote(self.out_dir),
+                                                              pipes.quote(log_filename), pipes.quote(self.done_filename))
+            self.process = subprocess.Popen(['/bin/sh', '-c', command], preexec_fn=os.setsid)
+        except (IOError, OSError) as e:
+            logging.error('Failed to start local instance %s' %(self.instance_name))
+            logging.error(e)
+            self.running = False
+            return False
+        self.running = True
+        return True
+
+    def stop(self):
+        """ Kill the script if it is still running """
+        if self.process is not None and self.process.poll() is None:
+            logging.info('Stopping %s' % self.instance_name)
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except OSError as e:
+                logging.error(e)
+        self.running = False
@@ -0,0 +1,157 @@
+"""
+Lightweight timers and counters for the grasping and bandit hot paths.
+Timers nest, so a timer started inside another is reported under the path 'outer/inner'. Instrumentation is off by
+default, in which case timer() returns a shared no-op context manager and count() returns immediately.
+
+Usage:
+    import instrumentation as inst
+    inst.enable()
+    with inst.timer('close_fingers'):
+        inst.count('rays_marched')
+    inst.dump('out/profile.json')
+"""
+import functools
+import json
+import logging
+import time
+
+enabled = False
+
+_timers = {} # timer path -> [number of calls, total seconds]
+_counters = {}
+_stack = []
+
+class _NullTimer(object):
+    """ Stands in for a timer when instrumentation is disabled """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class Timer(object):
+    def __init__(self, name):
+        self.name_ = name
+        self.path_ = None
+        self.start_time_ = None
+
+    def __enter__(self):
+        _stack.append(self.name_)
+        self.path_ = '/'.join(_stack)
+        self.start_time_ = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.time() - self.start_time_
+        _stack.pop()
+        stats = _timers.get(self.path_)
+        if stats is None:
+            _timers[self.path_] = [1, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+        return False
+
+def enable(flag = True):
+    """ Turns instrumentation on or off for the whole process """
+    global enabled
+    enabled = flag
+
+def timer(name):
+    """
+    Returns a context manager that times its block under name, nested inside any enclosing timers
+    """
+    if not enabled:
+        return _NULL_TIMER
+    return Timer(name)
+
+def timed(name):
+    """ Decorator that times every call of a function under name """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with Timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count(name, n = 1):
+    """ Increments the counter name by n """
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+def reset():
+    """ Clears all timers and counters, e.g. before the next object """
+    _timers.clear()
+    _counters.clear()
+    del _stack[:]
+
+def report():
+    """
+    Returns:
+        dict with the timers (calls, total and mean seconds keyed by path) and counters since the last reset
+    """
+    timers = {}
+    for path, (num_calls, total_time) in _timers.items():
+        timers[path] = {'count': num_calls, 'total_sec': total_time, 'mean_sec': total_time / num_calls}
+    return {'timers': timers, 'counters': dict(_counters)}
+
+def merge_reports(total, other):
+    """
+    Adds the timers and counters of report other to report total, e.g. to aggregate per object reports over a run
+    Returns:
+        the merged report
+    """
+    if total is None:
+        total = {'timers': {}, 'counters': {}}
+    for path, stats in other['timers'].items():
+        if path not in total['timers']:
+            total['timers'][path] = {'count': 0, 'total_sec': 0.0}
+        merged = total['timers'][path]
+        merged['count'] += stats['count']
+        merged['total_sec'] += stats['total_sec']
+        merged['mean_sec'] = merged['total_sec'] / merged['count']
+    for name, value in other['counters'].items():
+        total['counters'][name] = total['counters'].get(name, 0) + value
+    return total
+
+def dump(filename, profile = None):
+    """ Writes a report (by default the current one) to a json file """
+    if profile is None:
+        profile = report()
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=2, sort_keys=True)
+    logging.info('Saved profile to %s' %(filename))
+
+def test_instrumentation():
+    enable()
+    reset()
+    for i in range(3):
+        with timer('outer'):
+            with timer('inner'):
+                count('lookups', 2)
+    profile = report()
+    assert profile['timers']['outer']['count'] == 3
+    assert profile['timers']['outer/inner']['count'] == 3
+    assert profile['counters']['lookups'] == 6
+
+    total = merge_reports(None, profile)
+    total = merge_reports(total, profile)
+    assert total['timers']['outer/inner']['count'] == 6
+    assert total['counters']['lookups'] == 12
+
+    # nothing is recorded when disabled
+    enable(False)
+    reset()
+    with timer('outer'):
+        count('lookups')
+    assert len(report()['timers']) == 0 and len(report()['counters']) == 0
+    logging.info('Instrumentation test passed!')
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    test_instrumentation()
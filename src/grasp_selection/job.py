@@ -13,6 +13,7 @@ import logging
 import multiprocessing as mp
 import numpy as np
 import os
+import subprocess
 import sys
 import time
 
@@ -56,6 +57,10 @@ def wait_for_input(timeout, prompt='> ', no_input_msg=''):
         return text
     except RuntimeError:
         print no_input_msg
+    except EOFError:
+        # no terminal attached, so just wait out the timeout
+        signal.alarm(0)
+        time.sleep(timeout)
     signal.signal(signal.SIGALRM, signal.SIG_IGN)
     return ''
 
@@ -336,18 +341,199 @@ class GceJob(Job):
                 raise e
         return False
 
+class LocalJob(Job):
+    """
+    A Job that runs the same partitions as GceJob as processes on this machine against the local dataset.
+    Completion is tracked through marker files in a local results directory instead of bucket listings
+    """
+    def __init__(self, config):
+        self.config = config
+        self._setup()
+
+    def _setup(self):
+        self.instance_manager = instance.LocalInstanceManager()
+        self.launched_instances = {}
+        self.user_terminated = False
+
+        # get job id
+        self.id = gen_job_id()
+        self.job_name_root = 'job-%s' %(self.id)
+        if self.config['update']:
+            self.job_name_root = 'job-updater-%s' %(self.id)
+
+        results_dir = 'results/local'
+        if 'local_results_dir' in self.config and self.config['local_results_dir'] is not None:
+            results_dir = self.config['local_results_dir']
+        self.job_store_dir = os.path.join(results_dir, self.job_name_root)
+
+    def instances_in_progress(self):
+        """ Returns a list of the instances running or waiting for a process slot """
+        return [inst for inst in self.launched_instances.values() if inst.running]
+
+    def completed_instances(self):
+        """ Returns a list of the instances that have finished """
+        return [inst for inst in self.launched_instances.values() if not inst.running]
+
+    def is_complete(self):
+        """ Complete if all instances finished or the user terminated the job """
+        return len(self.instances_in_progress()) == 0 or self.user_terminated
+
+    def spin(self):
+        # get user input
+        self.user_terminated = wait_for_input(self.config['sleep_time'], prompt='done? ')
+
+        # check for finished instances
+        instances_to_stop = []
+        for inst in self.instances_in_progress():
+            if os.path.exists(inst.done_filename):
+                with open(inst.done_filename, 'r') as f:
+                    return_code = f.read().strip()
+                if return_code != '0':
+                    logging.warning('Instance %s exited with code %s' %(inst.instance_name, return_code))
+                instances_to_stop.append(inst)
+                logging.info('Instance %s completed!' % inst.instance_name)
+
+        # free up process slots for queued instances
+        self.instance_manager.stop_instances(instances_to_stop)
+        self.instance_manager.update()
+        instance_names_in_progress = [inst.instance_name for inst in self.instances_in_progress()]
+        logging.info('Instances in progress: %s', ' '.join(instance_names_in_progress))
+
+    def start(self):
+        """ Start the job! """
+        self.user_terminated = False
+        if not os.path.exists(self.job_store_dir):
+            os.makedirs(self.job_store_dir)
+
+        # save config file to directory
+        with open(os.path.join(self.job_store_dir, 'config.yaml'), 'w') as f:
+            f.write(self.config.file_contents)
+
+        # allocate one instance per partition and run them on a pool of processes, one per core by default
+        local_allocator = instance.LocalInstanceAllocator(self.config)
+        instances = local_allocator.allocate(self.job_name_root, self.config['compute']['run_script'], self.job_store_dir)
+        self.launched_instances = self.instance_manager.launch_instances(instances, self.config['num_processes'])
+        return True
+
+    def stop(self):
+        """ Stop the job! """
+        self.instance_manager.stop_instances(self.instances_in_progress())
+        logging.info('Job results are in %s' %(self.job_store_dir))
+
+    def analyze(self):
+        """ Analyze the results """
+        start_time = time.time()
+        # just call an analysis script for now
+        if self.config['results_script'] is not None:
+            config_filename = os.path.join(self.job_store_dir, 'config.yaml')
+            subprocess.call([sys.executable, self.config['results_script'], config_filename, self.job_store_dir])
+        end_time = time.time()
+        logging.info('Result analysis took %f sec' %(end_time - start_time))
+
+    def store(self):
+        """
+        Runs the update script on the local dataset. Partitions are updated one at a time since they share the
+        database files
+        """
+        compute_config = self.config['compute']
+        if 'update_script' not in compute_config or compute_config['update_script'] is None:
+            return False
+
+        update_config = copy.deepcopy(self.config)
+        update_config['use_hard_limits'] = False
+        update_config['update'] = True
+        update_config['num_processes'] = 1
+        update_config['compute']['run_script'] = compute_config['update_script']
+        logging.info('Running update job with script %s' %(compute_config['update_script']))
+
+        update_job = LocalJob(update_config)
+        update_job.run()
+        return True
+
+def make_job(config):
+    """ Creates the job for the compute backend named by the backend config key, 'gce' (default) or 'local' """
+    backend = 'gce'
+    if 'backend' in config and config['backend'] is not None:
+        backend = config['backend']
+
+    if backend == 'gce':
+        return GceJob(config)
+    elif backend == 'local':
+        return LocalJob(config)
+    raise ValueError('Unknown compute backend %s' %(backend))
+
 def test_gce_job_run():
     config_name = 'cfg/test_gce.yaml'
     config = ec.ExperimentConfig(config_name)
-    gce_job = GceJob(config)
+    gce_job = make_job(config)
     gce_job.run()
 
 def test_gce_job_update():
     config_name = 'cfg/test_gce_update2.yaml'
     config = ec.ExperimentConfig(config_name)
-    gce_job = GceJob(config)
+    gce_job = make_job(config)
     gce_job.store()
 
+LOCAL_TEST_CONFIG = """
+dataset_counts: %(dir)s/counts.txt
+datasets:
+  - test_data
+max_chunk_size: 2
+backend: local
+num_processes: 2
+sleep_time: 1
+local_results_dir: %(dir)s/results
+results_script: %(dir)s/analyze.py
+compute:
+  run_script: %(dir)s/run.py
+"""
+
+LOCAL_TEST_RUN_SCRIPT = """
+import os, sys, yaml
+config = yaml.safe_load(open(sys.argv[1]))
+with open(os.path.join(sys.argv[2], 'chunk.txt'), 'w') as f:
+    f.write('%s %d %d' %(config['dataset'], config['chunk_start'], config['chunk_end']))
+"""
+
+LOCAL_TEST_ANALYZE_SCRIPT = """
+import os, sys
+results = sorted(os.listdir(sys.argv[2]))
+with open(os.path.join(sys.argv[2], 'analysis.txt'), 'w') as f:
+    f.write(' '.join(results))
+"""
+
+def test_local_job_run(test_dir='local_job_test'):
+    import shutil
+    test_dir = os.path.abspath(test_dir)
+    os.makedirs(test_dir)
+    with open(os.path.join(test_dir, 'counts.txt'), 'w') as f:
+        f.write('5 test_data\n')
+    for filename, contents in [('config.yaml', LOCAL_TEST_CONFIG %{'dir': test_dir}),
+                               ('run.py', LOCAL_TEST_RUN_SCRIPT), ('analyze.py', LOCAL_TEST_ANALYZE_SCRIPT)]:
+        with open(os.path.join(test_dir, filename), 'w') as f:
+            f.write(contents)
+
+    # the backend key picks the local job, which runs one process per chunk
+    config = ec.ExperimentConfig(os.path.join(test_dir, 'config.yaml'))
+    local_job = make_job(config)
+    assert isinstance(local_job, LocalJob)
+    local_job.run()
+
+    instance_names = sorted(local_job.launched_instances.keys())
+    assert len(instance_names) == 3
+    for i, instance_name in enumerate(instance_names):
+        with open(os.path.join(local_job.job_store_dir, instance_name + '.done')) as f:
+            assert f.read().strip() == '0'
+        with open(os.path.join(local_job.job_store_dir, instance_name, 'chunk.txt')) as f:
+            assert f.read() == 'test_data %d %d' %(2 * i, 2 * i + 2)
+
+    # analysis runs on the job results
+    local_job.analyze()
+    with open(os.path.join(local_job.job_store_dir, 'analysis.txt')) as f:
+        assert f.read().split() == sorted(['config.yaml'] + instance_names + [name + '.done' for name in instance_names])
+    shutil.rmtree(test_dir)
+    logging.info('Local job test passed!')
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     test_gce_job_update()
@@ -12,11 +12,92 @@ import sys
 import tfx
 
 import camera_params as cp
+import connected_components as cc
 import obj_file
 
 # import mayavi.mlab as mv
 import pyhull.convex_hull as cvh
 
+def rasterize_triangles(verts_proj, verts_depth, triangles, image, depth=False, max_pixels_per_batch=1000000):
+    '''
+    Fills projected triangles into an image in place using edge functions evaluated over each triangle's bounding box.
+    Triangles are processed in batches sorted by bounding box area to bound memory.
+    Params:
+       verts_proj: (numpy num_verts x 2 array) projected vertex image coords (x, y)
+       verts_depth: (numpy num_verts array) vertex depths in the camera basis
+       triangles: (numpy num_tris x 3 int array) vertex indices of each triangle
+       image: (numpy height x width array) image to fill, 255 where covered or the nearest depth if depth is True
+       depth: (bool) whether to z-buffer the interpolated depths
+    '''
+    height, width = image.shape
+    if triangles.shape[0] == 0:
+        return image
+
+    # only draw triangles entirely in front of the camera
+    tri_depths = verts_depth[triangles]
+    in_front = (tri_depths > 0).all(axis=1)
+    tri_pts = verts_proj[triangles[in_front]].astype(np.float64)
+    tri_depths = tri_depths[in_front]
+
+    # bounding boxes clipped to the image, skipping degenerate and offscreen triangles
+    box_min = np.maximum(np.floor(tri_pts.min(axis=1)), 0).astype(np.int64)
+    box_max = np.minimum(np.ceil(tri_pts.max(axis=1)), [width - 1, height - 1]).astype(np.int64)
+    x0, y0 = tri_pts[:,0,0], tri_pts[:,0,1]
+    x1, y1 = tri_pts[:,1,0], tri_pts[:,1,1]
+    x2, y2 = tri_pts[:,2,0], tri_pts[:,2,1]
+    areas = (x1 - x0) * (y2 - y0) - (y1 - y0) * (x2 - x0)
+    keep = (box_max >= box_min).all(axis=1) & (areas != 0)
+
+    box_sizes = box_max - box_min + 1
+    box_areas = np.prod(box_sizes, axis=1)
+    order = np.nonzero(keep)[0]
+    order = order[np.argsort(box_areas[order], kind='mergesort')]
+    if depth:
+        depth_buf = np.empty(height * width)
+        depth_buf.fill(np.inf)
+
+    start = 0
+    while start < order.shape[0]:
+        # batch triangles with similar box sizes, the last one in the batch has the largest box
+        num_tris = max(max_pixels_per_batch / box_areas[order[start]], 1)
+        while num_tris > 1 and num_tris * box_areas[order[min(start + num_tris, order.shape[0]) - 1]] > max_pixels_per_batch:
+            num_tris = num_tris / 2
+        batch = order[start:start + num_tris]
+        start = start + num_tris
+
+        # candidate pixels in each bounding box
+        box_w = box_sizes[batch,0].max()
+        box_h = box_sizes[batch,1].max()
+        px = box_min[batch,0][:,np.newaxis,np.newaxis] + np.arange(box_w)[np.newaxis,np.newaxis,:]
+        py = box_min[batch,1][:,np.newaxis,np.newaxis] + np.arange(box_h)[np.newaxis,:,np.newaxis]
+        in_box = (px <= box_max[batch,0][:,np.newaxis,np.newaxis]) & (py <= box_max[batch,1][:,np.newaxis,np.newaxis])
+
+        # edge functions, oriented so that the triangle interior is nonnegative
+        sign = np.sign(areas[batch])[:,np.newaxis,np.newaxis]
+        bx0, by0 = x0[batch][:,np.newaxis,np.newaxis], y0[batch][:,np.newaxis,np.newaxis]
+        bx1, by1 = x1[batch][:,np.newaxis,np.newaxis], y1[batch][:,np.newaxis,np.newaxis]
+        bx2, by2 = x2[batch][:,np.newaxis,np.newaxis], y2[batch][:,np.newaxis,np.newaxis]
+        w0 = sign * ((bx2 - bx1) * (py - by1) - (by2 - by1) * (px - bx1))
+        w1 = sign * ((bx0 - bx2) * (py - by2) - (by0 - by2) * (px - bx2))
+        w2 = sign * ((bx1 - bx0) * (py - by0) - (by1 - by0) * (px - bx0))
+        inside = in_box & (w0 >= 0) & (w1 >= 0) & (w2 >= 0)
+        pixel_ind = (py * width + px)[inside]
+
+        if not depth:
+            image.flat[pixel_ind] = 255
+            continue
+
+        # perspective correct depth from barycentric interpolation of inverse depths
+        inv_depths = 1.0 / tri_depths[batch]
+        inv_depth = (w0 * inv_depths[:,0][:,np.newaxis,np.newaxis] + w1 * inv_depths[:,1][:,np.newaxis,np.newaxis] + \
+                     w2 * inv_depths[:,2][:,np.newaxis,np.newaxis]) / np.abs(areas[batch])[:,np.newaxis,np.newaxis]
+        np.minimum.at(depth_buf, pixel_ind, 1.0 / inv_depth[inside])
+
+    if depth:
+        depth_buf[np.isinf(depth_buf)] = 0
+        image[:] = depth_buf.reshape(height, width)
+    return image
+
 class Mesh3D(object):
     """
     A Mesh is a three-dimensional shape representation
@@ -170,40 +251,48 @@ class Mesh3D(object):
         The image is assumed to be taken from a camera with specified params at
         a given relative pose to the mesh.
         Params:
-           camera_params: CameraParams object
-           camera_pose: 4x4 pose matrix (camera in mesh basis)
+           camera_params: CameraParams object, whose pose takes the mesh basis to the camera basis
         Returns:
            PIL binary image (1 = mesh projects to point, 0 = does not)
         '''
+        images = self.render_views(camera_params, [camera_params.pose()])
+        return Image.fromarray(images[0])
+
+    def render_views(self, camera_params, camera_poses, depth=False, max_pixels_per_batch=1000000):
+        '''
+        Renders the mesh from many camera poses, transforming and projecting all vertices at once per view
+        and scan-converting the triangles with a vectorized edge-function rasterizer.
+        Params:
+           camera_params: CameraParams object
+           camera_poses: list of 4x4 numpy arrays or tfx transforms from the mesh basis to the camera basis
+           depth: (bool) whether to render depth images instead of binary images
+           max_pixels_per_batch: (int) max number of candidate pixels to test at once
+        Returns:
+           numpy num_views x height x width array, uint8 binary images (255 = mesh projects to point, 0 = does not)
+           or float32 depth images (0 = background)
+        '''
         vertex_array = np.array(self.vertices_)
-        camera_pose = camera_params.pose().matrix()
-        R = camera_pose[:3,:3]
-        t = camera_pose[:3,3:]
-        t_rep = np.tile(t, [1, 3]) # replicated t vector for fast transformations
-        
-        height = camera_params.get_height()
-        width = camera_params.get_width()
-        img_shape = [int(height), int(width)]
-        fill_img = Image.fromarray(np.zeros(img_shape).astype(np.uint8)) # init grayscale image
-        img_draw = ImageDraw.Draw(fill_img)
+        triangles = np.array(self.triangles_)
+        height = int(camera_params.height())
+        width = int(camera_params.width())
+
+        if depth:
+            images = np.zeros([len(camera_poses), height, width], dtype=np.float32)
+        else:
+            images = np.zeros([len(camera_poses), height, width], dtype=np.uint8)
+
+        for i, camera_pose in enumerate(camera_poses):
+            if hasattr(camera_pose, 'matrix'):
+                camera_pose = camera_pose.matrix
+            camera_pose = np.array(camera_pose)
+
+            # transform to camera basis and project to the camera imaging plane
+            verts_cam_basis = vertex_array.dot(camera_pose[:3,:3].T) + camera_pose[:3,3]
+            verts_proj, _ = camera_params.project(verts_cam_basis.T)
+            rasterize_triangles(verts_proj.T, verts_cam_basis[:,2], triangles, images[i], depth=depth,
+                                max_pixels_per_batch=max_pixels_per_batch)
+        return images
 
-        # project each triangle and fill in image
-        for f in self.triangles_:
-            verts_mesh_basis = np.array([vertex_array[f[0],:], vertex_array[f[1],:], vertex_array[f[2],:]])
-
-            # transform to camera basis
-            verts_cam_basis = R.dot(verts_mesh_basis.T) + t_rep
-            # project points to the camera imaging plane and snap to image borders
-            verts_proj, valid = camera_params.project(verts_cam_basis)
-            verts_proj[0, verts_proj[0,:] < 0] = 0
-            verts_proj[1, verts_proj[1,:] < 0] = 0
-            verts_proj[0, verts_proj[0,:] >= width]  = width - 1
-            verts_proj[1, verts_proj[1,:] >= height] = height - 1
-
-            # fill in area on image
-            img_draw.polygon([tuple(verts_proj[:,0]), tuple(verts_proj[:,1]), tuple(verts_proj[:,2])], fill=255)
-        return fill_img
-    
     def remove_unreferenced_vertices(self):
         '''
         Clean out vertices (and normals) not referenced by any triangles.
@@ -314,8 +403,8 @@ class Mesh3D(object):
 
     def transform(self, tf):
         vertex_array = np.array(self.vertices_)
-        vertex_array_tf = tf.apply(vertex_array.T)
-        return Mesh3D(vertex_array_tf.T.tolist(), self.triangles_)
+        vertex_array_tf = tf.apply_points(vertex_array)
+        return Mesh3D(vertex_array_tf.tolist(), self.triangles_)
 
     def rescale_vertices(self, min_scale):
         '''
@@ -379,10 +468,7 @@ class Mesh3D(object):
             'category': self.category
         }
 
-    """
     def num_connected_components(self):
-        vert_labels = np.linspace(0, len(self.vertices_)-1, num=len(self.vertices_)).astype(np.uint32)
-        for t in self.triangles_:
-            vert_labels[t[1]] = vert_labels[t[0]]
-            vert_labels[t[2]] = vert_labels[t[0]]
-    """                   
+        """ Returns the number of connected components formed by the mesh triangles """
+        num_components, vertex_labels, triangle_labels, component_sizes = cc.label_components(self.triangles_, len(self.vertices_))
+        return np.unique(triangle_labels).shape[0]
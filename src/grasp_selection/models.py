@@ -11,8 +11,39 @@ import numpy as np
 import scipy.stats
 import numbers
 
+import instrumentation as inst
+
 import IPython
 
+# below this shape both gamma draws of a beta sample can underflow to zero
+MIN_GAMMA_RATIO_SHAPE = 0.1
+
+def random_generator(seed = None):
+    """
+    Returns a dedicated random number generator for sampling from a model, a numpy Generator if available and a
+    RandomState otherwise. Without a seed the generator is seeded from fresh entropy, so callers pass a seed (e.g. from
+    their config) for reproducible runs. Seeds may be ints or sequences of ints
+    """
+    if hasattr(np.random, 'default_rng'):
+        return np.random.default_rng(seed)
+    return np.random.RandomState(seed)
+
+def standard_normal(random, out):
+    """ Fills out with standard normal samples from random, without allocating when random is a numpy Generator """
+    if isinstance(random, np.random.RandomState):
+        out[:] = random.standard_normal(out.shape)
+    else:
+        random.standard_normal(out=out)
+    return out
+
+def standard_gamma(random, shape, out):
+    """ Fills out with standard gamma samples from random, without allocating when random is a numpy Generator """
+    if isinstance(random, np.random.RandomState):
+        out[:] = random.standard_gamma(shape)
+    else:
+        random.standard_gamma(shape, out=out)
+    return out
+
 class Model:
     """
     A predictor of some value of the input data
@@ -47,6 +78,8 @@ class DiscreteModel(Model):
     """
     Maintains a prediction over a discrete set of points
     """
+    state_attributes_ = [] # attributes that change with updates and sampling, saved in checkpoints
+
     @abstractmethod
     def max_prediction(self):
         """
@@ -66,6 +99,18 @@ class DiscreteModel(Model):
         """Returns the number of variables in the model"""
         return self.num_vars_
 
+    def get_state(self):
+        """
+        Returns copies of the posterior parameters and random generator, enough to continue sampling from this model
+        with the same random stream after set_state
+        """
+        return dict([(name, copy.deepcopy(getattr(self, name))) for name in self.state_attributes_])
+
+    def set_state(self, state):
+        """ Restores the posterior parameters and random generator from a state returned by get_state """
+        for name in self.state_attributes_:
+            setattr(self, name, copy.deepcopy(state[name]))
+
 
 class Snapshot:
     __metaclass__ = ABCMeta
@@ -97,6 +142,8 @@ class BernoulliModel(DiscreteModel):
         num_vars: (int) the number of variables to track
         prior_means: (float) prior on mean probabilty of success for candidates
     """
+    state_attributes_ = ['pred_means_', 'num_observations_']
+
     def __init__(self, num_vars, mean_prior = 0.5):
         if num_vars <= 0:
             raise ValueError('Must provide at least one variable to BetaBernoulliModel')
@@ -176,13 +223,16 @@ class BetaBernoulliModel(DiscreteModel):
         alpha_prior and beta_prior: (float) the prior parameters of a Beta distribution over the
         probability of success for each candidate
     """
-    def __init__(self, num_vars, alpha_prior = 1., beta_prior = 1.):
+    state_attributes_ = ['posterior_alphas_', 'posterior_betas_', 'num_observations_', 'random_']
+
+    def __init__(self, num_vars, alpha_prior = 1., beta_prior = 1., seed = None):
         if num_vars <= 0:
             raise ValueError('Must provide at least one variable to BetaBernoulliModel')
 
         self.num_vars_ = num_vars
         self.alpha_prior_  = alpha_prior
         self.beta_prior_  = beta_prior
+        self.random_ = random_generator(seed)
 
         self._init_model_params()
 
@@ -203,6 +253,11 @@ class BetaBernoulliModel(DiscreteModel):
         
         self.num_observations_ = np.zeros(self.num_vars_)
 
+        # output buffers reused by sample, posteriors never drop below the priors
+        self.samples_ = np.zeros(self.num_vars_)
+        self.gamma_samples_ = np.zeros(self.num_vars_)
+        self.use_gamma_ratio_ = min(np.min(self.posterior_alphas_), np.min(self.posterior_betas_)) >= MIN_GAMMA_RATIO_SHAPE
+
     @staticmethod
     def beta_mean(alpha, beta):
         """ Mean of the beta distribution with params alpha and beta """
@@ -259,10 +314,17 @@ class BetaBernoulliModel(DiscreteModel):
 
     def sample(self, vis = False, stop = False):
         """
-        Samples probabilities of success from the given values
+        Samples probabilities of success from the given values. The returned array is reused by the next call
         """
-        #samples = np.random.beta(self.posterior_alphas_, self.posterior_betas_)
-        samples = scipy.stats.beta.rvs(self.posterior_alphas_, self.posterior_betas_)
+        samples = self.samples_
+        if self.use_gamma_ratio_:
+            # X / (X + Y) is Beta(a, b) distributed for X ~ Gamma(a) and Y ~ Gamma(b)
+            standard_gamma(self.random_, self.posterior_alphas_, samples)
+            standard_gamma(self.random_, self.posterior_betas_, self.gamma_samples_)
+            self.gamma_samples_ += samples
+            samples /= self.gamma_samples_
+        else:
+            samples[:] = self.random_.beta(self.posterior_alphas_, self.posterior_betas_)
         if stop:
             IPython.embed()
         if vis:
@@ -281,20 +343,25 @@ class GaussianModel(DiscreteModel):
         mean_prior: (float) prior parameter
         sigma: (float) noise
     """
-    def __init__(self, num_vars, mean_prior=0.5, sigma=1e-2):
+    state_attributes_ = ['means_', 'vars_', 'stds_', 'num_observations_', 'random_']
+
+    def __init__(self, num_vars, mean_prior=0.5, sigma=1e-2, seed=None):
         if num_vars <= 0:
             raise ValueError('Must provide at least one variable to GaussianModel')
 
         self.num_vars_ = num_vars
         self.mean_prior_  = mean_prior
         self.sigma_ = sigma
+        self.random_ = random_generator(seed)
 
         self._init_model_params()
 
     def _init_model_params(self):
         self.means_ = self.mean_prior_ * np.ones(self.num_vars_)
         self.vars_ = np.ones(self.num_vars_)
+        self.stds_ = np.ones(self.num_vars_) # kept in sync with vars_ for sampling
         self.num_observations_ = np.zeros(self.num_vars_)
+        self.samples_ = np.zeros(self.num_vars_) # output buffer reused by sample
 
     @property
     def means(self):
@@ -337,11 +404,15 @@ class GaussianModel(DiscreteModel):
 
         self.means_[index] = old_mean + ((value - old_mean) * old_var) / (old_var + noise)
         self.vars_[index] = old_var - (old_var ** 2) / (old_var + noise)
+        self.stds_[index] = np.sqrt(self.vars_[index])
         self.num_observations_[index] += 1
 
     def sample(self, stop=False):
-        """Sample discrete predictions from the model."""
-        samples = scipy.stats.multivariate_normal.rvs(self.means_, self.vars_)
+        """Sample discrete predictions from the model. The covariance is diagonal, so the variables are sampled
+        independently instead of factoring a full covariance matrix. The returned array is reused by the next call."""
+        samples = standard_normal(self.random_, self.samples_)
+        samples *= self.stds_
+        samples += self.means_
         if stop:
             IPython.embed()
         return samples
@@ -365,8 +436,8 @@ class CorrelatedBetaBernoulliModel(BetaBernoulliModel):
         distribution over the probability of success for each candidate
     """
     def __init__(self, candidates, nn, kernel, tolerance=1e-2,
-                 alpha_prior=1.0, beta_prior=1.0, p=0.5):
-        BetaBernoulliModel.__init__(self, len(candidates), alpha_prior, beta_prior)
+                 alpha_prior=1.0, beta_prior=1.0, p=0.5, seed=None):
+        BetaBernoulliModel.__init__(self, len(candidates), alpha_prior, beta_prior, seed)
         self.candidates_ = candidates
 
         self.kernel_ = kernel
@@ -398,8 +469,10 @@ class CorrelatedBetaBernoulliModel(BetaBernoulliModel):
 
         # find neighbors within radius
         candidate = self.candidates_[index]
-        neighbor_indices, _ = self.nn_.within_distance(candidate, self.error_radius_,
-                                                       return_indices=True)
+        with inst.timer('neighbor_search'):
+            neighbor_indices, _ = self.nn_.within_distance(candidate, self.error_radius_,
+                                                           return_indices=True)
+        inst.count('correlated_neighbors', len(neighbor_indices))
         # create array of correlations
         correlations = np.zeros(self.num_vars_)
         for neighbor_index in neighbor_indices:
@@ -12,6 +12,7 @@ import sklearn.cluster
 import antipodal_grasp_sampler as ags
 import grasp as gr
 import graspable_object as go
+import instrumentation as inst
 import obj_file
 import quality as pgq
 import sdf_file
@@ -86,6 +87,7 @@ class GraspableObjectGaussianPose:
     def rvs(self, size=1, iteration=1):
         """ Samples random variables """
         if self.num_prealloc_samples_ > 0:
+            inst.count('prealloc_sample_hits', size)
             samples = []
             for i in range(size):
                 samples.append(self.prealloc_samples_[(iteration + i) % self.num_prealloc_samples_])
@@ -149,6 +151,7 @@ class ParamsGaussian:
     def rvs(self, size=1, iteration=1):
         """ Samples |size| random variables """
         if self.num_prealloc_samples_ > 0:
+            inst.count('prealloc_sample_hits', size)
             samples = []
             for i in range(size):
                 samples.append(self.prealloc_samples_[(iteration + i) % self.num_prealloc_samples_])
@@ -208,6 +211,7 @@ class ParallelJawGraspGaussian:
     def rvs(self, size=1, iteration=1):
         """ Samples |size| random variables """
         if self.num_prealloc_samples_ > 0:
+            inst.count('prealloc_sample_hits', size)
             samples = []
             for i in range(size):
                 samples.append(self.prealloc_samples_[(iteration + i) % self.num_prealloc_samples_])
@@ -247,28 +251,23 @@ class PartialClosureRV:
         else:
             return self.features_.phi
 
+    @inst.timed('partial_closure_sample')
     def sample_success(self):
         # sample grasp
-        cur_time = time.clock()
-        grasp_sample = self.grasp_rv_.rvs(size=1, iteration=self.sample_count_)
-        grasp_time = time.clock()
+        with inst.timer('grasp_sample'):
+            grasp_sample = self.grasp_rv_.rvs(size=1, iteration=self.sample_count_)
 
         # sample object
-        obj_sample = self.obj_rv_.rvs(size=1, iteration=self.sample_count_)
-        obj_time = time.clock()
+        with inst.timer('obj_sample'):
+            obj_sample = self.obj_rv_.rvs(size=1, iteration=self.sample_count_)
 
         # sample friction cone
-        friction_coef_sample = self.friction_coef_rv_.rvs(size=1)
-        friction_time = time.clock()
+        with inst.timer('friction_sample'):
+            friction_coef_sample = self.friction_coef_rv_.rvs(size=1)
 
         #sample params
-        params_rv_sample=self.params_rv_.rvs(size=1,iteration=self.sample_count_)
-        params_time=time.clock()
-
-        #logging.info('Grasp sample time %f'%(grasp_time - cur_time))
-        #logging.info('Obj sample time %f'%(obj_time - grasp_time))
-        #logging.info('Friction sample time %f'%(friction_time - obj_time))
-	
+        with inst.timer('params_sample'):
+            params_rv_sample=self.params_rv_.rvs(size=1,iteration=self.sample_count_)
 
         # compute force closure
         fc = pgq.PointGraspMetrics3D.grasp_quality(grasp_sample, obj_sample, "partial_closure", friction_coef = friction_coef_sample,
@@ -313,23 +312,19 @@ class ForceClosureRV:
         else:
             return self.features_
 
+    @inst.timed('force_closure_sample')
     def sample_success(self):
         # sample grasp
-        cur_time = time.clock()
-        grasp_sample = self.grasp_rv_.rvs(size=1, iteration=self.sample_count_)
-        grasp_time = time.clock()
+        with inst.timer('grasp_sample'):
+            grasp_sample = self.grasp_rv_.rvs(size=1, iteration=self.sample_count_)
 
         # sample object
-        obj_sample = self.obj_rv_.rvs(size=1, iteration=self.sample_count_)
-        obj_time = time.clock()
+        with inst.timer('obj_sample'):
+            obj_sample = self.obj_rv_.rvs(size=1, iteration=self.sample_count_)
 
         # sample friction cone
-        friction_coef_sample = self.friction_coef_rv_.rvs(size=1)
-        friction_time = time.clock()
-
-        #logging.info('Grasp sample time %f'%(grasp_time - cur_time))
-        #logging.info('Obj sample time %f'%(obj_time - grasp_time))
-        #logging.info('Friction sample time %f'%(friction_time - obj_time))
+        with inst.timer('friction_sample'):
+            friction_coef_sample = self.friction_coef_rv_.rvs(size=1)
 
         # compute force closure
         fc = pgq.PointGraspMetrics3D.grasp_quality(grasp_sample, obj_sample, "force_closure", friction_coef = friction_coef_sample,
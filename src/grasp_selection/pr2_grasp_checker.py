@@ -247,6 +247,11 @@ class OpenRaveGraspChecker(object):
         self.env.Remove(obj)
         return object_grasps_keep
 
+    def collision_free_rotations(self, graspable, grasps, theta_res):
+        """ Returns the collision free rotations of each grasp about its axis """
+        return [self.prune_grasps_in_collision(graspable, grasp.transform(graspable.tf, theta_res), auto_step=True, delay=0.0)
+                for grasp in grasps]
+
 def test_grasp_collisions():
     np.random.seed(100)
 
@@ -6,6 +6,7 @@ import time
 
 import grasp as g
 import graspable_object as go
+import instrumentation as inst
 import obj_file
 import sdf_file
 
@@ -18,6 +19,7 @@ import IPython
 class PointGraspMetrics3D:
 
     @staticmethod
+    @inst.timed('grasp_quality')
     def grasp_quality(grasp, obj, method = 'force_closure', soft_fingers = False, friction_coef = 0.5, num_cone_faces = 8, params = None, vis=False):
         if not isinstance(grasp, g.PointGrasp):
             raise ValueError('Must provide a point grasp object')
@@ -75,7 +77,8 @@ class PointGraspMetrics3D:
 
         # evaluate the desired quality metric
         Q_func = getattr(PointGraspMetrics3D, method)
-        quality = Q_func(forces, torques, normals, soft_fingers, params)
+        with inst.timer(method):
+            quality = Q_func(forces, torques, normals, soft_fingers, params)
         return quality
 
     @staticmethod
@@ -165,10 +168,9 @@ class PointGraspMetrics3D:
 
         # create grasp matrix
         G = PointGraspMetrics3D.grasp_matrix(forces, torques, normals, soft_fingers)
-        s = time.clock()
-        hull = cvh.ConvexHull(G.T, joggle=not soft_fingers)
-        e = time.clock()
-        logging.info('Convex hull took %f sec' %(e-s))
+        with inst.timer('convex_hull'):
+            hull = cvh.ConvexHull(G.T, joggle=not soft_fingers)
+        inst.count('convex_hulls')
 
         if len(hull.vertices) == 0:
             logging.warning('Convex hull could not be computed')
@@ -208,7 +210,8 @@ class PointGraspMetrics3D:
         h = zeros(num_wrenches+1)
         h[num_wrenches] = f
 
-        sol = cvx.solvers.qp(P, q, G, h)        
+        sol = cvx.solvers.qp(P, q, G, h)
+        inst.count('qp_solves')
         min_dist = sol['primal objective']
         return min_dist < eps
 
@@ -230,6 +233,7 @@ class PointGraspMetrics3D:
         b = cvx.matrix(np.ones(1))         # combinations of vertices
 
         sol = cvx.solvers.qp(P, q, G, h, A, b)
+        inst.count('qp_solves')
 
         min_norm = sol['primal objective']
         return abs(min_norm)
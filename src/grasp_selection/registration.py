@@ -3,6 +3,7 @@ from abc import ABCMeta, abstractmethod
 import IPython
 import numpy as np
 import scipy.spatial.distance as ssd
+import scipy.linalg
 import scipy.optimize as opt
 import obj_file as of
 import similarity_tf as stf
@@ -22,37 +23,79 @@ class RegistrationFunc:
         pass
 
 class tpsRegistrationSolver(RegistrationFunc):
-    def __init__(self):
-        pass
-
-    def __init__(self,bend_coef,rot_coef):
+    def __init__(self, bend_coef, rot_coef, max_control_points = None, max_points_per_batch = 10000):
+        """
+        Thin plate spline registration
+        Params:
+            bend_coef: (float) regularization of the spline bending energy
+            rot_coef: (float) regularization of the linear part of the warp
+            max_control_points: (int) max number of spline centers, larger correspondence sets are fit by least
+                squares on a farthest point subsample of the source points
+            max_points_per_batch: (int) max number of points to evaluate the kernel at at once
+        """
         self.lin_ag_=None
         self.bend_coef=bend_coef
         self.rot_coef=rot_coef
+        self.max_control_points_ = max_control_points
+        self.max_points_per_batch_ = max_points_per_batch
 
     def register(self,correspondences, weights=None, K_nn = None):
         self.source_points=correspondences.source_points
         self.target_points_=correspondences.target_points
         N,D = self.source_points.shape     
-
-        K_nn = tps_kernel_matrix(self.source_points) if K_nn is None else K_nn
         coef_ratio = self.bend_coef / self.rot_coef if self.rot_coef > 0 else 0
-        #if weights is None: reg_nn = self.bend_coef * np.eye(N)    
-        #else: reg_nn = np.diag(self.bend_coef/(weights + 1e-6))
-        #print weights
-    
-        A = np.zeros((N+D+1, N+D+1))
-	    
-        A[:N, :N] = K_nn
+        weights = np.ones(N) if weights is None else np.ravel(weights) * np.ones(N)
 
-        A.flat[np.arange(0,N)*(N+D+2)] += self.bend_coef/(weights if weights is not None else 1)
+        if self.max_control_points_ is not None and N > self.max_control_points_:
+            control_indices = farthest_point_sample(self.source_points, self.max_control_points_)
+            self.control_points_ = self.source_points[control_indices]
+            self.w_ng_, self.lin_ag_, self.trans_g_ = self._fit_least_squares(weights, coef_ratio)
+            return
 
-        A[:N, N:N+D] = self.source_points
+        self.control_points_ = self.source_points
+        K_nn = tps_kernel_matrix(self.source_points) if K_nn is None else K_nn
+        A_nn = K_nn + np.diag(self.bend_coef / weights)
+        try:
+            self.w_ng_, self.lin_ag_, self.trans_g_ = self._solve_exact(A_nn, coef_ratio)
+        except np.linalg.LinAlgError:
+            # the kernel is not positive definite on the constraint space (e.g. 2D), use the full saddle point system
+            self.w_ng_, self.lin_ag_, self.trans_g_ = self._solve_dense(A_nn, coef_ratio)
+
+    def _solve_exact(self, A_nn, coef_ratio):
+        """
+        Solves the interpolating system by eliminating the constraint 1^T w = 0 with a Householder reflection and
+        factoring the remaining symmetric positive definite block with Cholesky. The linear part is recovered from
+        a D x D Schur complement
+        """
+        X, Y = self.source_points, self.target_points_
+        N, D = X.shape
+        u = -np.ones(N) / np.sqrt(N)
+        u[0] += 1
+        u = u / np.linalg.norm(u)
+        reflect = lambda B: B - 2 * np.outer(u, u.dot(B))
+
+        # Q^T A Q for the reflection Q = I - 2uu^T, whose first column is the normalized ones vector
+        Au = A_nn.dot(u)
+        A_qq = A_nn - 2 * np.outer(u, Au) - 2 * np.outer(Au, u) + 4 * u.dot(Au) * np.outer(u, u)
+        A_factor = scipy.linalg.cho_factor(A_qq[1:,1:])
+        X_q = reflect(X)[1:]
+        S_x = scipy.linalg.cho_solve(A_factor, X_q)
+        S_y = scipy.linalg.cho_solve(A_factor, reflect(Y)[1:])
+
+        lin_ag = np.linalg.solve(coef_ratio * np.eye(D) - X_q.T.dot(S_x), coef_ratio * np.eye(D) - X_q.T.dot(S_y))
+        w_ng = reflect(np.r_[np.zeros([1, D]), S_y - S_x.dot(lin_ag)])
+        trans_g = np.mean(Y - A_nn.dot(w_ng) - X.dot(lin_ag), axis=0)
+        return w_ng, lin_ag, trans_g
+
+    def _solve_dense(self, A_nn, coef_ratio):
+        X = self.source_points
+        N, D = X.shape
+        A = np.zeros((N+D+1, N+D+1))
+        A[:N, :N] = A_nn
+        A[:N, N:N+D] = X
         A[:N, N+D] = 1
-
-        A[N:N+D,:N] = self.source_points.T
+        A[N:N+D,:N] = X.T
         A[N+D,:N] = 1
-
         A[N:N+D, N:N+D] = coef_ratio*np.eye(D)
 
         B = np.empty((N+D+1, D))
@@ -61,13 +104,80 @@ class tpsRegistrationSolver(RegistrationFunc):
         B[N+D] = 0
 
         X = np.linalg.solve(A, B)
-        self.w_ng_ = X[:N,:]
-        self.lin_ag_ = X[N:N+D,:]
-        self.trans_g_ = X[N+D,:]
+        return X[:N,:], X[N:N+D,:], X[N+D,:]
+
+    def _fit_least_squares(self, weights, coef_ratio):
+        """
+        Fits a spline centered on the control points to all correspondences by regularized weighted least squares.
+        The normal equations are accumulated in batches and solved with Cholesky after restricting the spline
+        weights to the space where the bending energy is positive definite
+        """
+        X, Y, C = self.source_points, self.target_points_, self.control_points_
+        N, D = X.shape
+        M = C.shape[0]
+        K_mm = tps_kernel_matrix(C)
+
+        # spline weights must be orthogonal to the polynomials the kernel is conditionally positive definite for
+        P_c = np.ones([M, 1]) if D == 3 else np.c_[C, np.ones(M)]
+        Q, _ = np.linalg.qr(P_c, mode='complete')
+        Z = Q[:, P_c.shape[1]:]
+
+        KWK = self.bend_coef * K_mm
+        KWP = np.zeros([M, D+1])
+        PWP = np.zeros([D+1, D+1])
+        KWY = np.zeros([M, D])
+        PWY = np.zeros([D+1, D])
+        for start in range(0, N, self.max_points_per_batch_):
+            end = min(start + self.max_points_per_batch_, N)
+            K_b = tps_kernel_matrix2(X[start:end], C)
+            P_b = np.c_[X[start:end], np.ones(end - start)]
+            W_b = weights[start:end,np.newaxis]
+            KWK += K_b.T.dot(W_b * K_b)
+            KWP += K_b.T.dot(W_b * P_b)
+            PWP += P_b.T.dot(W_b * P_b)
+            KWY += K_b.T.dot(W_b * Y[start:end])
+            PWY += P_b.T.dot(W_b * Y[start:end])
+
+        # penalize deviation of the linear part from the identity
+        rot_penalty = self.bend_coef * coef_ratio
+        PWP[:D,:D] += rot_penalty * np.eye(D)
+        PWY[:D] += rot_penalty * np.eye(D)
+
+        G = np.r_[np.c_[Z.T.dot(KWK).dot(Z), Z.T.dot(KWP)],
+                  np.c_[KWP.T.dot(Z), PWP]]
+        b = np.r_[Z.T.dot(KWY), PWY]
+        sol = scipy.linalg.cho_solve(scipy.linalg.cho_factor(G), b)
+        num_w = Z.shape[1]
+        return Z.dot(sol[:num_w]), sol[num_w:num_w+D], sol[num_w+D]
 
     def transform(self,x):
-        K=tps_kernel_matrix2(x,self.source_points)
-        return np.transpose(np.dot(np.transpose(self.w_ng_),K)+np.dot(np.transpose(self.lin_ag_),np.transpose(x)))+self.trans_g_
+        """
+        Applies the warp to an N x D array of points, in batches
+        """
+        x_tf = np.empty(x.shape)
+        for start in range(0, x.shape[0], self.max_points_per_batch_):
+            x_b = x[start:start+self.max_points_per_batch_]
+            K = tps_kernel_matrix2(x_b, self.control_points_)
+            x_tf[start:start+self.max_points_per_batch_] = K.dot(self.w_ng_) + x_b.dot(self.lin_ag_) + self.trans_g_
+        return x_tf
+
+    def jacobian(self, x):
+        """
+        Returns the N x D x D Jacobians of the warp at an N x D array of points, in batches
+        """
+        N, D = x.shape
+        J = np.empty([N, D, D])
+        batch_size = max(self.max_points_per_batch_ / self.control_points_.shape[0], 1)
+        for start in range(0, N, batch_size):
+            grad = tps_kernel_gradient(x[start:start+batch_size], self.control_points_)
+            J[start:start+batch_size] = np.einsum('nmb,ma->nab', grad, self.w_ng_) + self.lin_ag_.T
+        return J
+
+    def transform_dirs(self, x, dirs):
+        """
+        Maps N x D directions based at the N x D points x through the local linearization of the warp
+        """
+        return np.einsum('nab,nb->na', self.jacobian(x), dirs)
 
 class RigidRegistrationSolver(RegistrationFunc):
     def __init__(self):
@@ -187,6 +297,38 @@ def tps_apply_kernel(distmat, dim):
         print 'dim =', dim
         raise NotImplementedError
     
+def tps_kernel_gradient(x_na, y_ma):
+    """
+    Returns the N x M x D gradients of the kernel between each point in x_na and each point in y_ma with
+    respect to the points in x_na
+    """
+    dim = x_na.shape[1]
+    diff = x_na[:,np.newaxis,:] - y_ma[np.newaxis,:,:]
+    distmat = np.sqrt(np.sum(diff**2, axis=2))
+    if dim==2:
+        scale = 4 * (2 * np.log(distmat+1e-20) + 1)
+        scale[distmat == 0] = 0
+    elif dim==3:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(distmat > 0, -1.0 / distmat, 0)
+    else:
+        print 'dim =', dim
+        raise NotImplementedError
+    return scale[:,:,np.newaxis] * diff
+
+def farthest_point_sample(x_na, num_points):
+    """
+    Greedily picks num_points indices of x_na that are spread out over the point set
+    """
+    N = x_na.shape[0]
+    num_points = min(num_points, N)
+    indices = np.zeros(num_points, dtype=np.int)
+    min_dists = np.sum((x_na - x_na[0])**2, axis=1)
+    for i in range(1, num_points):
+        indices[i] = np.argmax(min_dists)
+        min_dists = np.minimum(min_dists, np.sum((x_na - x_na[indices[i]])**2, axis=1))
+    return indices
+
 def tps_kernel_matrix(x_na):
     dim = x_na.shape[1]
     distmat = ssd.squareform(ssd.pdist(x_na))
@@ -195,4 +337,4 @@ def tps_kernel_matrix(x_na):
 def tps_kernel_matrix2(XA,XB):
     dim = XA.shape[1]
     distmat = ssd.cdist(XA,XB)
-    return tps_apply_kernel(distmat,2)
+    return tps_apply_kernel(distmat,dim)
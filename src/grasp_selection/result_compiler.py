@@ -0,0 +1,331 @@
+"""
+Streaming compilation of experiment result pickles.
+Result files are read one at a time (or by a pool of processes, one chunk of files each) and folded into running
+statistics, so a sweep over thousands of objects never holds more than one result per process in memory. The
+aggregates are written to a compact columnar summary (npz) that plotting scripts can reload without touching the
+pickles again.
+"""
+import copy
+import logging
+import multiprocessing as mp
+import numpy as np
+import os
+import pickle as pkl
+
+import checkpoint
+
+SUMMARY_FILENAME = 'summary.npz'
+
+class RunningStats(object):
+    """
+    Online mean and variance of equally shaped arrays (Welford's algorithm). Stats from separate workers can be
+    merged exactly (Chan et al.)
+    """
+    def __init__(self):
+        self.count_ = 0
+        self.mean_ = None
+        self.m2_ = None
+
+    @property
+    def count(self):
+        return self.count_
+
+    @property
+    def mean(self):
+        return self.mean_
+
+    @property
+    def var(self):
+        """ Population variance, as computed by np.var """
+        if self.count_ == 0:
+            return None
+        return self.m2_ / self.count_
+
+    @property
+    def std(self):
+        if self.count_ == 0:
+            return None
+        return np.sqrt(self.var)
+
+    def add(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.count_ == 0:
+            self.count_ = 1
+            self.mean_ = x.copy()
+            self.m2_ = np.zeros(x.shape)
+            return
+        self.count_ += 1
+        delta = x - self.mean_
+        self.mean_ += delta / self.count_
+        self.m2_ += delta * (x - self.mean_)
+
+    def merge(self, other):
+        """ Folds the stats of other into these """
+        if other.count_ == 0:
+            return
+        if self.count_ == 0:
+            self.count_ = other.count_
+            self.mean_ = other.mean_.copy()
+            self.m2_ = other.m2_.copy()
+            return
+        count = self.count_ + other.count_
+        delta = other.mean_ - self.mean_
+        self.mean_ = self.mean_ + delta * (float(other.count_) / count)
+        self.m2_ = self.m2_ + other.m2_ + delta**2 * (float(self.count_) * other.count_ / count)
+        self.count_ = count
+
+class WeightedMean(object):
+    """ Running weighted mean sum(w * x) / sum(w), where the weights are scalars or arrays shaped like x """
+    def __init__(self):
+        self.sum_ = 0.0
+        self.weight_ = 0.0
+
+    @property
+    def mean(self):
+        return self.sum_ / self.weight_
+
+    def add(self, x, weight):
+        x = np.asarray(x, dtype=np.float64)
+        self.sum_ = self.sum_ + weight * x
+        self.weight_ = self.weight_ + weight
+
+    def merge(self, other):
+        self.sum_ = self.sum_ + other.sum_
+        self.weight_ = self.weight_ + other.weight_
+
+class ResultAggregator(object):
+    """
+    Folds experiment results into running statistics one at a time
+    Params:
+        curve_fields: (list of strings) attributes holding normalized reward curves, or lists of curves, summarized
+            by their mean, std and simple regret at each snapshot and a per object column of final rewards
+        column_fields: (list of strings) per object attributes such as runtimes, kept as one row per object
+        weighted_fields: (dict) attribute -> attribute of its weights, summarized by their weighted mean
+        histogram_fields: (dict) attribute -> bin edges, summarized by histogram counts over all objects
+    """
+    def __init__(self, curve_fields, column_fields = [], weighted_fields = {}, histogram_fields = {}):
+        self.curve_fields_ = curve_fields
+        self.column_fields_ = column_fields
+        self.weighted_fields_ = weighted_fields
+        self.histogram_fields_ = histogram_fields
+
+        self.iters_ = None
+        self.obj_keys_ = []
+        self.num_skipped_ = 0
+        self.curve_stats_ = dict([(name, RunningStats()) for name in curve_fields])
+        self.final_rewards_ = dict([(name, []) for name in curve_fields])
+        self.columns_ = dict([(name, []) for name in column_fields])
+        self.weighted_means_ = dict([(name, WeightedMean()) for name in weighted_fields.keys()])
+        self.histograms_ = dict([(name, np.zeros(len(bin_edges) - 1)) for name, bin_edges in histogram_fields.items()])
+
+    @property
+    def num_results(self):
+        return len(self.obj_keys_)
+
+    def add(self, result):
+        """
+        Folds a single result into the aggregates. Objects without an obj_key, which are not experiment results, and
+        results with curves of a different length are skipped
+        """
+        if not hasattr(result, 'obj_key'):
+            logging.warning('Skipping %s object without an obj_key' %(type(result).__name__))
+            self.num_skipped_ += 1
+            return False
+
+        curves = {}
+        for name in self.curve_fields_:
+            curves[name] = np.asarray(getattr(result, name), dtype=np.float64)
+            stats = self.curve_stats_[name]
+            if stats.count > 0 and curves[name].shape != stats.mean.shape:
+                logging.warning('Skipping %s: %s has shape %s instead of %s' %(result.obj_key, name, str(curves[name].shape),
+                                                                                str(stats.mean.shape)))
+                self.num_skipped_ += 1
+                return False
+
+        if self.iters_ is None:
+            self.iters_ = np.asarray(result.iters)
+        for name, curve in curves.items():
+            self.curve_stats_[name].add(curve)
+            self.final_rewards_[name].append(curve[..., -1])
+        for name in self.column_fields_:
+            self.columns_[name].append(np.asarray(getattr(result, name), dtype=np.float64))
+        for name, weight_name in self.weighted_fields_.items():
+            self.weighted_means_[name].add(getattr(result, name), np.asarray(getattr(result, weight_name), dtype=np.float64))
+        for name, bin_edges in self.histogram_fields_.items():
+            counts, _ = np.histogram(getattr(result, name), bin_edges)
+            self.histograms_[name] += counts
+        self.obj_keys_.append(result.obj_key)
+        return True
+
+    def merge(self, other):
+        """ Folds the aggregates of other, e.g. from another worker, into these """
+        if self.iters_ is None:
+            self.iters_ = other.iters_
+        for name in self.curve_fields_:
+            self.curve_stats_[name].merge(other.curve_stats_[name])
+            self.final_rewards_[name].extend(other.final_rewards_[name])
+        for name in self.column_fields_:
+            self.columns_[name].extend(other.columns_[name])
+        for name in self.weighted_fields_.keys():
+            self.weighted_means_[name].merge(other.weighted_means_[name])
+        for name in self.histogram_fields_.keys():
+            self.histograms_[name] += other.histograms_[name]
+        self.obj_keys_.extend(other.obj_keys_)
+        self.num_skipped_ += other.num_skipped_
+
+    def summary(self):
+        """
+        Returns:
+            dict of numpy arrays, one entry per column of the summary
+        """
+        summary = {'obj_keys': np.array(self.obj_keys_), 'num_skipped': np.array(self.num_skipped_)}
+        if self.num_results == 0:
+            return summary
+        summary['iters'] = self.iters_
+        for name, stats in self.curve_stats_.items():
+            summary[name + '_mean'] = stats.mean
+            summary[name + '_std'] = stats.std
+            summary[name + '_regret'] = 1.0 - stats.mean
+            summary[name + '_final'] = np.array(self.final_rewards_[name])
+        for name, column in self.columns_.items():
+            summary[name] = np.array(column)
+        for name, weighted_mean in self.weighted_means_.items():
+            summary[name + '_weighted_mean'] = weighted_mean.mean
+        for name, counts in self.histograms_.items():
+            summary[name + '_hist'] = counts
+            summary[name + '_bin_edges'] = np.asarray(self.histogram_fields_[name])
+        return summary
+
+def result_files(result_dir):
+    """
+    Yields the result pickles in the subdirectories of result_dir, e.g. one per instance of a job, skipping
+    checkpoint directories
+    """
+    for root, dirs, files in os.walk(result_dir):
+        dirs[:] = sorted([d for d in dirs if d != checkpoint.CHECKPOINT_DIRNAME])
+        if root == result_dir:
+            continue
+        for f in files:
+            if f.endswith('.pkl'):
+                yield os.path.join(root, f)
+
+def load_result(filename):
+    """ Returns the result pickled in filename, or None if it cannot be read """
+    logging.info('Reading %s' %(filename))
+    try:
+        with open(filename, 'r') as f:
+            return pkl.load(f)
+    except Exception as e:
+        logging.warning('Failed to read %s: %s' %(filename, str(e)))
+        return None
+
+def _compile_files(args):
+    """ Folds a list of result files into an aggregator, calling per_result on each result first """
+    filenames, aggregator, per_result = args
+    for filename in filenames:
+        result = load_result(filename)
+        if result is None:
+            continue
+        if per_result is not None:
+            per_result(result)
+        aggregator.add(result)
+    return aggregator
+
+def compile_results(filenames, aggregator, num_processes = 1, per_result = None):
+    """
+    Streams result files into an aggregator
+    Params:
+        filenames: (list of strings) result pickles
+        aggregator: (ResultAggregator) empty aggregator defining the fields to summarize
+        num_processes: (int) number of worker processes, each folding its own share of the files
+        per_result: (function) optional callback on each loaded result, e.g. per object plots. Must be picklable to
+            use more than one process
+    Returns:
+        the aggregator holding all results
+    """
+    filenames = list(filenames)
+    if num_processes == 1 or len(filenames) <= 1:
+        return _compile_files((filenames, aggregator, per_result))
+
+    num_processes = min(num_processes, len(filenames))
+    chunks = [(filenames[i::num_processes], copy.deepcopy(aggregator), per_result) for i in range(num_processes)]
+    pool = mp.Pool(num_processes)
+    chunk_aggregators = pool.map(_compile_files, chunks)
+    pool.close()
+    pool.join()
+    for chunk_aggregator in chunk_aggregators:
+        aggregator.merge(chunk_aggregator)
+    return aggregator
+
+def save_summary(summary, filename):
+    """ Writes a summary to a compressed npz file """
+    np.savez_compressed(filename, **summary)
+    logging.info('Saved summary to %s' %(filename))
+
+def load_summary(filename):
+    """ Loads a summary written by save_summary into a dict of numpy arrays """
+    with np.load(filename) as data:
+        return dict([(name, data[name]) for name in data.files])
+
+class _TestResult:
+    def __init__(self, obj_key, reward, runtime):
+        self.obj_key = obj_key
+        self.iters = np.arange(reward.shape[-1])
+        self.reward = reward
+        self.prior_reward = [reward, 0.5 * reward]
+        self.runtime = runtime
+        self.num_grasps = reward.shape[-1]
+        self.true_avg_reward = reward
+
+def test_result_aggregator():
+    np.random.seed(100)
+    results = [_TestResult('obj_%d' %(i), np.random.rand(20), np.random.rand()) for i in range(25)]
+    fields = (['reward', 'prior_reward'], ['runtime'], {'reward': 'num_grasps'}, {'true_avg_reward': np.linspace(0, 1, 11)})
+
+    # streaming stats match the batch computation
+    aggregator = ResultAggregator(*fields)
+    for result in results:
+        aggregator.add(result)
+    summary = aggregator.summary()
+    all_rewards = np.array([r.reward for r in results])
+    assert np.allclose(summary['reward_mean'], np.mean(all_rewards, axis=0))
+    assert np.allclose(summary['reward_std'], np.std(all_rewards, axis=0))
+    assert np.allclose(summary['prior_reward_mean'][1], 0.5 * np.mean(all_rewards, axis=0))
+    assert np.allclose(summary['reward_final'], all_rewards[:,-1])
+    assert np.allclose(summary['runtime'], [r.runtime for r in results])
+    assert np.sum(summary['true_avg_reward_hist']) == all_rewards.size
+
+    # merged partial aggregates match
+    first = ResultAggregator(*fields)
+    second = ResultAggregator(*fields)
+    for i, result in enumerate(results):
+        [first, second][i % 2].add(result)
+    first.merge(second)
+    merged = first.summary()
+    assert np.allclose(merged['reward_std'], summary['reward_std'])
+    assert np.allclose(merged['reward_weighted_mean'], summary['reward_weighted_mean'])
+
+    # mismatched curves and objects that are not results are skipped
+    assert not aggregator.add(_TestResult('short', np.random.rand(10), 1.0))
+    assert not aggregator.add({'reward': np.random.rand(20)})
+    assert aggregator.num_results == len(results)
+    logging.info('Result aggregator test passed!')
+
+def test_result_files():
+    import shutil, tempfile
+    result_dir = tempfile.mkdtemp()
+    for d in ['chunk_0', os.path.join('chunk_0', 'nested'), os.path.join('chunk_1', checkpoint.CHECKPOINT_DIRNAME)]:
+        os.makedirs(os.path.join(result_dir, d))
+        open(os.path.join(result_dir, d, 'obj.pkl'), 'w').close()
+    open(os.path.join(result_dir, 'top.pkl'), 'w').close()
+
+    # only results in the job subdirectories are found, skipping checkpoints
+    filenames = [os.path.relpath(f, result_dir) for f in result_files(result_dir)]
+    shutil.rmtree(result_dir)
+    assert sorted(filenames) == [os.path.join('chunk_0', 'nested', 'obj.pkl'), os.path.join('chunk_0', 'obj.pkl')]
+    logging.info('Result files test passed!')
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    test_result_aggregator()
+    test_result_files()
@@ -67,6 +67,7 @@ from oauth2client import tools
 import smtplib
 
 import experiment_config as ec
+import job
 
 INSTANCE_NAME_LENGTH = 10
 
@@ -361,6 +362,17 @@ def launch_experiment(args, sleep_time):
     config_file = args.config
     config = ec.ExperimentConfig(config_file)
     logging.basicConfig(level=logging.INFO)
+
+    # other compute backends, e.g. processes on this machine, run through their job
+    if 'backend' in config and config['backend'] is not None and config['backend'] != 'gce':
+        if 'sleep_time' not in config or config['sleep_time'] is None:
+            config['sleep_time'] = sleep_time
+        experiment_job = job.make_job(config)
+        experiment_job.run()
+        experiment_job.analyze()
+        logging.info('Total runtime: %f' %(time.time() - start_time))
+        return
+
     auth_http = oauth_authorization(config, args)
 
     # Retrieve / create instance data
@@ -10,14 +10,18 @@ import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import numbers
+from numpy.lib.stride_tricks import as_strided
 
 from PIL import Image
 import scipy.io
 import scipy.ndimage
 import scipy.signal
+import scipy.sparse
+import scipy.sparse.csgraph
 from skimage import feature
 import skimage.filters
 
+import instrumentation as inst
 import sdf_file as sf
 import similarity_tf as stf
 import tfx
@@ -184,6 +188,11 @@ class Sdf:
         """
         pass
 
+    @property
+    def surface_thresh(self):
+        """ Max absolute sdf value of a point on the surface """
+        return self.surface_thresh_
+
     def on_surface(self, coords):
         """ Determines whether or not a point is on the object surface """
         sdf_val = self[coords]
@@ -200,11 +209,13 @@ class Sdf:
     @property
     def gradients(self):
         """
-        Gradients of the SDF.
+        Gradients of the SDF, computed on first access.
         Returns:
             list of gradients, where the nth element is an array of the
             derivative of the SDF with respect to the nth dimension
         """
+        if self.gradients_ is None:
+            self._compute_gradients()
         return self.gradients_
 
     def is_out_of_bounds(self, coords):
@@ -221,11 +232,35 @@ class Sdf3D(Sdf):
     min_coords_z = [0, 1, 2, 4]
     max_coords_z = [3, 5, 6, 7]
 
-    def __init__(self, sdf_data, origin, resolution, tf = stf.SimilarityTransform3D(tfx.identity_tf(), scale = 1.0), frame = None, use_abs = True):
+    # coarse-to-fine surface search using a pyramid of lower bounds on |sdf|
+    use_pyramid = False
+    pyramid_levels = 4
+
+    cell_offsets = np.array([[0, 0, 0], [0, 0, 1], [0, 1, 0], [0, 1, 1],
+                             [1, 0, 0], [1, 0, 1], [1, 1, 0], [1, 1, 1]])
+
+    def __init__(self, sdf_data, origin, resolution, tf = stf.SimilarityTransform3D(tfx.identity_tf(), scale = 1.0), frame = None, use_abs = True,
+                 dtype = None):
+        # optionally store the values, and thus the gradients, in another dtype, e.g. np.float32 to halve memory
         self.data_ = sdf_data
+        if dtype is not None:
+            self.data_ = self.data_.astype(dtype, copy=False)
+        self._init_grid(self.data_.shape, origin, resolution, tf)
+
+        # optionally use only the absolute values (useful for non-closed meshes in 3D)
+        self.use_abs_ = use_abs
+        if use_abs:
+            self.data_ = np.abs(self.data_)
+
+        self.feature_vector_ = None #Kmeans feature representation
+
+    def _init_grid(self, dims, origin, resolution, tf):
+        """
+        Sets up the grid geometry and grid <-> sdf transforms
+        """
         self.origin_ = origin
         self.resolution_ = resolution
-        self.dims_ = self.data_.shape
+        self.dims_ = dims
 
         # set up surface params
         self.surface_thresh_ = self.resolution_ * np.sqrt(2) / 2 # resolution is max dist from surface when surf is orthogonal to diagonal grid cells
@@ -240,15 +275,31 @@ class Sdf3D(Sdf):
         R_sdf_mesh = np.eye(3)
         self.tf_grid_sdf_ = stf.SimilarityTransform3D(tfx.canonical.CanonicalTransform(R_sdf_mesh, -R_sdf_mesh.T.dot(self.center_)), 1.0 / self.resolution_)
         self.tf_sdf_grid_ = self.tf_grid_sdf_.inverse()
+        self.pyramid_ = None
 
-        # optionally use only the absolute values (useful for non-closed meshes in 3D)
-        if use_abs:
-            self.data_ = np.abs(self.data_)
+        # gradients, the flat index grid and the interior mask are computed on first use
+        self.gradients_ = None
+        self.pts_ = None
+        self.interior_ = None
 
-        self._compute_flat_indices()
-        self._compute_gradients()
+    @property
+    def nbytes(self):
+        """ Number of bytes used to store the sdf values and any computed gradients, index grid and interior mask """
+        num_bytes = self.data_.nbytes
+        if self.gradients_ is not None:
+            num_bytes += sum([g.nbytes for g in self.gradients_])
+        if self.pts_ is not None:
+            num_bytes += self.pts_.nbytes
+        if self.interior_ is not None:
+            num_bytes += self.interior_.nbytes
+        return num_bytes
 
-        self.feature_vector_ = None #Kmeans feature representation
+    def to_narrow_band(self, band=4, brick_size=8):
+        """
+        Returns a sparse copy of the sdf storing only voxels within |band| voxels of the surface
+        """
+        return NarrowBandSdf3D.from_dense(self.data, self.origin_, self.resolution_, band * self.resolution_,
+                                          brick_size=brick_size, tf=self.tf_, use_abs=False)
 
     def _compute_flat_indices(self):
         """
@@ -257,6 +308,13 @@ class Sdf3D(Sdf):
         [x_ind, y_ind, z_ind] = np.indices(self.dims_)
         self.pts_ = np.c_[x_ind.flatten().T, np.c_[y_ind.flatten().T, z_ind.flatten().T]]
 
+    @property
+    def flat_indices(self):
+        """ Returns the V x 3 array of grid indices of the flattened data, computed on first access """
+        if self.pts_ is None:
+            self._compute_flat_indices()
+        return self.pts_
+
     def __getitem__(self, coords):
         return self.signed_distance(coords)
 
@@ -269,6 +327,7 @@ class Sdf3D(Sdf):
         """
         if len(coords) != 3:
             raise IndexError('Indexing must be 3 dimensional')
+        inst.count('sdf_lookups')
 
         if self.is_out_of_bounds(coords):
             logging.debug('Out of bounds access. Snapping to SDF dims')
@@ -334,7 +393,7 @@ class Sdf3D(Sdf):
         min_coords = np.floor(self.coords_buf_)
         max_coords = min_coords + 1
         self.points_buf_[Sdf3D.min_coords_x, 0] = min_coords[0]
-        self.points_buf_[Sdf3D.max_coords_x, 0] = min_coords[0]
+        self.points_buf_[Sdf3D.max_coords_x, 0] = max_coords[0]
         self.points_buf_[Sdf3D.min_coords_y, 1] = min_coords[1]
         self.points_buf_[Sdf3D.max_coords_y, 1] = max_coords[1]
         self.points_buf_[Sdf3D.min_coords_z, 2] = min_coords[2]
@@ -351,9 +410,9 @@ class Sdf3D(Sdf):
                 gp[1] = 0.0
                 gp[2] = 0.0
             else:
-                gp[0] = self.gradients_[0][p[0], p[1], p[2]]
-                gp[1] = self.gradients_[1][p[0], p[1], p[2]]
-                gp[2] = self.gradients_[2][p[0], p[1], p[2]]
+                gp[0] = self.gradients[0][p[0], p[1], p[2]]
+                gp[1] = self.gradients[1][p[0], p[1], p[2]]
+                gp[2] = self.gradients[2][p[0], p[1], p[2]]
 
             w = np.prod(-np.abs(p - self.coords_buf_) + 1)
             g = g + w * gp
@@ -408,11 +467,14 @@ class Sdf3D(Sdf):
             numpy arr: the points on the surfaec
             numpy arr: the sdf values on the surface
         """
-        surface_points = np.where(np.abs(self.data_) < self.surface_thresh_)
-        x = surface_points[0]
-        y = surface_points[1]
-        z = surface_points[2]
-        surface_points = np.c_[x, np.c_[y, z]]
+        if Sdf3D.use_pyramid:
+            surface_points = self._surface_points_pyramid()
+        else:
+            surface_points = np.where(np.abs(self.data_) < self.surface_thresh_)
+            x = surface_points[0]
+            y = surface_points[1]
+            z = surface_points[2]
+            surface_points = np.c_[x, np.c_[y, z]]
         surface_vals = self.data_[surface_points[:,0], surface_points[:,1], surface_points[:,2]]
         if not grid_basis:
             surface_points = self.transform_pt_grid_to_obj(surface_points.T)
@@ -420,60 +482,285 @@ class Sdf3D(Sdf):
 
         return surface_points, surface_vals
 
-    def transform(self, tf, detailed = False):
+    def build_pyramid(self, num_levels=None):
         """
-        Transform the grid by pose T and scale with canonical reference frame at the SDF center with axis alignment
+        Builds a pyramid of conservative lower bounds on |sdf|.
+        Level 0 holds the min of |sdf| over the eight corners of each grid cell, and each coarser level
+        holds the min over 2x2x2 cells of the level below. Thus cell c of level l bounds all voxels
+        from c * 2^l to (c+1) * 2^l along each axis, and any value interpolated inside those cells.
+        """
+        if num_levels is None:
+            num_levels = Sdf3D.pyramid_levels
+        level, self.pyramid_signed_ = self._pyramid_base()
+        self.pyramid_ = [level]
+
+        # min pool by 2 along each axis
+        for l in range(1, num_levels):
+            dims = np.array(level.shape)
+            if np.all(dims == 1):
+                break
+            coarse_dims = (dims + 1) / 2
+            pad_width = [(0, 2 * c - d) for c, d in zip(coarse_dims, dims)]
+            padded = np.pad(level, pad_width, mode='constant', constant_values=np.inf)
+            level = padded.reshape(coarse_dims[0], 2, coarse_dims[1], 2, coarse_dims[2], 2).min(axis=(1, 3, 5))
+            self.pyramid_.append(level)
+        return self.pyramid_
+
+    def _pyramid_base(self):
+        """
+        Returns the finest pyramid level and whether the sdf has negative values
+        """
+        level = Sdf3D._min_over_cells(np.abs(self.data_).astype(np.float32))
+        return level, bool(np.any(self.data_ < 0))
+
+    @staticmethod
+    def _min_over_cells(abs_data):
+        """
+        Returns the min of abs_data over the eight corners of each cell, repeating the last entry at the far edges
+        """
+        nx, ny, nz = abs_data.shape
+        padded = np.pad(abs_data, ((0, 1), (0, 1), (0, 1)), mode='edge')
+        level = abs_data.copy()
+        for dx, dy, dz in Sdf3D.cell_offsets[1:]:
+            np.minimum(level, padded[dx:dx+nx, dy:dy+ny, dz:dz+nz], out=level)
+        return level
+
+    def _pyramid_cells(self, pts):
+        """
+        Returns the indices of the level 0 pyramid cells containing the given grid coordinates
+        """
+        return np.floor(np.clip(pts, 0, np.array(self.dims_) - 1)).astype(np.int64)
+
+    @property
+    def pyramid(self):
+        if self.pyramid_ is None:
+            self.build_pyramid()
+        return self.pyramid_
+
+    def surface_candidates(self, pts):
+        """
+        Returns a mask of the grid points whose interpolated sdf value may be on the surface,
+        testing the coarsest pyramid level first and refining only the remaining points
         Params:
-            (similarity transform 3d): similarity tf
-            (bool): detailed - whether or not to do the dirty, fast method
+            pts: numpy num_pts x 3 array of grid coordinates
         Returns:
-            (SDF): new sdf with grid warped by T
+            numpy num_pts bool array, False only where the point cannot be on the surface
         """
-        # map all surface points to their new location
-        start_t = time.clock()
-        num_pts = self.pts_.shape[0]
-        pts_sdf = self.tf_grid_sdf_.apply(self.pts_.T)
-        pts_sdf_tf = tf.apply(pts_sdf)
-        pts_grid_tf = self.tf_sdf_grid_.apply(pts_sdf_tf)
-        pts_tf = pts_grid_tf.T
-        all_points_t = time.clock()
-
-        # transform the center
-        origin_sdf = self.tf_grid_sdf_.apply(self.origin_)
-        origin_sdf_tf = tf.apply(origin_sdf)
-        origin_tf = self.tf_sdf_grid_.apply(origin_sdf_tf)
-
-        # rescale the resolution
-        resolution_tf = tf.scale * self.resolution_
-        origin_res_t = time.clock()
+        pyramid = self.pyramid
+        thresh = self.surface_thresh_
+        if self.pyramid_signed_:
+            thresh = thresh + np.sqrt(3) * self.resolution_ # sign changes inside a cell need a margin
 
-        # add each point to the new pose
-        if detailed:
-            sdf_data_tf = np.zeros([num_pts, 1])
-            for i in range(num_pts):
-                sdf_data_tf[i] = self[pts_tf[i,0], pts_tf[i,1], pts_tf[i,2]]
-        else:
-            pts_tf_round = np.round(pts_tf).astype(np.int64)
+        cells = self._pyramid_cells(pts)
+        candidates = np.arange(pts.shape[0])
+        for l in reversed(range(len(pyramid))):
+            level_cells = cells[candidates] >> l
+            bounds = pyramid[l][level_cells[:,0], level_cells[:,1], level_cells[:,2]]
+            candidates = candidates[bounds < thresh]
+            if candidates.shape[0] == 0:
+                break
 
-            # snap to closest boundary
-            pts_tf_round[:,0] = np.max(np.c_[np.zeros([num_pts, 1]), pts_tf_round[:,0]], axis=1)
-            pts_tf_round[:,0] = np.min(np.c_[(self.dims_[0] - 1) * np.ones([num_pts, 1]), pts_tf_round[:,0]], axis=1)
+        mask = np.zeros(pts.shape[0], dtype=bool)
+        mask[candidates] = True
+        return mask
 
-            pts_tf_round[:,1] = np.max(np.c_[np.zeros([num_pts, 1]), pts_tf_round[:,1]], axis=1)
-            pts_tf_round[:,1] = np.min(np.c_[(self.dims_[1] - 1) * np.ones([num_pts, 1]), pts_tf_round[:,1]], axis=1)
+    def _surface_points_pyramid(self):
+        """
+        Returns the grid indices of surface points, descending the pyramid from the coarsest level
+        so that only voxels in cells that may contain the surface are tested
+        """
+        pyramid = self.pyramid
+        thresh = self.surface_thresh_
+        cells = np.array(np.nonzero(pyramid[-1] < thresh)).T
+        for l in reversed(range(len(pyramid) - 1)):
+            children = (2 * cells[:,np.newaxis,:] + Sdf3D.cell_offsets[np.newaxis,:,:]).reshape(-1, 3)
+            children = children[np.all(children < np.array(pyramid[l].shape), axis=1)]
+            cells = children[pyramid[l][children[:,0], children[:,1], children[:,2]] < thresh]
 
-            pts_tf_round[:,2] = np.max(np.c_[np.zeros([num_pts, 1]), pts_tf_round[:,2]], axis=1)
-            pts_tf_round[:,2] = np.min(np.c_[(self.dims_[2] - 1) * np.ones([num_pts, 1]), pts_tf_round[:,2]], axis=1)
+        # test the corner voxels of the remaining cells, in the same order as np.where
+        voxels = (cells[:,np.newaxis,:] + Sdf3D.cell_offsets[np.newaxis,:,:]).reshape(-1, 3)
+        voxels = np.minimum(voxels, np.array(self.dims_) - 1)
+        flat_ind = np.unique(np.ravel_multi_index(voxels.T, self.dims_))
+        voxels = np.array(np.unravel_index(flat_ind, self.dims_)).T.reshape(-1, 3)
+        on_surface = np.abs(self.data_[voxels[:,0], voxels[:,1], voxels[:,2]]) < thresh
+        return voxels[on_surface,:]
 
-            sdf_data_tf = self.data_[pts_tf_round[:,0], pts_tf_round[:,1], pts_tf_round[:,2]]
+    def _values_at(self, x_ind, y_ind, z_ind):
+        """
+        Returns the signed distances at integer grid indices (assumed in bounds)
+        """
+        return self.data_[x_ind, y_ind, z_ind]
 
-        sdf_data_tf_grid = sdf_data_tf.reshape(self.dims_)
-        tf_t = time.clock()
+    def _interpolation_corners(self, coords):
+        """
+        Returns the grid indices and trilinear weights of the eight cell corners around each coordinate,
+        snapping coordinates to the grid dims as in signed_distance
+        Params:
+            coords: numpy num_pts x 3 array of grid coordinates
+        Returns:
+            list of (x_ind, y_ind, z_ind, weight) tuples of num_pts arrays, one per corner
+        """
+        max_coords = np.array(self.dims_) - 1
+
+        # snap to grid dims and split into cell index and offset within the cell
+        coords = np.clip(coords, 0, max_coords)
+        min_ind = np.floor(coords).astype(np.int64)
+        w_max = coords - min_ind
+        w_min = 1.0 - w_max
+        max_ind = np.minimum(min_ind + 1, max_coords)
+
+        x_ind = (min_ind[:,0], max_ind[:,0])
+        y_ind = (min_ind[:,1], max_ind[:,1])
+        z_ind = (min_ind[:,2], max_ind[:,2])
+        x_w = (w_min[:,0], w_max[:,0])
+        y_w = (w_min[:,1], w_max[:,1])
+        z_w = (w_min[:,2], w_max[:,2])
+
+        corners = []
+        for i in range(2):
+            for j in range(2):
+                w_xy = x_w[i] * y_w[j]
+                for k in range(2):
+                    corners.append((x_ind[i], y_ind[j], z_ind[k], w_xy * z_w[k]))
+        return corners
+
+    def interpolate(self, coords, out=None):
+        """
+        Returns the trilinearly interpolated signed distance at many grid coordinates at once.
+        Matches signed_distance: coordinates are snapped to the grid dims.
+        Params:
+            coords: numpy num_pts x 3 array of grid coordinates
+            out: (optional) preallocated numpy array with num_pts elements to write into
+        Returns:
+            numpy num_pts array of signed distances
+        """
+        inst.count('sdf_lookups', coords.shape[0])
+        if out is None:
+            out = np.empty(coords.shape[0], dtype=np.float64)
+        out[:] = 0
+        for x_ind, y_ind, z_ind, w in self._interpolation_corners(coords):
+            out += w * self._values_at(x_ind, y_ind, z_ind)
+        return out
+
+    def _gradients_at(self, x_ind, y_ind, z_ind):
+        """
+        Returns the sdf gradients at integer grid indices (assumed in bounds) as a num_pts x 3 array
+        """
+        gradients = self.gradients
+        return np.c_[gradients[0][x_ind, y_ind, z_ind],
+                     gradients[1][x_ind, y_ind, z_ind],
+                     gradients[2][x_ind, y_ind, z_ind]]
+
+    def _compute_interior(self):
+        """
+        Finds the grid points inside the object. Sdfs usually store |sdf|, so the interior is the region enclosed by the
+        shell of grid points within one cell of the surface, plus any points with negative values
+        """
+        shell = np.abs(self.data_) <= self.resolution_
+        self.interior_ = (scipy.ndimage.binary_fill_holes(shell) & ~shell) | (self.data_ < 0)
+
+    @property
+    def interior(self):
+        """
+        Interior of the object, computed on first access.
+        Returns:
+            numpy bool array with the dimensions of the sdf grid, True inside the object
+        """
+        if self.interior_ is None:
+            self._compute_interior()
+        return self.interior_
+
+    def interior_at(self, x_ind, y_ind, z_ind):
+        """
+        Returns whether the integer grid indices (assumed in bounds) are inside the object, as a num_pts bool array
+        """
+        return self.interior[x_ind, y_ind, z_ind]
 
-        logging.debug('Sdf3D: Time to transform coords: %f' %(all_points_t - start_t))
-        logging.debug('Sdf3D: Time to transform origin: %f' %(origin_res_t - all_points_t))
-        logging.debug('Sdf3D: Time to transfer sd: %f' %(tf_t - origin_res_t))
-        return Sdf3D(sdf_data_tf_grid, origin_tf, resolution_tf, tf = tf.compose(self.tf_))
+    def interpolate_gradient(self, coords):
+        """
+        Returns the trilinearly interpolated sdf gradient at many grid coordinates at once
+        Params:
+            coords: numpy num_pts x 3 array of grid coordinates
+        Returns:
+            numpy num_pts x 3 array of gradients
+        """
+        g = np.zeros([coords.shape[0], 3])
+        for x_ind, y_ind, z_ind, w in self._interpolation_corners(coords):
+            g += w[:,np.newaxis] * self._gradients_at(x_ind, y_ind, z_ind)
+        return g
+
+    def interpolate_curvature(self, coords, delta=1.0):
+        """
+        Batched version of curvature: finite differences of the interpolated gradients
+        Params:
+            coords: numpy num_pts x 3 array of grid coordinates
+        Returns:
+            numpy num_pts x 3 x 3 array of hessians, one per coordinate
+        """
+        hessians = np.zeros([coords.shape[0], 3, 3])
+        for d in range(3):
+            offset = np.zeros(3)
+            offset[d] = delta
+            grad_up = self.interpolate_gradient(coords + offset)
+            grad_down = self.interpolate_gradient(coords - offset)
+            hessians[:,:,d] = (grad_up - grad_down) / (2 * delta)
+        return hessians
+
+    def _grid_affine(self, tf):
+        """
+        Folds the grid -> sdf -> tf -> grid chain of transforms into a single affine map A x + b
+        """
+        b = self.tf_sdf_grid_.apply(tf.apply(self.tf_grid_sdf_.apply(np.zeros(3))))
+        A = np.zeros([3, 3])
+        for i in range(3):
+            A[:,i] = self.tf_sdf_grid_.apply(tf.apply(self.tf_grid_sdf_.apply(np.eye(3)[:,i]))) - b
+        return A, b
+
+    def transform(self, tf, detailed = False):
+        """
+        Transform the grid by pose T and scale with canonical reference frame at the SDF center with axis alignment
+        Params:
+            (similarity transform 3d): similarity tf
+            (bool): detailed - whether to trilinearly interpolate (accurate) or round to the nearest voxel (fast)
+        Returns:
+            (SDF): new sdf with grid warped by T
+        """
+        # map all grid points to their new location, one axis at a time to avoid materializing the index grid.
+        # this is as fast as using a cached flat_indices and gives the same coordinates whether or not it is cached
+        with inst.timer('sdf_transform'):
+            with inst.timer('coords'):
+                num_pts = np.prod(self.dims_)
+                A, b = self._grid_affine(tf)
+                x_ind, y_ind, z_ind = [np.arange(d, dtype=np.float64) for d in self.dims_]
+                pts_tf = x_ind[:,np.newaxis,np.newaxis,np.newaxis] * A[:,0] + y_ind[np.newaxis,:,np.newaxis,np.newaxis] * A[:,1]
+                pts_tf = pts_tf + z_ind[np.newaxis,np.newaxis,:,np.newaxis] * A[:,2]
+                pts_tf = pts_tf.reshape(-1, 3)
+                pts_tf += b
+
+            # transform the center
+            origin_sdf = self.tf_grid_sdf_.apply(self.origin_)
+            origin_sdf_tf = tf.apply(origin_sdf)
+            origin_tf = self.tf_sdf_grid_.apply(origin_sdf_tf)
+
+            # rescale the resolution
+            resolution_tf = tf.scale * self.resolution_
+
+            # add each point to the new pose
+            with inst.timer('values'):
+                sdf_data_tf = np.empty(num_pts, dtype=self.data_.dtype)
+                if detailed:
+                    self.interpolate(pts_tf, out=sdf_data_tf)
+                else:
+                    # snap to closest boundary
+                    pts_tf_round = np.round(pts_tf, out=pts_tf).astype(np.int64)
+                    np.clip(pts_tf_round, 0, np.array(self.dims_) - 1, out=pts_tf_round)
+                    sdf_data_tf[:] = self.data_[pts_tf_round[:,0], pts_tf_round[:,1], pts_tf_round[:,2]]
+
+            sdf_data_tf_grid = sdf_data_tf.reshape(self.dims_)
+        sdf_tf = Sdf3D(sdf_data_tf_grid, origin_tf, resolution_tf, tf = tf.compose(self.tf_), use_abs = self.use_abs_,
+                       dtype = self.data_.dtype)
+        sdf_tf.pts_ = self.pts_ # same grid, so the index grid can be shared
+        return sdf_tf
 
     def transform_pt_obj_to_grid(self, x_sdf, direction = False):
         """ Converts a point in sdf coords to the grid basis. If direction then don't translate """
@@ -483,7 +770,7 @@ class Sdf3D(Sdf):
         """ Converts a point in grid coords to the world basis. If direction then don't translate """
         return self.tf_grid_sdf_.apply(x_grid, direction=direction)
 
-    def make_windows(self, W, S, target=False, filtering_function=crosses_threshold, threshold=.1):
+    def make_windows(self, W, S, target=False, filtering_function=crosses_threshold, threshold=.1, as_view=False):
         """
         Function for windowing the SDF grid
         Params:
@@ -491,47 +778,65 @@ class Sdf3D(Sdf):
             S: stride length between cubes (x axis "wraps" around)
             target: True for targetted windowing (filters for cubes containing both positive and negative values)
             filtering_function: function to filter windows out with
+            as_view: True to return a zero-copy view of all windows instead (ignores S and target)
         Returns:
-            ([np.array,...,np.array]): contains a list of numpy arrays, each of which is an unrolled window/cube.
-                                       window order based on center coordinate (increasing order of x, y, then z)
+            (np.array): num_windows x W^3 array, each row of which is an unrolled window/cube (x varies fastest).
+                        window order based on center coordinate (increasing order of x, y, then z)
+                        if as_view, a read-only nx x ny x nz x W x W x W view indexed by window center
+                        and then by window offset in (z, y, x) order, so that rows unroll as above
         """
-        windows = []
         window_center = (W-1)/2 #assuming odd window
-        offset = 0 #parameter used to "wrap around" x / not start back at x=1 each time
-
-        nx = self.dims_[0]
-        ny = self.dims_[1]
-        nz = self.dims_[2]
-        newx = 2*window_center + nx
-        newy = 2*window_center + ny
-        newz = 2*window_center + nz
-        padded_vals = np.zeros(newx*newy*newz)
-
-        #padding the original values list
-        for k in range(nz):
-            for j in range(ny):
-                for i in range(nx):
-                    padded_coord = (i+window_center) + (j+window_center)*newx + (k+window_center)*newx*newy
-                    orig_coord = i + j*nx + k*nx*ny
-                    padded_vals[padded_coord] = self.values_in_order_[orig_coord]
-
-        for z in range(window_center, nz + window_center, S):
-            for y in range(window_center, ny + window_center, S):
-                for x in range(window_center+offset, nx + window_center, S):
-                        #print map(lambda x: x-window_center,[x,y,z])
-                    new_window = np.zeros(W**3)
-                    count = 0
-                    for k in range(-window_center, window_center+1):
-                        for j in range(-window_center, window_center+1):
-                            for i in range(-window_center, window_center+1):
-                                new_window[count] = padded_vals[(x+i) + (y+j)*newx + (z+k)*newx*newy]
-                                count += 1
-                    windows.append(new_window)
-                offset = (x+S) - (nx+window_center)
-        #print windows, len(windows), type(windows)
+        padded_data, windows = Sdf3D._window_view(self.data_, W)
+        if as_view:
+            return windows
+
+        x_ind, y_ind, z_ind = self._window_centers(S)
         if target:
-            windows = filter(filtering_function(threshold), windows)
-        return windows
+            if filtering_function is crosses_threshold:
+                # a window crosses the threshold iff its max is above and its min is below
+                window_max = scipy.ndimage.maximum_filter(padded_data, size=W, mode='constant', cval=0)
+                window_min = scipy.ndimage.minimum_filter(padded_data, size=W, mode='constant', cval=0)
+                x_pad = x_ind + window_center
+                y_pad = y_ind + window_center
+                z_pad = z_ind + window_center
+                mask = (window_max[x_pad, y_pad, z_pad] > threshold) & (window_min[x_pad, y_pad, z_pad] < threshold)
+                x_ind, y_ind, z_ind = x_ind[mask], y_ind[mask], z_ind[mask]
+            else:
+                filtering = filtering_function(threshold)
+                mask = np.array([filtering(windows[x, y, z].ravel()) for x, y, z in zip(x_ind, y_ind, z_ind)], dtype=bool)
+                if mask.shape[0] > 0:
+                    x_ind, y_ind, z_ind = x_ind[mask], y_ind[mask], z_ind[mask]
+
+        return windows[x_ind, y_ind, z_ind].reshape(-1, W**3)
+
+    @staticmethod
+    def _window_view(data, W):
+        """
+        Returns the zero padded grid and a read-only view of the W x W x W window around every voxel of data
+        """
+        padded_data = np.pad(data, (W-1)/2, mode='constant', constant_values=0)
+
+        # sliding windows over the padded grid, one per voxel of the original grid
+        sx, sy, sz = padded_data.strides
+        windows = as_strided(padded_data, shape=data.shape + (W, W, W),
+                             strides=(sx, sy, sz, sz, sy, sx))
+        windows.flags.writeable = False
+        return padded_data, windows
+
+    def _window_centers(self, S):
+        """
+        Returns the grid indices of the window centers for stride S. Centers step by S in y and z,
+        while the x stride wraps around between rows
+        """
+        nx, ny, nz = self.dims_
+        y_centers = np.arange(0, ny, S)
+        z_centers = np.arange(0, nz, S)
+        x_steps = np.arange(0, y_centers.shape[0] * z_centers.shape[0] * nx, S)
+        rows = x_steps / nx
+        x_ind = x_steps % nx
+        y_ind = y_centers[rows % y_centers.shape[0]]
+        z_ind = z_centers[rows / y_centers.shape[0]]
+        return x_ind, y_ind, z_ind
 
     def set_feature_vector(self, vector):
         """
@@ -556,7 +861,7 @@ class Sdf3D(Sdf):
         Returns: -
         """
         if self.feature_vector_ is None:
-            to_add = self.data_[:]
+            to_add = self.data[:]
         else:
             to_add = self.feature_vector
 
@@ -577,7 +882,7 @@ class Sdf3D(Sdf):
                 numpy.float64: the match's distance from this SDF
         """
         if self.feature_vector is None:
-            to_query = self.data_[:]
+            to_query = self.data[:]
         else:
             to_query = self.feature_vector
         results = engine.neighbours(to_query)
@@ -618,6 +923,454 @@ class Sdf3D(Sdf):
         ax.set_ylim3d(0, self.dims_[1])
         ax.set_zlim3d(0, self.dims_[2])
 
+class NarrowBandSdf3D(Sdf3D):
+    """
+    Sparse 3D SDF that only stores voxels near the zero level set.
+    The grid is split into cubic bricks and only bricks containing a voxel with |sdf| < band are allocated,
+    indexed by a table of brick slots. Lookups outside the stored bricks return the band value, signed
+    like the surrounding region, so contacts, normals and windows near the surface are unchanged.
+    """
+    # number of sdf values to gather at once when windowing
+    window_chunk_size = 2**20
+
+    def __init__(self, bricks, brick_index, far_sign, dims, origin, resolution, band,
+                 tf = stf.SimilarityTransform3D(tfx.identity_tf(), scale = 1.0), frame = None):
+        """
+        Params:
+            bricks: numpy num_bricks x B x B x B float32 array of sdf values clamped to +/- band
+            brick_index: numpy int32 array with one entry per brick, the slot in bricks or -1 if not stored
+            far_sign: numpy int8 array with one entry per brick, the sign of the sdf far from the surface
+            dims: (tuple) dimensions of the full grid
+            band: (float) sdf values with larger magnitude are clamped to the band
+        """
+        self.bricks_ = bricks
+        self.brick_index_ = brick_index
+        self.far_sign_ = far_sign
+        self.brick_size_ = bricks.shape[1]
+        self.band_ = band
+        self.brick_coords_ = np.array(np.nonzero(brick_index >= 0)).T # slots are assigned in C order
+        self._init_grid(tuple(dims), origin, resolution, tf)
+
+        self.feature_vector_ = None #Kmeans feature representation
+
+    @staticmethod
+    def from_dense(sdf_data, origin, resolution, band, brick_size=8,
+                   tf = stf.SimilarityTransform3D(tfx.identity_tf(), scale = 1.0), use_abs = True):
+        """
+        Creates a narrow band sdf from a dense grid of sdf values
+        Params:
+            band: (float) half width of the band in sdf units
+            brick_size: (int) side length of the bricks in voxels
+        """
+        if use_abs:
+            sdf_data = np.abs(sdf_data)
+        bricks, brick_index, far_sign = NarrowBandSdf3D._make_bricks(sdf_data, band, brick_size)
+        return NarrowBandSdf3D(bricks, brick_index, far_sign, sdf_data.shape, origin, resolution, band, tf=tf)
+
+    @staticmethod
+    def _make_bricks(sdf_data, band, brick_size):
+        """
+        Splits a dense grid of sdf values into bricks and keeps the ones that intersect the band
+        """
+        B = brick_size
+        dims = np.array(sdf_data.shape)
+        num_bricks = (dims + B - 1) / B
+
+        # pad to a whole number of bricks, repeating edge values so far signs are preserved
+        pad_width = [(0, n * B - d) for n, d in zip(num_bricks, dims)]
+        padded = np.pad(np.clip(sdf_data, -band, band).astype(np.float32), pad_width, mode='edge')
+        bricked = padded.reshape(num_bricks[0], B, num_bricks[1], B, num_bricks[2], B).transpose(0, 2, 4, 1, 3, 5)
+
+        in_band = (np.abs(bricked) < band).any(axis=(3, 4, 5))
+        far_sign = np.where(bricked.sum(axis=(3, 4, 5)) < 0, -1, 1).astype(np.int8)
+
+        brick_index = -np.ones(num_bricks, dtype=np.int32)
+        brick_index[in_band] = np.arange(np.sum(in_band))
+        bricks = np.ascontiguousarray(bricked[in_band])
+        return bricks, brick_index, far_sign
+
+    @property
+    def band(self):
+        return self.band_
+
+    @property
+    def num_bricks(self):
+        """ Number of stored bricks """
+        return self.bricks_.shape[0]
+
+    @property
+    def nbytes(self):
+        """ Number of bytes used to store the bricks, brick tables and any computed brick gradients and interior """
+        num_bytes = self.bricks_.nbytes + self.brick_index_.nbytes + self.far_sign_.nbytes + self.brick_coords_.nbytes
+        if self.gradients_ is not None:
+            num_bytes += sum([g.nbytes for g in self.gradients_])
+        if self.interior_ is not None:
+            num_bytes += sum([m.nbytes for m in self.interior_])
+        return num_bytes
+
+    @property
+    def data(self):
+        """
+        Returns a dense copy of the (clamped) SDF data. Allocates the full grid!
+        """
+        [x_ind, y_ind, z_ind] = np.indices(self.dims_)
+        return self._values_at(x_ind.ravel(), y_ind.ravel(), z_ind.ravel()).reshape(self.dims_)
+
+    def _values_at(self, x_ind, y_ind, z_ind):
+        """
+        Returns the signed distances at integer grid indices (assumed in bounds)
+        """
+        B = self.brick_size_
+        bx, by, bz = x_ind / B, y_ind / B, z_ind / B
+        slots = self.brick_index_[bx, by, bz]
+        far = slots < 0
+
+        if self.bricks_.shape[0] == 0:
+            values = np.zeros(slots.shape, dtype=np.float32)
+        else:
+            values = self.bricks_[np.maximum(slots, 0), x_ind % B, y_ind % B, z_ind % B]
+        values[far] = self.band_ * self.far_sign_[bx[far], by[far], bz[far]]
+        return values
+
+    def _differences_at(self, x_ind, y_ind, z_ind):
+        """
+        Returns the sdf gradients at integer grid indices using the same differences as np.gradient
+        """
+        ind = [x_ind, y_ind, z_ind]
+        g = np.zeros([x_ind.shape[0], 3])
+        for d in range(3):
+            ind_up = list(ind)
+            ind_down = list(ind)
+            ind_up[d] = np.minimum(ind[d] + 1, self.dims_[d] - 1)
+            ind_down[d] = np.maximum(ind[d] - 1, 0)
+            spacing = np.maximum(ind_up[d] - ind_down[d], 1)
+            g[:,d] = (self._values_at(*ind_up) - self._values_at(*ind_down)) / spacing
+        return g
+
+    def _gradients_at(self, x_ind, y_ind, z_ind):
+        """
+        Returns the sdf gradients at integer grid indices (assumed in bounds) as a num_pts x 3 array.
+        Voxels in stored bricks are read from the brick gradients and the rest use differences of the far values,
+        which are zero away from the band
+        """
+        B = self.brick_size_
+        slots = self.brick_index_[x_ind / B, y_ind / B, z_ind / B]
+        far = slots < 0
+
+        g = np.empty([x_ind.shape[0], 3])
+        if np.any(~far):
+            gradients = self.gradients
+            near = ~far
+            x, y, z = x_ind[near] % B, y_ind[near] % B, z_ind[near] % B
+            for d in range(3):
+                g[near,d] = gradients[d][slots[near], x, y, z]
+        if np.any(far):
+            g[far,:] = self._differences_at(x_ind[far], y_ind[far], z_ind[far])
+        return g
+
+    def _compute_gradients(self):
+        """
+        Computes the gradients of the stored bricks, which are indexed like the bricks. Far from the band the
+        clamped sdf is constant, so no gradients are stored there
+        """
+        B = self.brick_size_
+        local_coords = np.indices([B, B, B]).reshape(3, -1)
+        voxels = (self.brick_coords_[:,:,np.newaxis] * B + local_coords[np.newaxis,:,:]).transpose(1, 0, 2).reshape(3, -1)
+
+        # voxels in the padding of the last bricks are never looked up
+        voxels = np.minimum(voxels, np.array(self.dims_)[:,np.newaxis] - 1)
+        g = self._differences_at(voxels[0], voxels[1], voxels[2]).astype(self.bricks_.dtype)
+        self.gradients_ = [g[:,d].reshape(self.bricks_.shape) for d in range(3)]
+
+    @property
+    def gradients(self):
+        """
+        Gradients of the stored bricks, computed on first access.
+        Returns:
+            list of gradients, where the nth element is a num_bricks x B x B x B array of the
+            derivative of the SDF with respect to the nth dimension, indexed like the bricks
+        """
+        if self.gradients_ is None:
+            self._compute_gradients()
+        return self.gradients_
+
+    def _compute_interior(self):
+        """
+        Finds the stored voxels and far bricks inside the object, as for the dense sdf but without allocating the full
+        grid. Voxels off the shell are split into connected components within each stored brick and each far brick is
+        a single component. Components joined across brick faces to the grid boundary are outside
+        """
+        B = self.brick_size_
+        num_bricks = np.array(self.brick_index_.shape)
+        dims = np.array(self.dims_)
+
+        # label the voxels off the shell in each stored brick, treating the brick padding as grid boundary
+        voxels = self.brick_coords_[:,:,np.newaxis,np.newaxis,np.newaxis] * B + np.indices([B, B, B])[np.newaxis]
+        max_voxel = (dims - 1)[np.newaxis,:,np.newaxis,np.newaxis,np.newaxis]
+        on_boundary = np.any((voxels == 0) | (voxels >= max_voxel), axis=1)
+        off_shell = (np.abs(self.bricks_) > self.resolution_) | np.any(voxels > max_voxel, axis=1)
+        labels = np.zeros(self.bricks_.shape, dtype=np.int64)
+        num_labels = 0
+        if self.bricks_.shape[0] > 0:
+            structure = np.zeros([3, 3, 3, 3], dtype=bool)
+            structure[1] = scipy.ndimage.generate_binary_structure(3, 1)
+            num_labels = scipy.ndimage.label(off_shell, structure=structure, output=labels)
+
+        # graph nodes are the labels, one node per far brick and one for the outside. Label 0 is the shell
+        far_nodes = num_labels + 1 + np.arange(np.prod(num_bricks)).reshape(num_bricks)
+        if self.band_ <= self.resolution_:
+            far_nodes[:] = 0
+        outside = num_labels + 1 + np.prod(num_bricks)
+        far_boundary = np.zeros(num_bricks, dtype=bool)
+        far_boundary[[0, -1],:,:] = True
+        far_boundary[:,[0, -1],:] = True
+        far_boundary[:,:,[0, -1]] = True
+        far_boundary &= self.brick_index_ < 0
+        edges = [(labels[on_boundary], outside), (far_nodes[far_boundary], outside)]
+
+        def face_labels(slots, nodes, d, layer):
+            faces = np.empty([slots.shape[0], B, B], dtype=np.int64)
+            faces[:] = nodes[:,np.newaxis,np.newaxis]
+            stored = slots >= 0
+            faces[stored] = np.take(labels[slots[stored]], layer, axis=d+1)
+            return faces.ravel()
+
+        # join components across the faces between neighboring bricks
+        for d in range(3):
+            lower = [slice(None)] * 3
+            upper = [slice(None)] * 3
+            lower[d] = slice(0, -1)
+            upper[d] = slice(1, None)
+            lower, upper = tuple(lower), tuple(upper)
+            slots_lower, slots_upper = self.brick_index_[lower].ravel(), self.brick_index_[upper].ravel()
+            nodes_lower, nodes_upper = far_nodes[lower].ravel(), far_nodes[upper].ravel()
+            far_pair = (slots_lower < 0) & (slots_upper < 0)
+            edges.append((nodes_lower[far_pair], nodes_upper[far_pair]))
+            edges.append((face_labels(slots_lower[~far_pair], nodes_lower[~far_pair], d, B-1),
+                          face_labels(slots_upper[~far_pair], nodes_upper[~far_pair], d, 0)))
+
+        # components connected to the outside node are outside
+        node_a = np.concatenate([a for a, b in edges])
+        node_b = np.concatenate([b * np.ones(a.shape[0], dtype=np.int64) for a, b in edges])
+        joined = (node_a > 0) & (node_b > 0)
+        graph = scipy.sparse.coo_matrix((np.ones(np.sum(joined)), (node_a[joined], node_b[joined])),
+                                        shape=(outside + 1, outside + 1))
+        components = scipy.sparse.csgraph.connected_components(graph, directed=False)[1]
+        is_outside = components == components[outside]
+
+        interior_bricks = ((labels > 0) & ~is_outside[labels]) | (self.bricks_ < 0)
+        far_interior = ((far_nodes > 0) & ~is_outside[far_nodes]) | (self.far_sign_ < 0)
+        self.interior_ = (interior_bricks, far_interior)
+
+    @property
+    def interior(self):
+        """
+        Interior of the object, computed on first access.
+        Returns:
+            numpy num_bricks x B x B x B bool array, True for stored voxels inside the object
+            numpy bool array with one entry per brick, True for far bricks inside the object
+        """
+        if self.interior_ is None:
+            self._compute_interior()
+        return self.interior_
+
+    def interior_at(self, x_ind, y_ind, z_ind):
+        """
+        Returns whether the integer grid indices (assumed in bounds) are inside the object, as a num_pts bool array
+        """
+        B = self.brick_size_
+        interior_bricks, far_interior = self.interior
+        bx, by, bz = x_ind / B, y_ind / B, z_ind / B
+        slots = self.brick_index_[bx, by, bz]
+        near = slots >= 0
+
+        inside = far_interior[bx, by, bz]
+        inside[near] = interior_bricks[slots[near], x_ind[near] % B, y_ind[near] % B, z_ind[near] % B]
+        return inside
+
+    def _pyramid_base(self):
+        """
+        Returns the finest pyramid level, with one cell per brick rather than per voxel, and whether the sdf has
+        negative values. Bricks that are not stored are bounded by the band
+        """
+        brick_min = np.empty(self.brick_index_.shape, dtype=np.float32)
+        brick_min.fill(self.band_)
+        if self.bricks_.shape[0] > 0:
+            brick_min[self.brick_index_ >= 0] = np.abs(self.bricks_).min(axis=(1, 2, 3))
+
+        # cells in the last voxel layer of a brick reach into the next brick
+        level = Sdf3D._min_over_cells(brick_min)
+        signed = bool(np.any(self.bricks_ < 0) or np.any(self.far_sign_ < 0))
+        return level, signed
+
+    def _pyramid_cells(self, pts):
+        """
+        Returns the indices of the level 0 pyramid cells, i.e. the bricks, containing the given grid coordinates
+        """
+        return Sdf3D._pyramid_cells(self, pts) / self.brick_size_
+
+    def _surface_points_pyramid(self):
+        """
+        Returns the grid indices of surface points. The stored bricks are already the candidate cells
+        """
+        return self.surface_points()[0]
+
+    def make_windows(self, W, S, target=False, filtering_function=crosses_threshold, threshold=.1, as_view=False):
+        """
+        Function for windowing the SDF grid, with the same params and window order as Sdf3D.make_windows.
+        Windows are gathered from the bricks in chunks of centers. A view of all windows needs the full grid,
+        so as_view allocates a dense copy of the clamped sdf
+        """
+        if as_view:
+            return Sdf3D._window_view(self.data, W)[1]
+
+        x_ind, y_ind, z_ind = self._window_centers(S)
+        if target and filtering_function is not crosses_threshold:
+            filtering = filtering_function(threshold)
+
+        # offsets in (z, y, x) order so that rows unroll with x varying fastest
+        window_center = (W-1)/2
+        z_off, y_off, x_off = np.indices([W, W, W]).reshape(3, -1) - window_center
+        windows = []
+        chunk_size = max(1, NarrowBandSdf3D.window_chunk_size / W**3)
+        for i in range(0, x_ind.shape[0], chunk_size):
+            x = x_ind[i:i+chunk_size,np.newaxis] + x_off
+            y = y_ind[i:i+chunk_size,np.newaxis] + y_off
+            z = z_ind[i:i+chunk_size,np.newaxis] + z_off
+
+            # zero padding outside the grid, as for the dense sdf
+            inside = (x >= 0) & (x < self.dims_[0]) & (y >= 0) & (y < self.dims_[1]) & (z >= 0) & (z < self.dims_[2])
+            chunk = np.zeros(x.shape, dtype=self.bricks_.dtype)
+            chunk[inside] = self._values_at(x[inside], y[inside], z[inside])
+
+            if target:
+                if filtering_function is crosses_threshold:
+                    mask = (chunk.max(axis=1) > threshold) & (chunk.min(axis=1) < threshold)
+                else:
+                    mask = np.array([filtering(window) for window in chunk], dtype=bool)
+                chunk = chunk[mask]
+            windows.append(chunk)
+
+        if len(windows) == 0:
+            return np.zeros([0, W**3], dtype=self.bricks_.dtype)
+        return np.concatenate(windows)
+
+    def signed_distance(self, coords):
+        """
+        Returns the signed distance at the given grid coordinates, interpolating if necessary.
+        Params: numpy 3 array
+        Returns:
+            float: the signed distance and the given coords (interpolated)
+        """
+        if len(coords) != 3:
+            raise IndexError('Indexing must be 3 dimensional')
+
+        if self.is_out_of_bounds(coords):
+            logging.debug('Out of bounds access. Snapping to SDF dims')
+
+        # regular indexing if integers
+        if type(coords[0]) is int and type(coords[1]) is int and type(coords[2]) is int:
+            ind = [np.array([max(0, min(coords[i], self.dims_[i] - 1))]) for i in range(3)]
+            inst.count('sdf_lookups')
+            return self._values_at(*ind)[0]
+
+        return self.interpolate(np.array([coords], dtype=np.float64))[0]
+
+    def gradient(self, coords):
+        """
+        Returns the sdf gradient at the given coordinates, interpolating if necessary
+        Params: numpy 3 array
+        Returns:
+            numpy 3 array: the gradient and the given coords (interpolated)
+        """
+        if len(coords) != 3:
+            raise IndexError('Indexing must be 3 dimensional')
+
+        if self.is_out_of_bounds(coords):
+            logging.debug('Out of bounds access. Snapping to SDF dims')
+
+        return self.interpolate_gradient(np.array([coords], dtype=np.float64))[0]
+
+    def surface_points(self, grid_basis=True):
+        """
+        Returns the points on the surface
+        Returns:
+            numpy arr: the points on the surfaec
+            numpy arr: the sdf values on the surface
+        """
+        slots, x_loc, y_loc, z_loc = np.nonzero(np.abs(self.bricks_) < self.surface_thresh_)
+        surface_points = self.brick_coords_[slots] * self.brick_size_ + np.c_[x_loc, np.c_[y_loc, z_loc]]
+        surface_vals = self.bricks_[slots, x_loc, y_loc, z_loc]
+
+        # remove brick padding and order points as in the dense grid
+        valid = np.all(surface_points < np.array(self.dims_), axis=1)
+        surface_points = surface_points[valid,:]
+        surface_vals = surface_vals[valid]
+        order = np.lexsort((surface_points[:,2], surface_points[:,1], surface_points[:,0]))
+        surface_points = surface_points[order,:]
+        surface_vals = surface_vals[order]
+
+        if not grid_basis:
+            surface_points = self.transform_pt_grid_to_obj(surface_points.T)
+            surface_points = surface_points.T
+
+        return surface_points, surface_vals
+
+    def transform(self, tf, detailed = False):
+        """
+        Transform the grid by pose T and scale with canonical reference frame at the SDF center with axis alignment.
+        Only bricks that map near the band of this sdf are resampled.
+        Params:
+            (similarity transform 3d): similarity tf
+            (bool): detailed - whether to trilinearly interpolate (accurate) or round to the nearest voxel (fast)
+        Returns:
+            (NarrowBandSdf3D): new sdf with grid warped by T
+        """
+        B = self.brick_size_
+        num_bricks = np.array(self.brick_index_.shape)
+        A, b = self._grid_affine(tf)
+
+        # find the source brick under the center of each new brick
+        brick_centers = np.indices(num_bricks).reshape(3, -1).T * B + (B - 1) / 2.0
+        src_centers = brick_centers.dot(A.T) + b
+        src_bricks = np.floor(src_centers / B).astype(np.int64)
+        inside = np.all((src_bricks >= 0) & (src_bricks < num_bricks), axis=1)
+
+        # a new brick can only reach the band if its footprint touches a stored brick
+        radius = int(np.ceil(np.sqrt(3) / 2 * np.max(np.linalg.norm(A, axis=0)) + 0.5))
+        occupied = scipy.ndimage.binary_dilation(self.brick_index_ >= 0, iterations=radius,
+                                                 structure=scipy.ndimage.generate_binary_structure(3, 3))
+        candidates = np.zeros(brick_centers.shape[0], dtype=bool)
+        candidates[inside] = occupied[src_bricks[inside,0], src_bricks[inside,1], src_bricks[inside,2]]
+        far_sign = np.where(self.interpolate(src_centers) < 0, -1, 1).astype(np.int8).reshape(num_bricks)
+
+        # resample the voxels of the candidate bricks
+        candidate_coords = brick_centers[candidates] - (B - 1) / 2.0
+        local_coords = np.indices([B, B, B]).reshape(3, -1).T
+        pts = (candidate_coords[:,np.newaxis,:] + local_coords[np.newaxis,:,:]).reshape(-1, 3)
+        pts_tf = pts.dot(A.T)
+        pts_tf += b
+        if detailed:
+            values = self.interpolate(pts_tf)
+        else:
+            pts_tf_round = np.round(pts_tf, out=pts_tf).astype(np.int64)
+            np.clip(pts_tf_round, 0, np.array(self.dims_) - 1, out=pts_tf_round)
+            values = self._values_at(pts_tf_round[:,0], pts_tf_round[:,1], pts_tf_round[:,2])
+        bricks = np.clip(values, -self.band_, self.band_).astype(np.float32).reshape(-1, B, B, B)
+
+        # keep only the resampled bricks that intersect the band
+        in_band = np.any(np.abs(bricks.reshape(bricks.shape[0], -1)) < self.band_, axis=1)
+        keep = np.zeros(brick_centers.shape[0], dtype=bool)
+        keep[np.nonzero(candidates)[0][in_band]] = True
+        brick_index = -np.ones(brick_centers.shape[0], dtype=np.int32)
+        brick_index[keep] = np.arange(np.sum(keep))
+
+        # transform the center and rescale the resolution
+        origin_tf = self.tf_sdf_grid_.apply(tf.apply(self.tf_grid_sdf_.apply(self.origin_)))
+        resolution_tf = tf.scale * self.resolution_
+        return NarrowBandSdf3D(np.ascontiguousarray(bricks[in_band]), brick_index.reshape(num_bricks), far_sign,
+                               self.dims_, origin_tf, resolution_tf, self.band_, tf = tf.compose(self.tf_))
+
 class Sdf2D(Sdf):
     def __init__(self, sdf_data, origin = np.array([0,0]), resolution = 1.0, pose = tfx.identity_tf(from_frame="world"), scale = 1.0):
         self.data_ = sdf_data
@@ -947,6 +1700,12 @@ def test_3d_transform():
     logging.info('Detailed 3D Transform took %f sec' %(duration))
     logging.info('Transformed detailed resolution %f' %(sdf_tf_d.resolution))
 
+    # transformed sdfs keep the dtype and signs of the source
+    signed_sdf = Sdf3D(sdf_3d.data - 2 * sdf_3d.resolution, sdf_3d.origin, sdf_3d.resolution, use_abs = False)
+    for detailed in [False, True]:
+        signed_tf = signed_sdf.transform(s_tf, detailed = detailed)
+        assert signed_tf.data.dtype == signed_sdf.data.dtype and np.any(signed_tf.data < 0)
+
     # display
     plt.figure()
     sdf_3d.scatter()
@@ -961,6 +1720,46 @@ def test_3d_transform():
     plt.title('Detailed Transformed')
     plt.show()
 
+def test_narrow_band_sdf():
+    np.random.seed(100)
+    sdf_3d_file_name = 'data/test/sdf/Co_clean_dim_25.sdf'
+    sdf_3d = sf.SdfFile(sdf_3d_file_name).read()
+    nb_sdf = sdf_3d.to_narrow_band(band=4, brick_size=8)
+
+    # surface points match exactly, with and without the pyramid
+    surface_points, surface_vals = sdf_3d.surface_points()
+    nb_points, nb_vals = nb_sdf.surface_points()
+    assert np.array_equal(surface_points, nb_points) and np.allclose(surface_vals, nb_vals)
+    assert np.array_equal(nb_sdf._surface_points_pyramid(), surface_points)
+    assert np.all(nb_sdf.surface_candidates(surface_points.astype(np.float64)))
+
+    # values and gradients match near the surface, where the band does not clamp
+    coords = surface_points + np.random.rand(*surface_points.shape) - 0.5
+    for x in coords:
+        assert abs(nb_sdf.signed_distance(x) - sdf_3d.signed_distance(x)) < 1e-5
+        assert np.allclose(nb_sdf.gradient(x), sdf_3d.gradient(x), atol=1e-5)
+
+    # windows and gradients match the dense grid of clamped values
+    clamped_sdf = Sdf3D(nb_sdf.data, sdf_3d.origin, sdf_3d.resolution, use_abs=False)
+    for target in [False, True]:
+        assert np.allclose(nb_sdf.make_windows(5, 3, target=target), clamped_sdf.make_windows(5, 3, target=target))
+    assert np.array_equal(nb_sdf.make_windows(5, 3, as_view=True), clamped_sdf.make_windows(5, 3, as_view=True))
+    voxels = np.indices(sdf_3d.dimensions).reshape(3, -1)
+    assert np.allclose(nb_sdf._gradients_at(*voxels), clamped_sdf._gradients_at(*voxels), atol=1e-5)
+    assert np.array_equal(nb_sdf.interior_at(*voxels), sdf_3d.interior_at(*voxels))
+
+    # transformed copies have the same surface
+    tf = tfx.random_tf()
+    tf.position = 0.01 * np.random.rand(3)
+    s_tf = stf.SimilarityTransform3D(tf, scale = 1.2)
+    for detailed in [False, True]:
+        sdf_tf = sdf_3d.transform(s_tf, detailed = detailed)
+        nb_sdf_tf = nb_sdf.transform(s_tf, detailed = detailed)
+        surface_points_tf, surface_vals_tf = sdf_tf.surface_points()
+        nb_points_tf, nb_vals_tf = nb_sdf_tf.surface_points()
+        assert np.array_equal(surface_points_tf, nb_points_tf) and np.allclose(surface_vals_tf, nb_vals_tf, atol=1e-5)
+    logging.info('Narrow band sdf test passed!')
+
 def test_2d_transform():
     sdf_2d_file_name = 'data/test/sdf/medium_black_spring_clamp_optimized_poisson_texture_mapped_mesh_clean_0.csv'
     sf2 = sf.SdfFile(sdf_2d_file_name)
@@ -23,14 +23,14 @@ class SdfFile:
         else:
             raise ValueError('Extension %s invalid for SDFs' %(file_ext))
     
-    def read(self):
+    def read(self, dtype=None):
         '''
-        Reads an SDF from file
+        Reads an SDF from file, optionally storing 3d sdf values in the given dtype
         '''
         # read in basic params from file
         try:
             if self.use_3d_:
-                return self._read_3d()
+                return self._read_3d(dtype)
             else:
                 return self._read_2d()
 
@@ -38,7 +38,7 @@ class SdfFile:
             logging.error('Failed to open %s as an SDF'%(self.file_name_)) 
             return None
 
-    def _read_3d(self):
+    def _read_3d(self, dtype=None):
         '''
         Reads a 3d SDF
         '''
@@ -59,7 +59,7 @@ class SdfFile:
                     sdf_data[i][j][k] = float(my_file.readline())
                     count += 1 
         my_file.close()
-        return sdf.Sdf3D(sdf_data, origin, resolution)
+        return sdf.Sdf3D(sdf_data, origin, resolution, dtype=dtype)
 
     def _read_2d(self):
         '''
@@ -73,9 +73,23 @@ class SdfFile:
 
     def write(self, sdf):
         '''
-        Writes an SDF to file
+        Writes an SDF to file in the format read by read
         '''
-        todo = 1
+        if self.use_3d_:
+            self._write_3d(sdf)
+        else:
+            np.savetxt(self.file_name_, sdf.data, delimiter=',')
+
+    def _write_3d(self, sdf):
+        '''
+        Writes a 3d SDF, with the x index varying fastest as in _read_3d
+        '''
+        my_file = open(self.file_name_, 'w')
+        my_file.write('%d %d %d\n' %tuple(sdf.dimensions))
+        my_file.write('%.8g %.8g %.8g\n' %tuple(sdf.origin))
+        my_file.write('%.8g\n' %(sdf.resolution))
+        np.savetxt(my_file, sdf.data.ravel(order='F'), fmt='%.8g')
+        my_file.close()
 
 def test_3d():
     sdf_3d_file_name = 'data/test/sdf/Co_clean_dim_25.sdf'
@@ -102,6 +116,24 @@ def test_3d():
     sdf_3d.scatter()
     plt.show()
     
+def test_3d_write():
+    import shutil, tempfile
+    sdf_3d_file_name = 'data/test/sdf/Co_clean_dim_25.sdf'
+    sdf_3d = SdfFile(sdf_3d_file_name).read()
+
+    # write to a temporary file and read back
+    tmp_dir = tempfile.mkdtemp()
+    out_file_name = os.path.join(tmp_dir, 'Co_clean_dim_25.sdf')
+    SdfFile(out_file_name).write(sdf_3d)
+    sdf_3d_read = SdfFile(out_file_name).read()
+    shutil.rmtree(tmp_dir)
+
+    assert sdf_3d_read.dimensions == sdf_3d.dimensions
+    assert np.allclose(sdf_3d_read.origin, sdf_3d.origin)
+    assert abs(sdf_3d_read.resolution - sdf_3d.resolution) < 1e-12
+    assert np.allclose(sdf_3d_read.data, sdf_3d.data)
+    logging.info('SDF write test passed!')
+
 def test_2d():
     sdf_2d_file_name = 'data/test/sdf/medium_black_spring_clamp_optimized_poisson_texture_mapped_mesh_clean_0.csv'
 #    sdf_2d_file_name = 'data/test/sdf/brine_mini_soccer_ball_optimized_poisson_texture_mapped_mesh_clean_0.csv'
@@ -124,5 +156,6 @@ if __name__ == '__main__':
     logging.getLogger().setLevel(logging.DEBUG)
     test_2d()
     test_3d()
+    test_3d_write()
     
 
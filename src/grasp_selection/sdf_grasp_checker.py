@@ -0,0 +1,236 @@
+"""
+Lightweight gripper collision checking against an object's SDF, for pruning grasps without OpenRAVE.
+The gripper is modelled as a palm and two finger boxes in the gripper frame of ParallelJawPtGrasp3D.gripper_pose,
++X is the approach direction and the jaws open along +Y
+"""
+import logging
+import numpy as np
+import time
+
+import grasp as g
+
+import IPython
+
+# default box dimensions in meters, roughly matching the PR2 gripper
+PR2_FINGER_LENGTH = 0.04
+PR2_FINGER_THICKNESS = 0.01
+PR2_FINGER_HEIGHT = 0.02
+PR2_PALM_DEPTH = 0.08
+PR2_PALM_HEIGHT = 0.05
+
+def box_surface_points(center, dims, spacing):
+    """
+    Samples a grid of points on the faces of an axis-aligned box
+    Params:
+        center: (numpy 3 array) center of the box
+        dims: (numpy 3 array) side lengths of the box
+        spacing: (float) max distance between neighboring samples
+    Returns:
+        numpy N x 3 array of points on the box surface
+    """
+    axes = [np.linspace(-d / 2.0, d / 2.0, num=max(int(np.ceil(d / spacing)) + 1, 2)) for d in dims]
+    points = []
+    for d in range(3):
+        u, v = [axes[i] for i in range(3) if i != d]
+        U, V = np.meshgrid(u, v, indexing='ij')
+        for side in [-dims[d] / 2.0, dims[d] / 2.0]:
+            face = np.zeros([U.size, 3])
+            face[:,d] = side
+            face[:,[i for i in range(3) if i != d]] = np.c_[U.ravel(), V.ravel()]
+            points.append(face)
+    return np.concatenate(points) + center
+
+class SdfGraspChecker(object):
+    def __init__(self, finger_length = PR2_FINGER_LENGTH, finger_thickness = PR2_FINGER_THICKNESS,
+                 finger_height = PR2_FINGER_HEIGHT, palm_depth = PR2_PALM_DEPTH, palm_height = PR2_PALM_HEIGHT,
+                 spacing = None, margin = 0.0, max_points_per_batch = 1000000,
+                 R_gripper_center = np.eye(3), t_gripper_center = g.PR2_GRASP_OFFSET):
+        """
+        Params:
+            finger_length, finger_thickness, finger_height: (float) finger box dims along x, y and z
+            palm_depth, palm_height: (float) palm box dims along x and z
+            spacing: (float) distance between gripper surface samples, defaults to the sdf resolution
+            margin: (float) extra clearance required between the gripper and the object surface
+            max_points_per_batch: (int) max number of sdf lookups to do at once
+            R_gripper_center, t_gripper_center: grasp to gripper transform, as in ParallelJawPtGrasp3D.gripper_pose
+        """
+        self.finger_length_ = finger_length
+        self.finger_thickness_ = finger_thickness
+        self.finger_height_ = finger_height
+        self.palm_depth_ = palm_depth
+        self.palm_height_ = palm_height
+        self.spacing_ = spacing
+        self.margin_ = margin
+        self.max_points_per_batch_ = max_points_per_batch
+        self.R_gripper_center_ = R_gripper_center
+        self.t_gripper_center_ = t_gripper_center
+
+    def gripper_points(self, grasp_width, spacing):
+        """
+        Samples points on the gripper surface in the gripper frame with the jaws open to grasp_width
+        Returns:
+            numpy N x 3 array of points
+        """
+        # the grasp center sits at -t_gripper_center in the gripper frame
+        center = -self.R_gripper_center_.T.dot(self.t_gripper_center_)
+        finger_dims = np.array([self.finger_length_, self.finger_thickness_, self.finger_height_])
+        finger_offset = np.array([0, (grasp_width + self.finger_thickness_) / 2.0, 0])
+        palm_width = grasp_width + 2 * self.finger_thickness_
+        palm_dims = np.array([self.palm_depth_, palm_width, self.palm_height_])
+        palm_offset = np.array([-(self.finger_length_ + self.palm_depth_) / 2.0, 0, 0])
+
+        return np.concatenate([box_surface_points(center + finger_offset, finger_dims, spacing),
+                               box_surface_points(center - finger_offset, finger_dims, spacing),
+                               box_surface_points(center + palm_offset, palm_dims, spacing)])
+
+    def gripper_poses(self, grasps):
+        """
+        Batched version of ParallelJawPtGrasp3D.gripper_pose
+        Params:
+            grasps: list of ParallelJawPtGrasp3D
+        Returns:
+            R: numpy N x 3 x 3 array of gripper rotations
+            t: numpy N x 3 array of gripper translations
+        """
+        centers = np.array([grasp.center for grasp in grasps])
+        axes_y = np.array([grasp.axis for grasp in grasps])
+        angles = np.array([grasp.approach_angle for grasp in grasps])
+
+        axes_x = np.c_[axes_y[:,1], -axes_y[:,0], np.zeros(len(grasps))]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            axes_x = axes_x / np.linalg.norm(axes_x, axis=1)[:,np.newaxis]
+        axes_z = np.cross(axes_x, axes_y)
+        R_center_ref = np.concatenate([axes_x[:,:,np.newaxis], axes_y[:,:,np.newaxis], axes_z[:,:,np.newaxis]], axis=2)
+
+        # rotate along grasp approach angle
+        R_center_rot_center = np.zeros([len(grasps), 3, 3])
+        R_center_rot_center[:,0,0] = np.cos(angles)
+        R_center_rot_center[:,0,2] = np.sin(angles)
+        R_center_rot_center[:,1,1] = 1
+        R_center_rot_center[:,2,0] = -np.sin(angles)
+        R_center_rot_center[:,2,2] = np.cos(angles)
+
+        R_rot_ref = np.einsum('nij,njk->nik', R_center_ref, R_center_rot_center)
+        R = R_rot_ref.dot(self.R_gripper_center_)
+        t = centers + R_rot_ref.dot(self.t_gripper_center_)
+        return R, t
+
+    def collision_mask(self, graspable, grasps):
+        """
+        Checks the gripper at each grasp for collisions with the object
+        Params:
+            graspable: (GraspableObject3D) the object, with an Sdf3D
+            grasps: list of ParallelJawPtGrasp3D in the world frame (e.g. from ParallelJawPtGrasp3D.transform)
+        Returns:
+            numpy bool array, True for grasps in collision
+        """
+        in_collision = np.zeros(len(grasps), dtype=np.bool)
+        if len(grasps) == 0:
+            return in_collision
+        sdf = graspable.sdf
+        spacing = self.spacing_
+        if spacing is None:
+            spacing = sdf.resolution
+        clearance = max(sdf.surface_thresh, spacing * np.sqrt(2) / 2) + self.margin_
+        tf_world_obj = graspable.tf.inverse()
+        max_coords = np.array(sdf.dimensions) - 1
+
+        # poses that cannot be computed (e.g. axis along z) are treated as in collision
+        R, t = self.gripper_poses(grasps)
+        in_collision = ~np.isfinite(R).all(axis=(1,2))
+
+        grasp_widths = np.array([grasp.grasp_width for grasp in grasps])
+        for grasp_width in np.unique(grasp_widths):
+            gripper_pts = self.gripper_points(grasp_width, spacing)
+            indices = np.nonzero((grasp_widths == grasp_width) & ~in_collision)[0]
+            batch_size = max(self.max_points_per_batch_ / gripper_pts.shape[0], 1)
+
+            for start in range(0, indices.shape[0], batch_size):
+                batch = indices[start:start+batch_size]
+                pts_world = np.einsum('nij,pj->npi', R[batch], gripper_pts) + t[batch,np.newaxis,:]
+                pts_obj = tf_world_obj.apply_points(pts_world.reshape(-1, 3))
+                pts_grid = sdf.transform_pt_obj_to_grid(pts_obj.T).T.reshape(-1, 3)
+
+                # points off the grid are in free space
+                sd = sdf.interpolate(pts_grid)
+                in_bounds = (pts_grid >= 0).all(axis=1) & (pts_grid <= max_coords).all(axis=1)
+                nearest = np.clip(np.round(pts_grid), 0, max_coords).astype(np.int64)
+                inside = sdf.interior_at(nearest[:,0], nearest[:,1], nearest[:,2])
+                hits = in_bounds & ((np.abs(sd) < clearance) | inside)
+                in_collision[batch] = hits.reshape(batch.shape[0], gripper_pts.shape[0]).any(axis=1)
+        return in_collision
+
+    def prune_grasps_in_collision(self, graspable, object_grasps, **kwargs):
+        """ Remove all grasps from the object grasps list that are in collision with the given object """
+        in_collision = self.collision_mask(graspable, object_grasps)
+        return [grasp for grasp, collides in zip(object_grasps, in_collision) if not collides]
+
+    def collision_free_rotations(self, graspable, grasps, theta_res):
+        """
+        Checks all rotations of many grasps about their axes at once
+        Params:
+            graspable: (GraspableObject3D) the object
+            grasps: list of ParallelJawPtGrasp3D in the object frame
+            theta_res: (float) angle resolution of the rotations, as in ParallelJawPtGrasp3D.transform
+        Returns:
+            list with the collision free rotated grasps for each grasp
+        """
+        start_time = time.clock()
+        rotated_grasps = [grasp.transform(graspable.tf, theta_res) for grasp in grasps]
+        all_rotated_grasps = [rotated_grasp for rotations in rotated_grasps for rotated_grasp in rotations]
+        in_collision = self.collision_mask(graspable, all_rotated_grasps)
+
+        collision_free = []
+        i = 0
+        for rotations in rotated_grasps:
+            collision_free.append([grasp for grasp, collides in zip(rotations, in_collision[i:i+len(rotations)]) if not collides])
+            i = i + len(rotations)
+        logging.debug('SdfGraspChecker: Time to check %d gripper poses: %f' %(len(all_rotated_grasps), time.clock() - start_time))
+        return collision_free
+
+def test_sdf_grasp_collisions():
+    import sdf, sdf_file, obj_file, graspable_object
+    np.random.seed(100)
+
+    sdf_3d_file_name = 'data/test/sdf/Co_clean.sdf'
+    sf = sdf_file.SdfFile(sdf_3d_file_name)
+    sdf_3d = sf.read()
+
+    mesh_name = 'data/test/meshes/Co_clean.obj'
+    of = obj_file.ObjFile(mesh_name)
+    m = of.read()
+
+    graspable = graspable_object.GraspableObject3D(sdf_3d, mesh=m, model_name=mesh_name)
+    grasp_checker = SdfGraspChecker()
+
+    # a grasp far from the object is collision free
+    axis = np.array([1, 0, 0])
+    free_grasp = g.ParallelJawPtGrasp3D(np.array([0, 0, 1.0]), axis, 0.1)
+    center_grasp = g.ParallelJawPtGrasp3D(np.array([0, 0, 0]), axis, 0.1)
+    in_collision = grasp_checker.collision_mask(graspable, [free_grasp, center_grasp])
+    assert not in_collision[0]
+
+    rotated_grasps = grasp_checker.collision_free_rotations(graspable, [center_grasp], 2 * np.pi / 10)
+    logging.info('%d of 10 rotations of the center grasp are collision free' %(len(rotated_grasps[0])))
+
+    # a small gripper embedded deep inside a large sphere is in collision, although the sdf stores |sdf|
+    dim = 50
+    half_width = 0.1
+    resolution = 2.0 * half_width / (dim - 1)
+    pts_grid = np.indices([dim, dim, dim]).reshape(3, -1).T
+    sphere_data = (np.linalg.norm(pts_grid * resolution - half_width, axis=1) - 0.08).reshape([dim, dim, dim])
+    sphere_sdf = sdf.Sdf3D(sphere_data, -half_width * np.ones(3), resolution)
+    sphere = graspable_object.GraspableObject3D(sphere_sdf)
+    small_checker = SdfGraspChecker(finger_length=0.02, finger_thickness=0.005, finger_height=0.01, palm_depth=0.02,
+                                    palm_height=0.02, t_gripper_center=np.zeros(3))
+    embedded_grasp = g.ParallelJawPtGrasp3D(np.zeros(3), axis, 0.02)
+    assert small_checker.collision_mask(sphere, [embedded_grasp])[0]
+
+    # the interior is cached on the sdf, and narrow band sdfs find the same interior from their bricks
+    assert sphere_sdf.interior_ is not None
+    nb_sphere = graspable_object.GraspableObject3D(sphere_sdf.to_narrow_band())
+    assert small_checker.collision_mask(nb_sphere, [embedded_grasp])[0]
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    test_sdf_grasp_collisions()
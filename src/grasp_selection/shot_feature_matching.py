@@ -55,12 +55,16 @@ class ShotFeatures:
 
         #determining indices of points with descriptors in original .obj/point list
         self.all_points = np.loadtxt(pts_file_name)
+        self.point_index_ = None
 
     def get_index(self, point):
-        inds = np.where(np.linalg.norm(point - self.all_points, axis=1) < 1e-4)
-        if inds[0].shape[0] == 0:
-            return -1
-        return inds[0][0]
+        return self.point_index.lookup(point)
+
+    @property
+    def point_index(self):
+        if self.point_index_ is None:
+            self.point_index_ = fm.PointIndex(self.all_points)
+        return self.point_index_
 
     def indices_with_descriptors(self):
         """
@@ -74,7 +78,7 @@ class ShotFeatures:
 
     def calc_closest_descriptors(self, other_model):
         """
-        Brute force 1-NN of shot descriptors using cdist. Input self and another shot_features instance.
+        Mutual 1-NN of shot descriptors using KD-trees. Input self and another shot_features instance.
         Returns dictionary mapping of this model's points to the other_model's points, as well as matrix containing the points in 
         the other model closest to this model's keypoints.
         Params:
@@ -86,29 +90,19 @@ class ShotFeatures:
                             in the other_model that is closest to keypoint i of this model
         """
 
-        #calculate distance between this model's descriptors and each of the other_model's descriptors
-        dists = spatial.distance.cdist(self.descriptors, other_model.descriptors) 
-        
         #calculate the indices of the other_model that minimize the distance to the descriptors in this model
-        my_closest_descriptors = dists.argmin(axis=1)
-        other_closest_descriptors = dists.argmin(axis=0)
-        matches = {}
-        my_matched_points = np.zeros((0,3))
-        other_matched_points = np.zeros((0,3))
+        my_closest_descriptors, is_match = fm.mutual_nearest_neighbors(self.descriptors, other_model.descriptors)
 
         #calculate which points/indices the closest descriptors correspond to
-        for i, j in enumerate(my_closest_descriptors):
-            my_point_index = self.get_index(self.points[i])
-
-            # for now, only keep correspondences that are a 2-way match
-            if other_closest_descriptors[my_closest_descriptors[i]] == i:
-                other_point_index = other_model.get_index(other_model.points[j])
-
-                matches[my_point_index] = other_point_index
-                my_matched_points = np.r_[my_matched_points, self.all_points[my_point_index:my_point_index+1, :]]
-                other_matched_points = np.r_[other_matched_points, other_model.all_points[other_point_index:other_point_index+1, :]]
-            else:
-                matches[my_point_index] = -1
+        my_point_indices = self.point_index.lookup_all(self.points)
+        other_point_indices = other_model.point_index.lookup_all(other_model.points[my_closest_descriptors])
+
+        # for now, only keep correspondences that are a 2-way match
+        other_point_indices[~is_match] = -1
+        matches = dict(zip(my_point_indices, other_point_indices))
+        valid = is_match & (my_point_indices >= 0) & (other_point_indices >= 0)
+        my_matched_points = self.all_points[my_point_indices[valid]]
+        other_matched_points = other_model.all_points[other_point_indices[valid]]
 
         return matches, my_matched_points, other_matched_points
     
@@ -5,40 +5,73 @@ import tfx
 
 import IPython
 
-class SimilarityTransform3D:
+class SimilarityTransform3D(object):
+    """
+    Rigid pose plus uniform scale. The rotation, translation and scale are cached as plain numpy arrays so that
+    applying, composing and inverting transforms never touches tfx. The tfx pose is only built when requested
+    through the pose property (e.g. for frame bookkeeping or ROS interop).
+    """
     def __init__(self, pose, scale=1.0):
         if not isinstance(pose, tfx.canonical.CanonicalTransform):
             raise ValueError('Pose must be tfx canonical tf')
         self.pose_ = pose
         self.scale_ = scale
-        
+        self._set_arrays_from_pose(pose)
+
+    @staticmethod
+    def _from_arrays(R, t, scale):
+        """
+        Creates a transform directly from cached arrays. The tfx pose is built from R and t on demand
+        """
+        tf = SimilarityTransform3D.__new__(SimilarityTransform3D)
+        tf.R_ = R
+        tf.t_ = t
+        tf.scale_ = scale
+        tf.pose_ = None
+        return tf
+
+    def _set_arrays_from_pose(self, pose):
+        self.R_ = np.array(pose.rotation.matrix, dtype=np.float64)
+        self.t_ = np.array(pose.position, dtype=np.float64).ravel()
+
+    def apply_points(self, pts):
+        """
+        Applies the transform to an N x 3 array of points
+        Params:
+            pts: (numpy N x 3 array) points to transform
+        Returns:
+            (numpy N x 3 array) transformed points
+        """
+        pts_tf = pts.dot(self.R_.T)
+        pts_tf += self.t_
+        pts_tf *= (1.0 / self.scale_)
+        return pts_tf
+
+    def apply_dirs(self, dirs):
+        """
+        Rotates an N x 3 array of directions (no translation or scaling)
+        Params:
+            dirs: (numpy N x 3 array) directions to transform
+        Returns:
+            (numpy N x 3 array) rotated directions
+        """
+        return dirs.dot(self.R_.T)
+
     def apply(self, x, direction = False):
         """ Applies a similarity transform to a point x"""
         # allow numpy arays
         if isinstance(x, np.ndarray) and x.shape[0] == 3:
-            num_pts = 1
-            if x.ndim > 1:
-                num_pts = x.shape[1]
-            else:
-                x = np.array([x]).T
+            single_pt = (x.ndim == 1 or x.shape[1] == 1)
+            x = x.reshape(3, -1)
 
             # rotation only if a direction
             if direction:
-                x_tf = np.array(self.pose_.rotation.matrix.dot(x))
-                if num_pts == 1:
-                    x_tf = x_tf.squeeze()
-                return x_tf
-
-            # multiply pose matrix and scale result
-            x_homog = np.r_[x, np.ones([1, num_pts])]
-            x_homog_tf = np.array(self.pose_.matrix.dot(x_homog))
-            x_tf = x_homog_tf[0:3,:]
-            x_tf_scale = (1.0 / self.scale_) * x_tf
-            x_tf_scale = np.array(x_tf_scale)
-            if num_pts == 1:
-                x_tf_scale = x_tf_scale.squeeze()
-
-            return x_tf_scale 
+                x_tf = self.apply_dirs(x.T).T
+            else:
+                x_tf = self.apply_points(x.T).T
+            if single_pt:
+                x_tf = x_tf.squeeze()
+            return x_tf
         elif (isinstance(x, np.ndarray) and x.shape[0] == 1) or isinstance(x, numbers.Number):
             x_tf = (1.0 / self.scale_) * x
             return x_tf
@@ -46,30 +79,34 @@ class SimilarityTransform3D:
             raise ValueError('Only numpy 3-arrays are supported')
 
     def compose(self, other_tf):
-        pose_tf = other_tf.pose.apply(self.pose_)
+        R = other_tf.R_.dot(self.R_)
+        t = other_tf.R_.dot(self.t_) + other_tf.t_
         scale_tf = other_tf.scale * self.scale_
-        return SimilarityTransform3D(pose_tf, scale_tf)
+        return SimilarityTransform3D._from_arrays(R, t, scale_tf)
 
     def inverse(self):
-        inv_pose = self.pose_.inverse()
-        inv_pose.position = (1.0 / self.scale_) * inv_pose.position
-        return SimilarityTransform3D(inv_pose, 1.0 / self.scale_)
+        R = self.R_.T
+        t = -(1.0 / self.scale_) * R.dot(self.t_)
+        return SimilarityTransform3D._from_arrays(R, t, 1.0 / self.scale_)
 
     @property
     def translation(self):
-        return np.array(self.pose_.position).squeeze()
+        return self.t_.copy()
 
     @property
     def rotation(self):
-        return np.array(self.pose_.rotation.matrix)
+        return self.R_.copy()
 
     @property
     def pose(self):
+        if self.pose_ is None:
+            self.pose_ = tfx.canonical.CanonicalTransform(self.R_, self.t_)
         return self.pose_
 
     @pose.setter
     def pose(self, pose):
         self.pose_ = pose
+        self._set_arrays_from_pose(pose)
 
     @property
     def scale(self):
@@ -78,3 +115,28 @@ class SimilarityTransform3D:
     @scale.setter
     def scale(self, scale):
         self.scale_ = scale
+
+def test_similarity_tf():
+    np.random.seed(100)
+    pose_a = tfx.random_tf()
+    pose_b = tfx.random_tf()
+    tf_a = SimilarityTransform3D(pose_a, scale=1.5)
+    tf_b = SimilarityTransform3D(pose_b, scale=0.7)
+
+    x = np.random.rand(3, 10)
+    tf_ab = tf_a.compose(tf_b)
+    assert np.allclose(tf_ab.inverse().apply(tf_ab.apply(x)), x)
+    assert np.allclose(tf_ab.apply_points(x.T), tf_ab.apply(x).T)
+    assert np.allclose(tf_ab.rotation, np.array(tf_ab.pose.rotation.matrix))
+    assert np.allclose(tf_ab.translation, np.array(tf_ab.pose.position).squeeze())
+
+    # lazily built poses do not depend on later changes to the parents
+    tf_ab = tf_a.compose(tf_b)
+    tf_ab_inv = tf_ab.inverse()
+    tf_a.pose = tfx.random_tf()
+    assert np.allclose(tf_ab.rotation, np.array(tf_ab.pose.rotation.matrix))
+    assert np.allclose(tf_ab_inv.translation, np.array(tf_ab_inv.pose.position).squeeze())
+    print 'Similarity transforms consistent'
+
+if __name__ == '__main__':
+    test_similarity_tf()
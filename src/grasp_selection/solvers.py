@@ -52,7 +52,7 @@ class DiscreteSamplingSolver(SamplingSolver):
         TopKSolver.__init__(self, objective)
 
     @abstractmethod
-    def discrete_maximize(self, candidates, termination_condition, snapshot_rate):
+    def discrete_maximize(self, candidates, termination_condition, snapshot_rate, checkpoint = None):
         """
         Main loop for sampling-based solvers
         """
@@ -80,9 +80,9 @@ class DiscreteSamplingSolver(SamplingSolver):
         return candidate_bins
 
     def solve(self, termination_condition = tc.MaxIterTerminationCondition(DEF_MAX_ITER),
-              snapshot_rate = 1):
-        """ Call discrete maxmization function with all candidates """
-        return self.discrete_maximize(self.candidates_, termination_condition, snapshot_rate)
+              snapshot_rate = 1, checkpoint = None):
+        """ Call discrete maxmization function with all candidates, optionally checkpointing the run """
+        return self.discrete_maximize(self.candidates_, termination_condition, snapshot_rate, checkpoint)
 
     def top_K_solve(self, K, termination_condition = tc.MaxIterTerminationCondition(DEF_MAX_ITER),
                     snapshot_rate = 1):
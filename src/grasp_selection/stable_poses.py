@@ -2,6 +2,7 @@
 Computes the statistical distribution of stable poses for a polyhedron
 Author: Nikhil Sharma
 """
+import logging
 import math
 import sys
 # import IPython
@@ -47,289 +48,175 @@ def compute_centroid(vertices):
         centroid.append(sum([vertex[i] for vertex in vertices]) / len(vertices))
     return np.array(centroid)
 
+# local vertex indices of the three edges of each triangle, in the order (v0, v1), (v0, v2), (v1, v2)
+TRIANGLE_EDGES = np.array([[0, 1], [0, 2], [1, 2]])
+
+# edge to topple over for each pattern of closest edges, encoded as a bitmask over TRIANGLE_EDGES.
+# Ties resolve to the edge from the shared vertex to the next vertex of the triangle, as in the original topple rule
+TOPPLE_EDGE_FOR_TIES = np.array([-1, 0, 1, 0, 2, 2, 1, 1])
+
 # A function for computing the statistical distribution of stable poses of a polyhedron.
-def compute_stable_poses(mesh):
+def compute_stable_poses(mesh, convex_hull=None):
     """
     Computes convex hull of the input mesh and returns stable final faces along with 
     corresponding probabilities.
 
     mesh -- a 3D Mesh object
+    convex_hull -- (optional) the precomputed convex hull of mesh
     """
-    convex_hull, cm = mesh.convex_hull(), mesh.vertex_mean_
-
-    # mapping each edge in the convex hull to the two faces it borders
-    triangles, vertices, edge_to_faces, triangle_to_vertex = convex_hull.triangles(), convex_hull.vertices(), {}, {}
-
-    for triangle in triangles:
-        triangle_vertices = [vertices[i] for i in triangle]
-        e1, e2, e3 = Segment(triangle_vertices[0], triangle_vertices[1]), Segment(triangle_vertices[0], triangle_vertices[2]), Segment(triangle_vertices[1], triangle_vertices[2])
-        for edge in [e1, e2, e3]:
-            # order vertices for consistent hashing
-            p_1, p_2 = tuple(edge.endpoint_1), tuple(edge.endpoint_2)
-            k = (p_1, p_2)
-            if p_1[0] < p_2[0]:
-                k = (p_2, p_1)
-            elif p_1[0] == p_2[0] and p_1[1] < p_2[1]:
-                k = (p_2, p_1)
-            elif p_1[0] == p_2[0] and p_1[1] == p_2[1] and p_1[2] < p_2[2]:
-                k = (p_2, p_1)
-                
- 
-            if k in edge_to_faces:
-                edge_to_faces[k] += [triangle]
-            else:
-                edge_to_faces[k] = [triangle]
-        p_i = compute_projected_area(triangle_vertices, cm) / (4 * math.pi)
-        v = Vertex(p_i, triangle)
-        triangle_to_vertex[tuple(triangle)] = v
-
-    # determining if landing on a given face implies toppling, and initializes a directed acyclic graph
-    # a directed edge between two graph nodes implies that landing on one face will lead to toppling onto its successor
-    # an outdegree of 0 for any graph node implies it is a sink (the object will come to rest if it topples to this face)
-    for triangle in triangles:
-        triangle_vertices = [vertices[i] for i in triangle]
-
-        # computation of projection of cm onto plane of face
-        v_0 = np.subtract(triangle_vertices[2], triangle_vertices[0])
-        v_1 = np.subtract(triangle_vertices[1], triangle_vertices[0])
-
-        v_0 = v_0 / np.linalg.norm(v_0)
-        v_1 = v_1 / np.linalg.norm(v_1)
-        normal_vector = np.cross(v_0, v_1)
-        
-        origin_point = np.array(triangle_vertices[0])
-        normal_vector = normal_vector / np.linalg.norm(normal_vector)
-
-        proj_vector = np.subtract(cm, origin_point)
-        dist = np.dot(normal_vector, proj_vector)
-        proj_cm = np.subtract(cm, dist*normal_vector)
-
-        other_dist = np.linalg.norm(cm - np.array(triangle_vertices[1]))
-
-        # barycentric coordinates/minimum distance analysis (adapted from implementation provided at http://www.blackpawn.com/texts/pointinpoly/)
-        v_2 = np.subtract(proj_cm, triangle_vertices[0])
-
-        dot_00 = np.dot(v_0, v_0)
-        dot_01 = np.dot(v_0, v_1)
-        dot_02 = np.dot(v_0, v_2)
-        dot_11 = np.dot(v_1, v_1)
-        dot_12 = np.dot(v_1, v_2)
-
-        inv_denom = 1.0 / (dot_00 * dot_11 - dot_01 * dot_01)
-        u = (dot_11 * dot_02 - dot_01 * dot_12) * inv_denom
-        v = (dot_00 * dot_12 - dot_01 * dot_02) * inv_denom
-
-        proj_cm_in_triangle = (u >= 0) and (v >= 0) and (u + v < 1)
-
-        # update list of top vertices, add edges between vertices as needed
-        if not proj_cm_in_triangle:
-            s1, s2, s3 = Segment(triangle_vertices[0], triangle_vertices[1]), Segment(triangle_vertices[0], triangle_vertices[2]), Segment(triangle_vertices[1], triangle_vertices[2])
-            closest_edges, common_endpoint = closest_segment(proj_cm, [s1, s2, s3])
-            if len(closest_edges) > 1:
-                index = triangle_vertices.index(common_endpoint)
-                if index == len(triangle_vertices) - 1:
-                    index = 0
-                else:
-                    index = index + 1
-                closest_edge = Segment(common_endpoint, triangle_vertices[index])
-
-            else:
-                closest_edge = closest_edges[0]
-
-            # order vertices for consistent hashing
-            p_1, p_2 = tuple(closest_edge.endpoint_1), tuple(closest_edge.endpoint_2)
-            k = (p_1, p_2)
-            if p_1[0] < p_2[0]:
-                k = (p_2, p_1)
-            elif p_1[0] == p_2[0] and p_1[1] < p_2[1]:
-                k = (p_2, p_1)
-            elif p_1[0] == p_2[0] and p_1[1] == p_2[1] and p_1[2] < p_2[2]:
-                k = (p_2, p_1)
-
-            for face in edge_to_faces[k]:
-                if list(face) != list(triangle):
-                    topple_face = face
-            predecessor, successor = triangle_to_vertex[tuple(triangle)], triangle_to_vertex[tuple(topple_face)]
-            predecessor.add_edge(successor)
-
-    probabilities = propagate_probabilities(triangle_to_vertex.values())
-
-    return probabilities
-
-
-def compute_projected_area(vertices, cm):
-    """
-    Projects input vertices onto unit sphere and computes the area of the projection
-    
-    triangle_vertices -- list of three 3-element arrays; each array is a vertex coordinate of the triangle
-    cm -- 3-element array representing the center of mass of the mesh being handled
-    """
-    angles, projected_vertices = [], [np.subtract(vertex, cm) / np.linalg.norm(np.subtract(vertex, cm)) for vertex in vertices]
-
-    a = math.acos(max(1, min(-1, np.dot(projected_vertices[0], projected_vertices[1]) / (np.linalg.norm(projected_vertices[0]) * np.linalg.norm(projected_vertices[1])))))
-    b = math.acos(max(1, min(-1, np.dot(projected_vertices[0], projected_vertices[2]) / (np.linalg.norm(projected_vertices[0]) * np.linalg.norm(projected_vertices[2])))))
-    c = math.acos(max(1, min(-1, np.dot(projected_vertices[1], projected_vertices[2]) / (np.linalg.norm(projected_vertices[1]) * np.linalg.norm(projected_vertices[2])))))
-    s = (a + b + c) / 2
-
-    try:
-        return 4 * math.atan(math.sqrt(math.tan(s/2)*math.tan((s-a)/2)*math.tan((s-b)/2)*math.tan((s-c)/2)))
-    except:
-        s = s + 0.001
-        return 4 * math.atan(math.sqrt(math.tan(s/2)*math.tan((s-a)/2)*math.tan((s-b)/2)*math.tan((s-c)/2)))
-    
-    
-
-def propagate_probabilities(vertices):
-    """
-    Pushes the probability of each vertex onto it sink by traversing the graph for each vertex. Slow, but works
-
-    vertices -- list of all vertices in grasp
-    prob_mapping -- mapping of sink vertices to their propogated probabilities
-    """
+    if convex_hull is None:
+        convex_hull = mesh.convex_hull()
+    cm = mesh.vertex_mean_
+    triangles = convex_hull.triangles()
+    vertices = np.array(convex_hull.vertices())
+    triangle_array = np.array(triangles, dtype=np.int64)
+
+    # the probability of landing on each face is its solid angle seen from the center of mass
+    probabilities = compute_projected_areas(vertices, triangle_array, cm) / (4 * math.pi)
+
+    # determine which face each face topples onto, which forms a directed acyclic graph
+    # a face topples if it has an outgoing edge, otherwise it is a sink (the object will come to rest on it)
+    neighbors = hull_edge_adjacency(triangle_array)
+    topple_faces = compute_topple_faces(vertices, triangle_array, neighbors, cm)
+
+    sinks, sink_probabilities = propagate_probabilities(topple_faces, probabilities)
     prob_mapping = {}
-    for vertex in vertices:
-        c = vertex
-        visited = []
-        while not c.is_sink:
-            if c in visited:
-                break
-            visited.append(c)
-            c = c.children[0]
-
-        if not vertex.is_sink:
-            c.probability += vertex.probability
-        prob_mapping[tuple(c.face)] = c.probability
-
+    for sink, probability in zip(sinks, sink_probabilities):
+        prob_mapping[tuple(triangles[sink])] = probability
     return prob_mapping
 
-
-def closest_segment(point, line_segments):
+def hull_edge_adjacency(triangles):
     """
-    Returns the finite line segment the least distance from the input point
+    Returns the face across each edge of each triangle, using integer vertex-index edge keys
 
-    point -- A 3-element array-like data structure containing x,y,z coordinates
-    line_segments -- An array of Segments
-    """
-    min_dist, min_segs, distances, segments, common_endpoint = sys.maxint, [], [], [], None
-    for segment in line_segments:
-        proj_point = project(point, segment)
-        if on_line_segment(proj_point, segment):
-            dist = distance_between(point, proj_point)
-        else:
-            min_endpoint_distance = min(distance_between(proj_point, segment.endpoint_1), distance_between(proj_point, segment.endpoint_2))
-            dist = math.sqrt((distance_between(point, proj_point))**2 + (min_endpoint_distance)**2)
-        distances.append(dist)
-        segments.append(segment)
-        if dist < min_dist:
-            min_dist = dist
-
-    for i in range(len(distances)):
-        if min_dist + 0.000001 >= distances[i]:
-            min_segs.append(segments[i])
-    if len(min_segs) > 1:
-        for i in range(len(min_segs)):
-            seg_1 = min_segs[i]
-            for endpoint in [seg_1.endpoint_1, seg_1.endpoint_2]:
-                for seg_2 in min_segs[i+1:]:
-                    if endpoint in [seg_2.endpoint_1, seg_2.endpoint_2]:
-                        common_endpoint = endpoint
-                        break
-    return min_segs, common_endpoint
-
-
-def distance_between(point_1, point_2):
+    triangles -- num_faces x 3 integer array of vertex indices
+    neighbors -- num_faces x 3 integer array, entry (i, j) is the face sharing edge TRIANGLE_EDGES[j] with face i (-1 if none)
     """
-    Returns the distance between the two input points.
-
-    point_1 -- A 3-element array-like data structure containing x,y,z coordinates
-    point_2 -- Another 3-element array-like data structure containing x,y,z coordinates
+    num_faces = triangles.shape[0]
+    edges = np.sort(triangles[:, TRIANGLE_EDGES], axis=2).reshape(-1, 2)
+    keys = edges[:,0] * (triangles.max() + 1) + edges[:,1]
+    faces = np.repeat(np.arange(num_faces), 3)
+
+    # group edge slots with the same key, faces are in increasing order within each group
+    order = np.lexsort((faces, keys))
+    sorted_keys = keys[order]
+    _, group_starts, group_sizes = np.unique(sorted_keys, return_index=True, return_counts=True)
+
+    neighbors = -np.ones(3 * num_faces, dtype=np.int64)
+    pairs = group_starts[group_sizes == 2]
+    neighbors[order[pairs]] = faces[order[pairs + 1]]
+    neighbors[order[pairs + 1]] = faces[order[pairs]]
+
+    # non-manifold edges topple onto the last other face bordering the edge
+    for start, size in zip(group_starts[group_sizes > 2], group_sizes[group_sizes > 2]):
+        group = order[start:start + size]
+        for slot in group:
+            others = faces[group][faces[group] != faces[slot]]
+            neighbors[slot] = others[-1]
+    return neighbors.reshape(num_faces, 3)
+
+def compute_projected_areas(vertices, triangles, cm):
     """
-    return math.sqrt((point_1[0] - point_2[0])**2 + (point_1[1] - point_2[1])**2 + (point_1[2] - point_2[2])**2)
+    Projects each triangle onto the unit sphere around cm and computes the area of the projection (solid angle)
 
-
-def on_line_segment(point, segment):
-    """
-    Returns whether a point is on a line segment
-
-    In this case, we assume that point is on the line containing the input segment
-    
-    point -- a 3-element array containing x,y,z coordinates
-    segment -- a Segment object
+    vertices -- num_vertices x 3 array of vertex coordinates
+    triangles -- num_faces x 3 integer array of vertex indices
+    cm -- 3-element array representing the center of mass of the mesh being handled
     """
-    endpoint_1, endpoint_2 = segment.endpoint_1, segment.endpoint_2
-    if (point[0] >= endpoint_1[0] and point[0] <= endpoint_2[0]) or (point[0] <= endpoint_1[0] and point[0] >= endpoint_2[0]):
-        if (point[1] >= endpoint_1[1] and point[1] <= endpoint_2[1]) or (point[1] <= endpoint_1[1] and point[1] >= endpoint_2[1]):
-            if (point[2] >= endpoint_1[2] and point[2] <= endpoint_2[2]) or (point[2] <= endpoint_1[2] and point[2] >= endpoint_2[2]):
-                return True
-    return False
+    rays = vertices[triangles] - cm
+    rays = rays / np.linalg.norm(rays, axis=2)[:,:,np.newaxis]
+    a, b, c = rays[:,0,:], rays[:,1,:], rays[:,2,:]
 
+    # Van Oosterom and Strackee's formula, equivalent to L'Huilier's theorem on the spherical triangle
+    triple_product = np.abs(np.sum(a * np.cross(b, c), axis=1))
+    denom = 1 + np.sum(a * b, axis=1) + np.sum(b * c, axis=1) + np.sum(a * c, axis=1)
+    return 2 * np.arctan2(triple_product, denom)
 
-def project(point, segment):
-    """
-    Returns a 3-element array that is the projection of point onto the line containing segment
-    
-    point -- a 3-element array containing x,y,z coordinates
-    segment -- a Segment object
+def compute_topple_faces(vertices, triangles, neighbors, cm):
     """
-    x = np.linalg.norm(np.subtract(point, segment.endpoint_1))
-    y = np.linalg.norm(np.subtract(point, segment.endpoint_2))
-    z = np.linalg.norm(np.subtract(segment.endpoint_2, segment.endpoint_1))
-    scale_factor = 0.5*(z - ((x**2 - y**2) / z))
-    
-    return np.add(segment.endpoint_2, scale_factor * (np.subtract(segment.endpoint_1, segment.endpoint_2) / np.linalg.norm(np.subtract(segment.endpoint_1, segment.endpoint_2))))
-
+    Returns the face each face topples onto, or -1 if the projection of the center of mass lands inside the face
 
-class Segment:
+    vertices -- num_vertices x 3 array of vertex coordinates
+    triangles -- num_faces x 3 integer array of vertex indices
+    neighbors -- num_faces x 3 face adjacency from hull_edge_adjacency
+    cm -- 3-element array representing the center of mass of the mesh being handled
     """
-    Object representation of a finite line segment in 3D space
+    num_faces = triangles.shape[0]
+    tri_vertices = vertices[triangles]
+    p_0, p_1, p_2 = tri_vertices[:,0,:], tri_vertices[:,1,:], tri_vertices[:,2,:]
+
+    # projection of cm onto plane of each face
+    v_0 = p_2 - p_0
+    v_1 = p_1 - p_0
+    v_0 = v_0 / np.linalg.norm(v_0, axis=1)[:,np.newaxis]
+    v_1 = v_1 / np.linalg.norm(v_1, axis=1)[:,np.newaxis]
+    normals = np.cross(v_0, v_1)
+    normals = normals / np.linalg.norm(normals, axis=1)[:,np.newaxis]
+    dist = np.sum(normals * (cm - p_0), axis=1)
+    proj_cm = cm - dist[:,np.newaxis] * normals
+
+    # barycentric coordinates with respect to the normalized edge directions (adapted from http://www.blackpawn.com/texts/pointinpoly/)
+    v_2 = proj_cm - p_0
+    dot_00 = np.sum(v_0 * v_0, axis=1)
+    dot_01 = np.sum(v_0 * v_1, axis=1)
+    dot_02 = np.sum(v_0 * v_2, axis=1)
+    dot_11 = np.sum(v_1 * v_1, axis=1)
+    dot_12 = np.sum(v_1 * v_2, axis=1)
+    inv_denom = 1.0 / (dot_00 * dot_11 - dot_01 * dot_01)
+    u = (dot_11 * dot_02 - dot_01 * dot_12) * inv_denom
+    v = (dot_00 * dot_12 - dot_01 * dot_02) * inv_denom
+    proj_cm_in_triangle = (u >= 0) & (v >= 0) & (u + v < 1)
+
+    # distance from the projected cm to each edge segment
+    edge_starts = tri_vertices[:,TRIANGLE_EDGES[:,0],:]
+    edge_ends = tri_vertices[:,TRIANGLE_EDGES[:,1],:]
+    edge_dirs = edge_ends - edge_starts
+    t = np.sum((proj_cm[:,np.newaxis,:] - edge_starts) * edge_dirs, axis=2) / np.sum(edge_dirs**2, axis=2)
+    closest_pts = edge_starts + np.clip(t, 0, 1)[:,:,np.newaxis] * edge_dirs
+    edge_dists = np.linalg.norm(proj_cm[:,np.newaxis,:] - closest_pts, axis=2)
+
+    # topple over the closest edge, breaking near-ties consistently
+    ties = edge_dists <= np.min(edge_dists, axis=1)[:,np.newaxis] + 1e-6
+    tie_codes = ties[:,0] * 1 + ties[:,1] * 2 + ties[:,2] * 4
+    topple_edges = TOPPLE_EDGE_FOR_TIES[tie_codes]
+
+    topple_faces = neighbors[np.arange(num_faces), topple_edges]
+    topple_faces[proj_cm_in_triangle | (topple_edges < 0)] = -1
+    return topple_faces
+
+def propagate_probabilities(topple_faces, probabilities):
     """
+    Pushes the probability of each face onto the sink it eventually topples to, with path compression
 
-    def __init__(self, endpoint_1, endpoint_2):
-        """
-        Creates a Segment with given endpoints
-
-        endpoint_1 -- a 3-element array containing x,y,z coordinates
-        endpoint_2 -- a 3-element array containing x,y,z coordinates
-        """
-        self.endpoint_1 = endpoint_1
-        self.endpoint_2 = endpoint_2
-
-
-class Vertex:
-    """
-    Each face of the convex hull of a polyhedron is represented as a Vertex
-    in a directed acyclic graph
+    topple_faces -- num_faces integer array of the face each face topples onto (-1 for sinks)
+    probabilities -- num_faces array of the probability of landing on each face
+    sinks -- indices of the faces that collect probability
+    sink_probabilities -- the total probability of coming to rest on each sink
     """
-    marked = False
-
-    def __init__(self, probability, face, children=[]):
-        """
-        Create a Vertex with given probability and children
-        
-        probability -- float probability of toppling
-        children -- array of vertices pointed at by this vertex
-        """
-        self.probability = probability
-        self.children = []
-        self.parents = []
-        self.face = face
-        self.is_sink = True if not self.children else False
-        self.has_parent = False
-        self.num_parents = 0
-
-    def add_edge(self, child):
-        """
-        Connects this vertex to the input child vertex
-
-        child -- Vertex object
-        """
-        self.is_sink = False
-        self.children.append(child)
-        child.parents.append(self)
-        child.has_parent = True
-        child.num_parents += 1
-
-
+    num_faces = topple_faces.shape[0]
+    sink_of = -np.ones(num_faces, dtype=np.int64)
+    sink_of[topple_faces < 0] = np.nonzero(topple_faces < 0)[0]
+
+    for face in range(num_faces):
+        # walk until reaching a face with a known sink, stopping at cycles
+        path = []
+        on_path = set()
+        c = face
+        while sink_of[c] < 0 and c not in on_path:
+            path.append(c)
+            on_path.add(c)
+            c = topple_faces[c]
+
+        # faces on a cycle come to rest on themselves, faces leading into it rest on the first face visited twice
+        if sink_of[c] < 0:
+            cycle = path[path.index(c):]
+            sink_of[cycle] = cycle
+            path = path[:path.index(c)]
+        sink_of[path] = sink_of[c]
+
+    sinks, inverse = np.unique(sink_of, return_inverse=True)
+    sink_probabilities = np.bincount(inverse, weights=probabilities, minlength=sinks.shape[0])
+    return sinks, sink_probabilities
 
 def transform_meshes(path):
     """
@@ -369,5 +256,89 @@ def transform_meshes(path):
     f.write('###########################################################\n')
     f.write('\n')
 
+def topple_faces_loop(vertices, triangles, cm):
+    """
+    Reference for compute_topple_faces that checks one face at a time with the closest segment and tie rule of the
+    original implementation
 
-
+    vertices -- num_vertices x 3 array of vertex coordinates
+    triangles -- num_faces x 3 integer array of vertex indices
+    cm -- 3-element array representing the center of mass of the mesh being handled
+    """
+    edge_to_faces = {}
+    for i, triangle in enumerate(triangles):
+        for a, b in TRIANGLE_EDGES:
+            edge_to_faces.setdefault(frozenset([triangle[a], triangle[b]]), []).append(i)
+
+    topple_faces = []
+    for i, triangle in enumerate(triangles):
+        p = [vertices[j] for j in triangle]
+        v_0 = (p[2] - p[0]) / np.linalg.norm(p[2] - p[0])
+        v_1 = (p[1] - p[0]) / np.linalg.norm(p[1] - p[0])
+        normal = np.cross(v_0, v_1)
+        normal = normal / np.linalg.norm(normal)
+        proj_cm = cm - np.dot(normal, cm - p[0]) * normal
+
+        v_2 = proj_cm - p[0]
+        inv_denom = 1.0 / (np.dot(v_0, v_0) * np.dot(v_1, v_1) - np.dot(v_0, v_1)**2)
+        u = (np.dot(v_1, v_1) * np.dot(v_0, v_2) - np.dot(v_0, v_1) * np.dot(v_1, v_2)) * inv_denom
+        v = (np.dot(v_0, v_0) * np.dot(v_1, v_2) - np.dot(v_0, v_1) * np.dot(v_0, v_2)) * inv_denom
+        if u >= 0 and v >= 0 and u + v < 1:
+            topple_faces.append(-1)
+            continue
+
+        # closest segments, and the edge from their common endpoint to the next vertex on ties
+        dists = []
+        for a, b in TRIANGLE_EDGES:
+            t = np.clip(np.dot(proj_cm - p[a], p[b] - p[a]) / np.dot(p[b] - p[a], p[b] - p[a]), 0, 1)
+            dists.append(np.linalg.norm(proj_cm - (p[a] + t * (p[b] - p[a]))))
+        closest = [list(edge) for edge, dist in zip(TRIANGLE_EDGES, dists) if min(dists) + 1e-6 >= dist]
+        if len(closest) > 1:
+            for k, edge in enumerate(closest):
+                for endpoint in edge:
+                    for other in closest[k+1:]:
+                        if endpoint in other:
+                            common_endpoint = endpoint
+                            break
+            closest = [[common_endpoint, (common_endpoint + 1) % 3]]
+        a, b = closest[0]
+        topple_faces.append([face for face in edge_to_faces[frozenset([triangle[a], triangle[b]])] if face != i][-1])
+    return np.array(topple_faces)
+
+def test_stable_poses(mesh_filename='data/test/meshes/Co_clean.obj'):
+    ob = obj_file.ObjFile(mesh_filename)
+    m = ob.read()
+    m.remove_unreferenced_vertices()
+    convex_hull = m.convex_hull()
+    cm = m.vertex_mean_
+    vertices = np.array(convex_hull.vertices())
+    triangles = np.array(convex_hull.triangles(), dtype=np.int64)
+
+    # topple faces match the face by face loop
+    neighbors = hull_edge_adjacency(triangles)
+    topple_faces = compute_topple_faces(vertices, triangles, neighbors, cm)
+    assert np.array_equal(topple_faces, topple_faces_loop(vertices, triangles, cm))
+
+    # sinks match walking each face until it comes to rest or revisits a face
+    probabilities = compute_projected_areas(vertices, triangles, cm) / (4 * math.pi)
+    sinks, sink_probabilities = propagate_probabilities(topple_faces, probabilities)
+    expected_sinks = {}
+    for face in range(triangles.shape[0]):
+        c = face
+        visited = []
+        while topple_faces[c] >= 0 and c not in visited:
+            visited.append(c)
+            c = topple_faces[c]
+        expected_sinks[c] = expected_sinks.get(c, 0.0) + probabilities[face]
+    assert sorted(expected_sinks.keys()) == list(sinks)
+    assert np.allclose([expected_sinks[sink] for sink in sinks], sink_probabilities)
+
+    # the faces cover the sphere around the center of mass, so the poses account for all of the probability
+    prob_mapping = compute_stable_poses(m, convex_hull=convex_hull)
+    assert len(prob_mapping) == sinks.shape[0]
+    assert abs(sum(prob_mapping.values()) - 1.0) < 1e-6
+    logging.info('Stable poses test passed!')
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    test_stable_poses()
@@ -60,7 +60,8 @@ class StablePoseFile:
             mesh = ob.read()
             mesh.remove_unreferenced_vertices()
 
-            prob_mapping, cv_hull = st.compute_stable_poses(mesh), mesh.convex_hull()
+            cv_hull = mesh.convex_hull()
+            prob_mapping = st.compute_stable_poses(mesh, cv_hull)
             R_list = []
             for face, p in prob_mapping.items():
                 if p >= min_prob:
@@ -70,7 +71,8 @@ class StablePoseFile:
             self.write_mesh_stable_poses(mesh, filename, min_prob)
     
     def write_mesh_stable_poses(self, mesh, filename, min_prob=0, vis=False):
-        prob_mapping, cv_hull = st.compute_stable_poses(mesh), mesh.convex_hull()
+        cv_hull = mesh.convex_hull()
+        prob_mapping = st.compute_stable_poses(mesh, cv_hull)
         R_list = []
         for face, p in prob_mapping.items():
             if p >= min_prob: